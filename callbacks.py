@@ -0,0 +1,140 @@
+import inspect
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Type, Union
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.filters.callback_data import CallbackData
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.types import CallbackQuery
+
+CALLBACK_SEPARATOR = ':'
+
+class PickTemplate(CallbackData, prefix='tm'):
+    template_id: int
+
+class TemplatesPage(CallbackData, prefix='tp'):
+    page: int
+    for_selection: bool
+
+class SelectTemplate(CallbackData, prefix='ts'):
+    template_id: int
+
+class EditTemplate(CallbackData, prefix='te'):
+    template_id: int
+
+class EditTemplateName(CallbackData, prefix='ten'):
+    template_id: int
+
+class EditTemplateText(CallbackData, prefix='tet'):
+    template_id: int
+
+class EditTemplateBoth(CallbackData, prefix='teb'):
+    template_id: int
+
+class DeleteTemplate(CallbackData, prefix='td'):
+    template_id: int
+
+class ConfirmDeleteTemplate(CallbackData, prefix='tdc'):
+    template_id: int
+
+class SelectReceiverList(CallbackData, prefix='ls'):
+    list_id: int
+
+class AddToReceiverList(CallbackData, prefix='la'):
+    list_id: int
+
+class EditReceiverList(CallbackData, prefix='le'):
+    list_id: int
+
+class DeleteReceiverList(CallbackData, prefix='ld'):
+    list_id: int
+
+class ConfirmDeleteReceiverList(CallbackData, prefix='ldc'):
+    list_id: int
+
+class ManageReceivers(CallbackData, prefix='lm'):
+    list_id: int
+    page: int = 0
+
+class DeleteReceiver(CallbackData, prefix='rd'):
+    receiver_id: int
+
+class Delay(CallbackData, prefix='dl'):
+    seconds: int
+
+class MaxRecipients(CallbackData, prefix='mx'):
+    count: int
+
+class ConfirmMailing(CallbackData, prefix='mc'):
+    campaign_id: int
+
+class SelectBotGroup(CallbackData, prefix='gb'):
+    chat_id: int
+
+class SelectGroup(CallbackData, prefix='gu'):
+    group_id: int
+
+class ViewCampaign(CallbackData, prefix='cv'):
+    campaign_id: int
+
+class CampaignsPage(CallbackData, prefix='cp'):
+    page: int
+
+class ReportPage(CallbackData, prefix='rp'):
+    campaign_id: int
+    after_id: int
+
+class ReportCsv(CallbackData, prefix='rc'):
+    campaign_id: int
+
+class SendDuplicates(CallbackData, prefix='ds'):
+    campaign_id: int
+
+class SkipDuplicates(CallbackData, prefix='dk'):
+    campaign_id: int
+
+CallbackHandler = Callable[..., Awaitable]
+Route = Tuple[Optional[Type[CallbackData]], CallbackHandler, Tuple[str, ...]]
+
+class CallbackRegistry:
+    def __init__(self):
+        self._routes: Dict[str, Dict[Optional[str], Route]] = {}
+
+    def route(self, key: Union[str, Type[CallbackData]], state: Optional[State]=None):
+        if isinstance(key, str):
+            route_key, callback_data_type = key, None
+        else:
+            route_key, callback_data_type = key.__prefix__, key
+        if CALLBACK_SEPARATOR in route_key:
+            raise ValueError(f'Ключ callback {route_key!r} не должен содержать разделитель')
+        state_name = state.state if state is not None else None
+
+        def decorator(handler: CallbackHandler) -> CallbackHandler:
+            routes = self._routes.setdefault(route_key, {})
+            if state_name in routes:
+                raise ValueError(f'Callback {route_key!r} уже зарегистрирован для состояния {state_name}')
+            params = tuple(inspect.signature(handler).parameters)[1:]
+            routes[state_name] = (callback_data_type, handler, params)
+            return handler
+        return decorator
+
+    def resolve(self, payload: str, state_name: Optional[str]) -> Optional[Route]:
+        routes = self._routes.get(payload.split(CALLBACK_SEPARATOR, 1)[0])
+        if not routes:
+            return None
+        return routes.get(state_name) or routes.get(None)
+
+    async def dispatch(self, callback: CallbackQuery, state: FSMContext, **data):
+        payload = callback.data or ''
+        route = self.resolve(payload, await state.get_state())
+        if route is None:
+            raise SkipHandler()
+        callback_data_type, handler, params = route
+        available = dict(data, state=state)
+        if callback_data_type is not None:
+            try:
+                available['callback_data'] = callback_data_type.unpack(payload)
+            except (TypeError, ValueError):
+                raise SkipHandler()
+        return await handler(callback, **{name: available[name] for name in params if name in available})
+
+callback_registry = CallbackRegistry()
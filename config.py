@@ -7,7 +7,42 @@ API_HASH = os.getenv('API_HASH', '')
 PHONE_NUMBER = os.getenv('PHONE_NUMBER', '')
 MAIN_ADMIN_ID = int(os.getenv('MAIN_ADMIN_ID', '0'))
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite+aiosqlite:///bot.db')
+DATABASE_READ_URL = os.getenv('DATABASE_READ_URL', '')
 MIN_DELAY_SECONDS = 300
 MAX_DELAY_SECONDS = 660
 LOG_FILE = 'bot.log'
 LOG_LEVEL = 'INFO'
+SUMMARY_REPORT_CONCURRENCY = int(os.getenv('SUMMARY_REPORT_CONCURRENCY', '5'))
+SUMMARY_REPORT_MESSAGES_PER_SECOND = float(os.getenv('SUMMARY_REPORT_MESSAGES_PER_SECOND', '25'))
+MEDIA_CACHE_DIR = os.getenv('MEDIA_CACHE_DIR', 'media_cache')
+CAMPAIGN_EXECUTION = os.getenv('CAMPAIGN_EXECUTION', 'inline')
+CAMPAIGN_LEASE_SECONDS = int(os.getenv('CAMPAIGN_LEASE_SECONDS', '120'))
+CAMPAIGN_WORKER_CONCURRENCY = int(os.getenv('CAMPAIGN_WORKER_CONCURRENCY', '2'))
+CAMPAIGN_WORKER_POLL_SECONDS = int(os.getenv('CAMPAIGN_WORKER_POLL_SECONDS', '5'))
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = int(os.getenv('WEBAPP_PORT', os.getenv('PORT', '8080')))
+WEBHOOK_DRAIN_SECONDS = int(os.getenv('WEBHOOK_DRAIN_SECONDS', '25'))
+WEBHOOK_HEALTH_GRACE_SECONDS = int(os.getenv('WEBHOOK_HEALTH_GRACE_SECONDS', '10'))
+HISTORY_RETENTION_DAYS = int(os.getenv('HISTORY_RETENTION_DAYS', '0'))
+HISTORY_ARCHIVE_DIR = os.getenv('HISTORY_ARCHIVE_DIR', 'history_archive')
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '1000'))
+RETENTION_LEASE_SECONDS = int(os.getenv('RETENTION_LEASE_SECONDS', '600'))
+RETENTION_VACUUM_PAGES = int(os.getenv('RETENTION_VACUUM_PAGES', '1000'))
+PROGRESS_UPDATE_SECONDS = int(os.getenv('PROGRESS_UPDATE_SECONDS', '20'))
+PROGRESS_UPDATE_RECIPIENTS = int(os.getenv('PROGRESS_UPDATE_RECIPIENTS', '25'))
+RECEIVERS_PAGE_SIZE = int(os.getenv('RECEIVERS_PAGE_SIZE', '20'))
+SLOW_UPDATE_SECONDS = float(os.getenv('SLOW_UPDATE_SECONDS', '1.0'))
+HANDLER_METRICS_WINDOW = int(os.getenv('HANDLER_METRICS_WINDOW', '1000'))
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '0.5'))
+LOOP_BLOCK_SECONDS = float(os.getenv('LOOP_BLOCK_SECONDS', '0.5'))
+LOOP_DEBUG = os.getenv('LOOP_DEBUG', '').lower() in ('1', 'true', 'yes')
+SLOW_QUERY_SECONDS = float(os.getenv('SLOW_QUERY_SECONDS', '0.2'))
+GROUP_REGISTRY_FLUSH_SECONDS = float(os.getenv('GROUP_REGISTRY_FLUSH_SECONDS', '2.0'))
+GROUP_MEMBERS_COUNT_TTL = int(os.getenv('GROUP_MEMBERS_COUNT_TTL', '3600'))
+REPORT_CACHE_SIZE = int(os.getenv('REPORT_CACHE_SIZE', '256'))
+PROFILING_TRACE_FRAMES = int(os.getenv('PROFILING_TRACE_FRAMES', '1'))
+MEDIA_BRIDGE_FAILURE_TTL = int(os.getenv('MEDIA_BRIDGE_FAILURE_TTL', '600'))
@@ -1,14 +1,15 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, Index, func
+from typing import NamedTuple, Optional, Tuple
+from sqlalchemy import Column, Integer, SmallInteger, BigInteger, String, Text, Boolean, DateTime, ForeignKey, Index, event, func
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
-from config import DATABASE_URL
+from config import DATABASE_URL, DATABASE_READ_URL, CAMPAIGN_EXECUTION
 Base = declarative_base()
 
 class User(Base):
     __tablename__ = 'users'
     id = Column(Integer, primary_key=True)
-    telegram_id = Column(Integer, unique=True, nullable=False, index=True)
+    telegram_id = Column(BigInteger, unique=True, nullable=False, index=True)
     username = Column(String(255), nullable=True)
     first_name = Column(String(255), nullable=True)
     last_name = Column(String(255), nullable=True)
@@ -26,7 +27,7 @@ class Template(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String(255), nullable=False)
     text = Column(Text, nullable=False)
-    created_by = Column(Integer, ForeignKey('users.telegram_id'), nullable=False)
+    created_by = Column(BigInteger, ForeignKey('users.telegram_id'), nullable=False)
     created_at = Column(DateTime, default=func.now())
     is_active = Column(Boolean, default=True)
     media_type = Column(String(50), nullable=True)
@@ -38,7 +39,7 @@ class MailingCampaign(Base):
     __tablename__ = 'mailing_campaigns'
     id = Column(Integer, primary_key=True)
     campaign_id = Column(String(50), unique=True, nullable=False, index=True)
-    owner_id = Column(Integer, ForeignKey('users.telegram_id'), nullable=False)
+    owner_id = Column(BigInteger, ForeignKey('users.telegram_id'), nullable=False)
     template_id = Column(Integer, ForeignKey('templates.id'), nullable=False)
     status = Column(String(50), default='pending')
     started_at = Column(DateTime, nullable=True)
@@ -49,35 +50,54 @@ class MailingCampaign(Base):
     duplicates_count = Column(Integer, default=0)
     delay_seconds = Column(Integer, default=5)
     max_recipients = Column(Integer, nullable=True)
+    lease_owner = Column(String(100), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=func.now())
     owner = relationship('User', back_populates='campaigns')
     template = relationship('Template', back_populates='campaigns')
     recipients = relationship('Recipient', back_populates='campaign', cascade='all, delete-orphan')
     sending_history = relationship('SendingHistory', back_populates='campaign', cascade='all, delete-orphan')
+    __table_args__ = (Index('ix_mailing_campaigns_created_at', 'created_at'), Index('ix_mailing_campaigns_owner_created', 'owner_id', 'created_at'), Index('ix_mailing_campaigns_status_lease', 'status', 'lease_expires_at'))
 
 class Recipient(Base):
     __tablename__ = 'recipients'
     id = Column(Integer, primary_key=True)
     campaign_id = Column(Integer, ForeignKey('mailing_campaigns.id'), nullable=False)
     recipient_identifier = Column(String(255), nullable=False)
-    normalized_identifier = Column(String(255), nullable=False, index=True)
+    normalized_identifier = Column(String(255), nullable=False)
     is_duplicate = Column(Boolean, default=False)
     previous_campaign_id = Column(Integer, nullable=True)
     created_at = Column(DateTime, default=func.now())
     campaign = relationship('MailingCampaign', back_populates='recipients')
-    __table_args__ = (Index('idx_template_recipient', 'normalized_identifier'),)
+    __table_args__ = (Index('idx_template_recipient', 'normalized_identifier'), Index('ix_recipients_campaign_duplicate', 'campaign_id', 'is_duplicate'))
+
+class ErrorType(Base):
+    __tablename__ = 'error_types'
+    id = Column(SmallInteger, primary_key=True, autoincrement=False)
+    code = Column(String(100), unique=True, nullable=False)
+    message = Column(Text, nullable=True)
 
 class SendingHistory(Base):
     __tablename__ = 'sending_history'
     id = Column(Integer, primary_key=True)
     campaign_id = Column(Integer, ForeignKey('mailing_campaigns.id'), nullable=False)
-    recipient_identifier = Column(String(255), nullable=False)
+    recipient_id = Column(Integer, ForeignKey('recipients.id'), nullable=True)
     success = Column(Boolean, nullable=False)
-    error_type = Column(String(100), nullable=True)
+    error_code = Column(SmallInteger, ForeignKey('error_types.id'), nullable=True)
     error_details = Column(Text, nullable=True)
     telegram_message_id = Column(Integer, nullable=True)
     sent_at = Column(DateTime, default=func.now())
     campaign = relationship('MailingCampaign', back_populates='sending_history')
+    __table_args__ = (Index('ix_sending_history_campaign_sent', 'campaign_id', 'sent_at'), Index('ix_sending_history_recipient', 'recipient_id'), Index('ix_sending_history_sent_at', 'sent_at'))
+
+class DeliveryLedger(Base):
+    __tablename__ = 'delivery_ledger'
+    id = Column(Integer, primary_key=True)
+    template_id = Column(Integer, ForeignKey('templates.id'), nullable=False)
+    normalized_identifier = Column(String(255), nullable=False)
+    campaign_id = Column(Integer, ForeignKey('mailing_campaigns.id'), nullable=False)
+    delivered_at = Column(DateTime, default=func.now())
+    __table_args__ = (Index('uq_delivery_ledger_template_identifier', 'template_id', 'normalized_identifier', unique=True),)
 
 class ReportReceiverList(Base):
     __tablename__ = 'report_receiver_lists'
@@ -94,15 +114,16 @@ class ReportReceiver(Base):
     list_id = Column(Integer, ForeignKey('report_receiver_lists.id'), nullable=False)
     identifier = Column(String(255), nullable=False)
     identifier_type = Column(String(20), nullable=False)
-    telegram_id = Column(Integer, nullable=True)
+    telegram_id = Column(BigInteger, nullable=True)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=func.now())
     list = relationship('ReportReceiverList', back_populates='receivers')
+    __table_args__ = (Index('uq_report_receivers_list_identifier', 'list_id', 'identifier', unique=True), Index('ix_report_receivers_identifier', 'identifier'))
 
 class BotGroup(Base):
     __tablename__ = 'bot_groups'
     id = Column(Integer, primary_key=True)
-    chat_id = Column(Integer, unique=True, nullable=False, index=True)
+    chat_id = Column(BigInteger, unique=True, nullable=False, index=True)
     title = Column(String(255), nullable=True)
     username = Column(String(255), nullable=True)
     chat_type = Column(String(50), nullable=False)
@@ -110,41 +131,140 @@ class BotGroup(Base):
     members_count = Column(Integer, nullable=True)
     added_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+class JobLease(Base):
+    __tablename__ = 'job_leases'
+    name = Column(String(100), primary_key=True)
+    lease_owner = Column(String(100), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+class PlanRecipient(NamedTuple):
+    id: int
+    identifier: str
+    normalized: str
+
+class CampaignPlan(NamedTuple):
+    id: int
+    campaign_id: str
+    owner_id: int
+    delay_seconds: Optional[int]
+    max_recipients: Optional[int]
+    template_id: int
+    template_text: str
+    media_type: Optional[str]
+    media_file_id: Optional[str]
+    media_file_unique_id: Optional[str]
+    recipients: Tuple[PlanRecipient, ...]
 engine = create_async_engine(DATABASE_URL, echo=False)
 async_session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+read_engine = create_async_engine(DATABASE_READ_URL or DATABASE_URL, echo=False)
+read_session_maker = async_sessionmaker(read_engine, class_=AsyncSession, expire_on_commit=False)
+ENGINES = (engine, read_engine)
+
+@event.listens_for(engine.sync_engine, 'connect')
+def _sqlite_wal(dbapi_connection, connection_record):
+    if engine.dialect.name == 'sqlite':
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.close()
+
+@event.listens_for(read_engine.sync_engine, 'connect')
+def _sqlite_query_only(dbapi_connection, connection_record):
+    if read_engine.dialect.name == 'sqlite':
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA query_only=ON')
+        cursor.close()
 
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    await seed_error_types()
 
 async def close_db():
     await engine.dispose()
-from datetime import datetime
-from typing import Optional, List, Dict
-from sqlalchemy import select, func, and_, or_
+    await read_engine.dispose()
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional, List, Dict, Tuple
+from sqlalchemy import select, insert, update, delete, bindparam, case, func, and_, or_
 from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
 import uuid
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+class UnitOfWork:
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self.task = asyncio.current_task()
+_unit_of_work: ContextVar[Optional[UnitOfWork]] = ContextVar('unit_of_work', default=None)
+
+def _current_unit_of_work() -> Optional[UnitOfWork]:
+    unit = _unit_of_work.get()
+    return unit if unit is not None and unit.task is asyncio.current_task() else None
+
+@asynccontextmanager
+async def unit_of_work() -> AsyncIterator[AsyncSession]:
+    unit = _current_unit_of_work()
+    if unit is not None:
+        yield unit.session
+        return
+    async with async_session_maker() as session:
+        unit = UnitOfWork(session)
+        token = _unit_of_work.set(unit)
+        try:
+            yield session
+            await session.commit()
+        except BaseException:
+            await session.rollback()
+            raise
+        finally:
+            _unit_of_work.reset(token)
+
+@asynccontextmanager
+async def get_session() -> AsyncIterator[AsyncSession]:
+    unit = _current_unit_of_work()
+    if unit is not None:
+        yield unit.session
+        return
+    async with async_session_maker() as session:
+        yield session
+
+@asynccontextmanager
+async def get_read_session() -> AsyncIterator[AsyncSession]:
+    unit = _current_unit_of_work()
+    if unit is not None:
+        yield unit.session
+        return
+    async with read_session_maker() as session:
+        yield session
+
+async def _commit(session: AsyncSession):
+    unit = _current_unit_of_work()
+    if unit is not None and unit.session is session:
+        await session.flush()
+    else:
+        await session.commit()
 
 async def get_or_create_user(telegram_id: int, username: Optional[str]=None, first_name: Optional[str]=None, last_name: Optional[str]=None) -> User:
-    async with async_session_maker() as session:
+    async with get_session() as session:
         result = await session.execute(select(User).where(User.telegram_id == telegram_id))
         user = result.scalar_one_or_none()
         if not user:
             user = User(telegram_id=telegram_id, username=username, first_name=first_name, last_name=last_name)
             session.add(user)
-            await session.commit()
+            await _commit(session)
             await session.refresh(user)
         else:
             user.username = username
             user.first_name = first_name
             user.last_name = last_name
             user.updated_at = datetime.now()
-            await session.commit()
+            await _commit(session)
             await session.refresh(user)
         return user
 
 async def update_user_client_auth(telegram_id: int, api_id: Optional[int]=None, api_hash: Optional[str]=None, phone_number: Optional[str]=None, has_auth: bool=True) -> User:
-    async with async_session_maker() as session:
+    async with get_session() as session:
         result = await session.execute(select(User).where(User.telegram_id == telegram_id))
         user = result.scalar_one_or_none()
         if not user:
@@ -157,35 +277,35 @@ async def update_user_client_auth(telegram_id: int, api_id: Optional[int]=None,
             user.phone_number = phone_number
         user.has_client_auth = has_auth
         user.updated_at = datetime.now()
-        await session.commit()
+        await _commit(session)
         await session.refresh(user)
         return user
 
 async def get_user_by_telegram_id(telegram_id: int) -> Optional[User]:
-    async with async_session_maker() as session:
+    async with get_session() as session:
         result = await session.execute(select(User).where(User.telegram_id == telegram_id))
         return result.scalar_one_or_none()
 
 async def create_template(name: str, text: str, created_by: int, media_type: Optional[str]=None, media_file_id: Optional[str]=None, media_file_unique_id: Optional[str]=None) -> Template:
-    async with async_session_maker() as session:
+    async with get_session() as session:
         template = Template(name=name, text=text, created_by=created_by, media_type=media_type, media_file_id=media_file_id, media_file_unique_id=media_file_unique_id)
         session.add(template)
-        await session.commit()
+        await _commit(session)
         await session.refresh(template)
         return template
 
 async def get_template(template_id: int) -> Optional[Template]:
-    async with async_session_maker() as session:
+    async with get_session() as session:
         result = await session.execute(select(Template).where(Template.id == template_id))
         return result.scalar_one_or_none()
 
 async def get_all_active_templates() -> List[Template]:
-    async with async_session_maker() as session:
+    async with get_session() as session:
         result = await session.execute(select(Template).where(Template.is_active == True).order_by(Template.created_at.desc()))
         return list(result.scalars().all())
 
 async def update_template(template_id: int, name: Optional[str]=None, text: Optional[str]=None, media_type: Optional[str]=None, media_file_id: Optional[str]=None, media_file_unique_id: Optional[str]=None) -> Optional[Template]:
-    async with async_session_maker() as session:
+    async with get_session() as session:
         result = await session.execute(select(Template).where(Template.id == template_id))
         template = result.scalar_one_or_none()
         if not template:
@@ -200,46 +320,46 @@ async def update_template(template_id: int, name: Optional[str]=None, text: Opti
             template.media_file_id = media_file_id
         if media_file_unique_id is not None:
             template.media_file_unique_id = media_file_unique_id
-        await session.commit()
+        await _commit(session)
         await session.refresh(template)
         return template
 
 async def delete_template(template_id: int) -> bool:
-    async with async_session_maker() as session:
+    async with get_session() as session:
         result = await session.execute(select(Template).where(Template.id == template_id))
         template = result.scalar_one_or_none()
         if not template:
             return False
         template.is_active = False
-        await session.commit()
+        await _commit(session)
         return True
 
 async def create_campaign(owner_id: int, template_id: int, delay_seconds: int=5, max_recipients: Optional[int]=None) -> MailingCampaign:
-    async with async_session_maker() as session:
+    async with get_session() as session:
         campaign_id = f'MAIL-{uuid.uuid4().hex[:8].upper()}'
         campaign = MailingCampaign(campaign_id=campaign_id, owner_id=owner_id, template_id=template_id, status='pending', delay_seconds=delay_seconds, max_recipients=max_recipients)
         session.add(campaign)
-        await session.commit()
+        await _commit(session)
         await session.refresh(campaign)
         return campaign
 
 async def get_campaign(campaign_id: int) -> Optional[MailingCampaign]:
-    async with async_session_maker() as session:
+    async with get_session() as session:
         result = await session.execute(select(MailingCampaign).where(MailingCampaign.id == campaign_id))
         return result.scalar_one_or_none()
 
 async def get_campaign_by_campaign_id(campaign_id: str) -> Optional[MailingCampaign]:
-    async with async_session_maker() as session:
+    async with get_session() as session:
         result = await session.execute(select(MailingCampaign).where(MailingCampaign.campaign_id == campaign_id))
         return result.scalar_one_or_none()
 
 async def get_user_campaigns(owner_id: int, limit: int=20) -> List[MailingCampaign]:
-    async with async_session_maker() as session:
+    async with get_read_session() as session:
         result = await session.execute(select(MailingCampaign).where(MailingCampaign.owner_id == owner_id).order_by(MailingCampaign.created_at.desc()).limit(limit))
         return list(result.scalars().all())
 
 async def update_campaign_status(campaign_id: int, status: str, started_at: Optional[datetime]=None, completed_at: Optional[datetime]=None):
-    async with async_session_maker() as session:
+    async with get_session() as session:
         result = await session.execute(select(MailingCampaign).where(MailingCampaign.id == campaign_id))
         campaign = result.scalar_one_or_none()
         if campaign:
@@ -248,10 +368,10 @@ async def update_campaign_status(campaign_id: int, status: str, started_at: Opti
                 campaign.started_at = started_at
             if completed_at:
                 campaign.completed_at = completed_at
-            await session.commit()
+            await _commit(session)
 
 async def update_campaign_stats(campaign_id: int, total: int, sent: int, failed: int, duplicates: int):
-    async with async_session_maker() as session:
+    async with get_session() as session:
         result = await session.execute(select(MailingCampaign).where(MailingCampaign.id == campaign_id))
         campaign = result.scalar_one_or_none()
         if campaign:
@@ -259,68 +379,263 @@ async def update_campaign_stats(campaign_id: int, total: int, sent: int, failed:
             campaign.sent_successfully = sent
             campaign.sent_failed = failed
             campaign.duplicates_count = duplicates
-            await session.commit()
-
-async def add_recipients(campaign_id: int, recipients: List[Dict]) -> List[Recipient]:
-    async with async_session_maker() as session:
-        recipient_objects = []
-        for rec in recipients:
-            recipient = Recipient(campaign_id=campaign_id, recipient_identifier=rec['original'], normalized_identifier=rec['normalized'])
-            recipient_objects.append(recipient)
-            session.add(recipient)
-        await session.commit()
-        return recipient_objects
+            await _commit(session)
+
+async def queue_campaign(campaign_id: int):
+    await update_campaign_status(campaign_id, 'queued')
+
+def _claimable_campaign(now: datetime):
+    stale = MailingCampaign.lease_expires_at < now
+    if CAMPAIGN_EXECUTION == 'worker':
+        stale = or_(stale, MailingCampaign.lease_expires_at.is_(None))
+    return or_(MailingCampaign.status == 'queued', and_(MailingCampaign.status == 'processing', stale))
+
+async def claim_campaign(lease_owner: str, lease_seconds: int) -> Optional[int]:
+    now = datetime.now()
+    async with get_session() as session:
+        busy_owners = select(MailingCampaign.owner_id).where(and_(MailingCampaign.status == 'processing', MailingCampaign.lease_expires_at >= now)).subquery()
+        owner_not_busy = MailingCampaign.owner_id.not_in(select(busy_owners.c.owner_id))
+        result = await session.execute(select(MailingCampaign.id, MailingCampaign.owner_id).where(and_(_claimable_campaign(now), owner_not_busy)).order_by(MailingCampaign.id).limit(10))
+        for campaign_id, owner_id in result.all():
+            await session.execute(select(User.id).where(User.telegram_id == owner_id).with_for_update())
+            claimed = await session.execute(update(MailingCampaign).where(and_(MailingCampaign.id == campaign_id, _claimable_campaign(now), owner_not_busy)).values(status='processing', lease_owner=lease_owner, lease_expires_at=now + timedelta(seconds=lease_seconds)).execution_options(synchronize_session=False))
+            await _commit(session)
+            if claimed.rowcount == 1:
+                return campaign_id
+        return None
+
+async def renew_campaign_lease(campaign_id: int, lease_owner: str, lease_seconds: int) -> bool:
+    async with get_session() as session:
+        result = await session.execute(update(MailingCampaign).where(and_(MailingCampaign.id == campaign_id, MailingCampaign.lease_owner == lease_owner)).values(lease_expires_at=datetime.now() + timedelta(seconds=lease_seconds)).execution_options(synchronize_session=False))
+        await _commit(session)
+        return result.rowcount == 1
+
+async def release_campaign_lease(campaign_id: int, lease_owner: str, status: Optional[str]=None):
+    values = {'lease_owner': None, 'lease_expires_at': None}
+    if status is not None:
+        values['status'] = case((MailingCampaign.status == 'processing', status), else_=MailingCampaign.status)
+    async with get_session() as session:
+        await session.execute(update(MailingCampaign).where(and_(MailingCampaign.id == campaign_id, MailingCampaign.lease_owner == lease_owner)).values(values).execution_options(synchronize_session=False))
+        await _commit(session)
+
+async def acquire_job_lease(name: str, lease_owner: str, lease_seconds: int) -> bool:
+    now = datetime.now()
+    table = JobLease.__table__
+    async with get_session() as session:
+        await session.execute(_insert_ignore(table).values(name=name))
+        result = await session.execute(update(table).where(and_(table.c.name == name, or_(table.c.lease_owner.is_(None), table.c.lease_owner == lease_owner, table.c.lease_expires_at < now))).values(lease_owner=lease_owner, lease_expires_at=now + timedelta(seconds=lease_seconds)))
+        await _commit(session)
+        return result.rowcount == 1
+
+async def release_job_lease(name: str, lease_owner: str):
+    table = JobLease.__table__
+    async with get_session() as session:
+        await session.execute(update(table).where(and_(table.c.name == name, table.c.lease_owner == lease_owner)).values(lease_owner=None, lease_expires_at=None))
+        await _commit(session)
+
+async def get_campaign_progress(campaign_id: int) -> Dict:
+    async with get_session() as session:
+        result = await session.execute(select(SendingHistory.recipient_id, SendingHistory.success, ErrorType.code).outerjoin(ErrorType, SendingHistory.error_code == ErrorType.id).where(SendingHistory.campaign_id == campaign_id))
+        progress = {'processed': set(), 'sent': 0, 'failed': 0, 'duplicates': 0}
+        for recipient_id, success, error_type in result.all():
+            progress['processed'].add(recipient_id)
+            if success:
+                progress['sent'] += 1
+            elif error_type == 'duplicate':
+                progress['duplicates'] += 1
+            else:
+                progress['failed'] += 1
+        return progress
+
+async def add_recipients(campaign_id: int, recipients: List[Dict]) -> int:
+    if not recipients:
+        return 0
+    async with get_session() as session:
+        await session.execute(insert(Recipient), [{'campaign_id': campaign_id, 'recipient_identifier': rec['original'], 'normalized_identifier': rec['normalized']} for rec in recipients])
+        await _commit(session)
+        return len(recipients)
+
+async def load_campaign_plan(campaign_id: int) -> Optional[CampaignPlan]:
+    async with get_session() as session:
+        result = await session.execute(select(MailingCampaign.id, MailingCampaign.campaign_id, MailingCampaign.owner_id, MailingCampaign.delay_seconds, MailingCampaign.max_recipients, Template.id, Template.text, Template.media_type, Template.media_file_id, Template.media_file_unique_id).join(Template, MailingCampaign.template_id == Template.id).where(MailingCampaign.id == campaign_id))
+        campaign = result.one_or_none()
+        if campaign is None:
+            return None
+        result = await session.execute(select(Recipient.id, Recipient.recipient_identifier, Recipient.normalized_identifier).where(Recipient.campaign_id == campaign_id).order_by(Recipient.id))
+        recipients = tuple((PlanRecipient(*row) for row in result.all()))
+    return CampaignPlan(*campaign, recipients)
 
 async def check_duplicate(template_id: int, normalized_identifier: str) -> Optional[Dict]:
-    async with async_session_maker() as session:
-        result = await session.execute(select(SendingHistory, MailingCampaign).join(MailingCampaign, SendingHistory.campaign_id == MailingCampaign.id).where(and_(MailingCampaign.template_id == template_id, SendingHistory.recipient_identifier == normalized_identifier, SendingHistory.success == True)).order_by(SendingHistory.sent_at.desc()).limit(1))
+    async with get_session() as session:
+        result = await session.execute(select(DeliveryLedger.campaign_id, DeliveryLedger.delivered_at, MailingCampaign.campaign_id).join(MailingCampaign, DeliveryLedger.campaign_id == MailingCampaign.id).where(and_(DeliveryLedger.template_id == template_id, DeliveryLedger.normalized_identifier == normalized_identifier)))
         row = result.first()
         if row:
-            history, campaign = row
-            return {'is_duplicate': True, 'previous_campaign_id': campaign.id, 'previous_time': history.sent_at, 'campaign_id': campaign.campaign_id}
+            return {'is_duplicate': True, 'previous_campaign_id': row[0], 'previous_time': row[1], 'campaign_id': row[2]}
         return {'is_duplicate': False}
 
+async def record_delivery(template_id: int, normalized_identifier: str, campaign_id: int):
+    async with get_session() as session:
+        table = DeliveryLedger.__table__
+        result = await session.execute(update(table).where(and_(table.c.template_id == template_id, table.c.normalized_identifier == normalized_identifier)).values(campaign_id=campaign_id, delivered_at=datetime.now()))
+        if not result.rowcount:
+            await session.execute(_insert_ignore(table).values(template_id=template_id, normalized_identifier=normalized_identifier, campaign_id=campaign_id, delivered_at=datetime.now()))
+        await _commit(session)
+
+async def claim_delivery(template_id: int, normalized_identifier: str, campaign_id: int) -> Optional[Dict]:
+    async with get_session() as session:
+        table = DeliveryLedger.__table__
+        result = await session.execute(_insert_ignore(table).values(template_id=template_id, normalized_identifier=normalized_identifier, campaign_id=campaign_id, delivered_at=datetime.now()))
+        if result.rowcount:
+            await _commit(session)
+            return None
+        row = (await session.execute(select(DeliveryLedger.campaign_id, DeliveryLedger.delivered_at, MailingCampaign.campaign_id).join(MailingCampaign, DeliveryLedger.campaign_id == MailingCampaign.id).where(and_(DeliveryLedger.template_id == template_id, DeliveryLedger.normalized_identifier == normalized_identifier)))).first()
+        if row is None:
+            return None
+        return {'is_duplicate': True, 'previous_campaign_id': row[0], 'previous_time': row[1], 'campaign_id': row[2]}
+
+async def release_delivery(template_id: int, normalized_identifier: str, campaign_id: int):
+    async with get_session() as session:
+        table = DeliveryLedger.__table__
+        await session.execute(delete(table).where(and_(table.c.template_id == template_id, table.c.normalized_identifier == normalized_identifier, table.c.campaign_id == campaign_id)))
+        await _commit(session)
+
 async def mark_recipient_as_duplicate(recipient_id: int, previous_campaign_id: int):
-    async with async_session_maker() as session:
+    async with get_session() as session:
         result = await session.execute(select(Recipient).where(Recipient.id == recipient_id))
         recipient = result.scalar_one_or_none()
         if recipient:
             recipient.is_duplicate = True
             recipient.previous_campaign_id = previous_campaign_id
-            await session.commit()
-
-async def add_sending_history(campaign_id: int, recipient_identifier: str, success: bool, error_type: Optional[str]=None, error_details: Optional[str]=None, telegram_message_id: Optional[int]=None):
-    async with async_session_maker() as session:
-        history = SendingHistory(campaign_id=campaign_id, recipient_identifier=recipient_identifier, success=success, error_type=error_type, error_details=error_details, telegram_message_id=telegram_message_id)
+            await _commit(session)
+
+ERROR_MESSAGES = {'blocked': 'пользователь заблокировал бота', 'invalid_user': 'пользователь не найден или не начинал диалог с ботом', 'deleted': 'аккаунт удален', 'privacy': 'ограничения приватности', 'rate_limit': 'превышен лимит сообщений', 'technical': 'техническая ошибка', 'unknown': 'неизвестная ошибка', 'not_participant': 'вы не участник группы или канала, присоединитесь к ней перед отправкой сообщений', 'admin_required': 'нужны права администратора для отправки сообщений в эту группу или канал', 'private_chat': 'приватная группа или канал, используйте invite-ссылку для присоединения или убедитесь, что вы участник', 'peer_flood': 'аккаунт временно ограничен Telegram (PEER_FLOOD), увеличьте интервал между сообщениями (минимум 15-30 секунд) или подождите 1-2 часа перед следующей рассылкой', 'invalid_invite': 'недействительная или истекшая invite-ссылка', 'join_failed': 'не удалось присоединиться к группе', 'no_client': 'Client API не настроен, настройте его через /setup_my_client или используйте общие настройки в .env'}
+_error_types: Dict[str, Tuple[int, Optional[str]]] = {}
+
+async def seed_error_types():
+    table = ErrorType.__table__
+    async with get_session() as session:
+        existing = dict((await session.execute(select(table.c.code, table.c.id))).all())
+        next_id = max(existing.values(), default=0) + 1
+        new_codes = [{'id': next_id + i, 'code': code, 'message': ERROR_MESSAGES[code]} for i, code in enumerate((code for code in ERROR_MESSAGES if code not in existing))]
+        if new_codes:
+            await session.execute(_insert_ignore(table), new_codes)
+        known = [{'b_code': code, 'b_message': ERROR_MESSAGES[code]} for code in ERROR_MESSAGES if code in existing]
+        if known:
+            await session.execute(update(table).where(table.c.code == bindparam('b_code')).values(message=bindparam('b_message')), known)
+        await _commit(session)
+    _error_types.clear()
+
+async def _error_type(session: AsyncSession, code: str) -> Tuple[int, Optional[str]]:
+    if code in _error_types:
+        return _error_types[code]
+    table = ErrorType.__table__
+    while True:
+        row = (await session.execute(select(table.c.id, table.c.message).where(table.c.code == code))).first()
+        if row:
+            break
+        next_id = (await session.scalar(select(func.max(table.c.id))) or 0) + 1
+        await session.execute(_insert_ignore(table).values(id=next_id, code=code, message=ERROR_MESSAGES.get(code)))
+    _error_types[code] = (row[0], row[1])
+    return _error_types[code]
+
+def _history_select():
+    return select(SendingHistory.id, SendingHistory.campaign_id, Recipient.recipient_identifier, SendingHistory.success, ErrorType.code.label('error_type'), func.coalesce(ErrorType.message + ': ' + SendingHistory.error_details, SendingHistory.error_details, ErrorType.message).label('error_details'), SendingHistory.telegram_message_id, SendingHistory.sent_at).select_from(SendingHistory).outerjoin(Recipient, SendingHistory.recipient_id == Recipient.id).outerjoin(ErrorType, SendingHistory.error_code == ErrorType.id)
+
+async def add_sending_history(campaign_id: int, recipient_id: int, success: bool, error_type: Optional[str]=None, error_details: Optional[str]=None, telegram_message_id: Optional[int]=None):
+    async with get_session() as session:
+        error_code = None
+        if error_type:
+            error_code, canonical_message = await _error_type(session, error_type)
+            if error_details == canonical_message:
+                error_details = None
+        history = SendingHistory(campaign_id=campaign_id, recipient_id=recipient_id, success=success, error_code=error_code, error_details=error_details, telegram_message_id=telegram_message_id)
         session.add(history)
-        await session.commit()
+        await _commit(session)
         return history
 
-async def get_campaign_sending_history(campaign_id: int) -> List[SendingHistory]:
-    async with async_session_maker() as session:
-        result = await session.execute(select(SendingHistory).where(SendingHistory.campaign_id == campaign_id).order_by(SendingHistory.sent_at))
-        return list(result.scalars().all())
+async def get_campaign_sending_history(campaign_id: int) -> List:
+    async with get_read_session() as session:
+        result = await session.execute(_history_select().where(SendingHistory.campaign_id == campaign_id).order_by(SendingHistory.sent_at))
+        return list(result.all())
+
+async def iter_failed_history(campaign_id: int, after_id: int=0, batch_size: int=500) -> AsyncIterator[Tuple]:
+    async with read_session_maker() as session:
+        result = await session.stream(_history_select().where(and_(SendingHistory.campaign_id == campaign_id, SendingHistory.success == False, SendingHistory.id > after_id)).order_by(SendingHistory.id).execution_options(yield_per=batch_size))
+        async for history_id, _, recipient_identifier, _, error_type, error_details, _, sent_at in result:
+            yield (history_id, recipient_identifier, error_type, error_details, sent_at)
+
+async def iter_sending_history(campaign_id: Optional[int]=None, start_date: Optional[datetime]=None, end_date: Optional[datetime]=None, batch_size: int=1000) -> AsyncIterator[Tuple]:
+    conditions = []
+    if campaign_id is not None:
+        conditions.append(SendingHistory.campaign_id == campaign_id)
+    if start_date is not None:
+        conditions.append(SendingHistory.sent_at >= start_date)
+    if end_date is not None:
+        conditions.append(SendingHistory.sent_at <= end_date)
+    async with read_session_maker() as session:
+        result = await session.stream(_history_select().where(*conditions).order_by(SendingHistory.id).execution_options(yield_per=batch_size))
+        async for row in result:
+            yield tuple(row)
+
+ACTIVE_CAMPAIGN_STATUSES = ('pending', 'queued', 'processing')
+
+def _active_campaign_ids():
+    return select(MailingCampaign.id).where(MailingCampaign.status.in_(ACTIVE_CAMPAIGN_STATUSES))
+
+async def get_archivable_sending_history(cutoff: datetime, limit: int) -> List[Tuple]:
+    async with get_session() as session:
+        result = await session.execute(_history_select().where(and_(SendingHistory.sent_at < cutoff, SendingHistory.campaign_id.not_in(_active_campaign_ids()))).order_by(SendingHistory.sent_at).limit(limit))
+        return [tuple(row) for row in result.all()]
+
+async def get_archivable_recipients(cutoff: datetime, limit: int) -> List[Tuple]:
+    archived_campaigns = select(MailingCampaign.id).where(and_(MailingCampaign.created_at < cutoff, MailingCampaign.status.not_in(ACTIVE_CAMPAIGN_STATUSES)))
+    referenced = select(SendingHistory.id).where(SendingHistory.recipient_id == Recipient.id).exists()
+    async with get_session() as session:
+        result = await session.execute(select(Recipient.id, Recipient.campaign_id, Recipient.recipient_identifier, Recipient.normalized_identifier, Recipient.is_duplicate, Recipient.previous_campaign_id, Recipient.created_at).where(and_(Recipient.campaign_id.in_(archived_campaigns), ~referenced)).limit(limit))
+        return [tuple(row) for row in result.all()]
+
+async def delete_sending_history_rows(history_ids: List[int]) -> int:
+    async with get_session() as session:
+        result = await session.execute(delete(SendingHistory).where(SendingHistory.id.in_(history_ids)))
+        await _commit(session)
+        return result.rowcount
+
+async def delete_recipient_rows(recipient_ids: List[int]) -> int:
+    async with get_session() as session:
+        result = await session.execute(delete(Recipient).where(Recipient.id.in_(recipient_ids)))
+        await _commit(session)
+        return result.rowcount
+
+async def get_campaign_duplicates(campaign_id: int, limit: int=10) -> Tuple[List[str], int]:
+    async with get_read_session() as session:
+        condition = and_(Recipient.campaign_id == campaign_id, Recipient.is_duplicate == True)
+        result = await session.execute(select(Recipient.recipient_identifier).where(condition).order_by(Recipient.id).limit(limit))
+        identifiers = list(result.scalars().all())
+        if len(identifiers) < limit:
+            return (identifiers, len(identifiers))
+        total = await session.scalar(select(func.count(Recipient.id)).where(condition))
+        return (identifiers, total)
 
 async def create_report_receiver_list(name: str) -> ReportReceiverList:
-    async with async_session_maker() as session:
+    async with get_session() as session:
         receiver_list = ReportReceiverList(name=name, is_active=True)
         session.add(receiver_list)
-        await session.commit()
+        await _commit(session)
         await session.refresh(receiver_list)
         return receiver_list
 
 async def get_all_report_receiver_lists() -> List[ReportReceiverList]:
-    async with async_session_maker() as session:
+    async with get_session() as session:
         result = await session.execute(select(ReportReceiverList).where(ReportReceiverList.is_active == True).order_by(ReportReceiverList.created_at.desc()))
         return list(result.scalars().all())
 
 async def get_report_receiver_list(list_id: int) -> Optional[ReportReceiverList]:
-    async with async_session_maker() as session:
+    async with get_session() as session:
         result = await session.execute(select(ReportReceiverList).where(ReportReceiverList.id == list_id))
         return result.scalar_one_or_none()
 
 async def update_report_receiver_list(list_id: int, name: Optional[str]=None) -> Optional[ReportReceiverList]:
-    async with async_session_maker() as session:
+    async with get_session() as session:
         result = await session.execute(select(ReportReceiverList).where(ReportReceiverList.id == list_id))
         receiver_list = result.scalar_one_or_none()
         if not receiver_list:
@@ -328,93 +643,120 @@ async def update_report_receiver_list(list_id: int, name: Optional[str]=None) ->
         if name is not None:
             receiver_list.name = name
         receiver_list.updated_at = datetime.now()
-        await session.commit()
+        await _commit(session)
         await session.refresh(receiver_list)
         return receiver_list
 
 async def delete_report_receiver_list(list_id: int) -> bool:
-    async with async_session_maker() as session:
+    async with get_session() as session:
         result = await session.execute(select(ReportReceiverList).where(ReportReceiverList.id == list_id))
         receiver_list = result.scalar_one_or_none()
         if not receiver_list:
             return False
         receiver_list.is_active = False
-        await session.commit()
+        await _commit(session)
         return True
 
-async def get_receivers_by_list(list_id: int) -> List[ReportReceiver]:
-    async with async_session_maker() as session:
-        result = await session.execute(select(ReportReceiver).where(and_(ReportReceiver.list_id == list_id, ReportReceiver.is_active == True)).order_by(ReportReceiver.created_at.desc()))
-        return list(result.scalars().all())
-
-async def add_report_receivers_to_list(list_id: int, identifiers: List[str]) -> List[ReportReceiver]:
+async def get_report_receiver_list_summaries() -> List[Tuple[int, str, int]]:
+    async with get_session() as session:
+        receivers_count = func.count(ReportReceiver.id).label('receivers_count')
+        result = await session.execute(select(ReportReceiverList.id, ReportReceiverList.name, receivers_count).outerjoin(ReportReceiver, and_(ReportReceiver.list_id == ReportReceiverList.id, ReportReceiver.is_active == True)).where(ReportReceiverList.is_active == True).group_by(ReportReceiverList.id, ReportReceiverList.name, ReportReceiverList.created_at).order_by(ReportReceiverList.created_at.desc()))
+        return list(result.all())
+
+async def get_receivers_page(list_id: int, offset: int=0, limit: int=20) -> Tuple[List[ReportReceiver], int]:
+    async with get_session() as session:
+        condition = and_(ReportReceiver.list_id == list_id, ReportReceiver.is_active == True)
+        result = await session.execute(select(ReportReceiver).where(condition).order_by(ReportReceiver.created_at.desc(), ReportReceiver.id.desc()).offset(offset).limit(limit))
+        receivers = list(result.scalars().all())
+        if not offset and len(receivers) < limit:
+            return (receivers, len(receivers))
+        total = await session.scalar(select(func.count(ReportReceiver.id)).where(condition))
+        return (receivers, total)
+
+def _insert_ignore(table):
+    dialect = engine.dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert(table).on_conflict_do_nothing()
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+        return postgresql_insert(table).on_conflict_do_nothing()
+    if dialect in ('mysql', 'mariadb'):
+        return insert(table).prefix_with('IGNORE')
+    raise RuntimeError(f'СУБД {dialect} не поддерживается: нет аналога INSERT ... ON CONFLICT DO NOTHING')
+
+def _receiver_identifier_type(identifier: str) -> str:
+    if identifier.isdigit():
+        return 'user_id'
+    if identifier.startswith('@'):
+        return 'username'
+    if 't.me' in identifier or 'telegram.me' in identifier:
+        return 'link'
+    return 'username'
+
+async def add_report_receivers_to_list(list_id: int, identifiers: List[str], chunk_size: int=200) -> Tuple[int, int]:
     from utils import normalize_identifier
-    async with async_session_maker() as session:
-        receivers = []
-        for identifier in identifiers:
-            identifier = identifier.strip()
-            if not identifier:
-                continue
-            normalized = normalize_identifier(identifier)
-            if not normalized:
-                continue
-            if identifier.isdigit():
-                identifier_type = 'user_id'
-            elif identifier.startswith('@'):
-                identifier_type = 'username'
-            elif 't.me' in identifier or 'telegram.me' in identifier:
-                identifier_type = 'link'
-            else:
-                identifier_type = 'username'
-            result = await session.execute(select(ReportReceiver).where(and_(ReportReceiver.list_id == list_id, ReportReceiver.identifier == normalized)))
-            existing = result.scalar_one_or_none()
-            if not existing:
-                receiver = ReportReceiver(list_id=list_id, identifier=normalized, identifier_type=identifier_type)
-                session.add(receiver)
-                receivers.append(receiver)
-        await session.commit()
-        return receivers
+    rows = {}
+    submitted = 0
+    for identifier in identifiers:
+        identifier = identifier.strip()
+        normalized = normalize_identifier(identifier) if identifier else ''
+        if not normalized:
+            continue
+        submitted += 1
+        rows.setdefault(normalized, {'list_id': list_id, 'identifier': normalized, 'identifier_type': _receiver_identifier_type(identifier)})
+    values = list(rows.values())
+    inserted = 0
+    async with get_session() as session:
+        for start in range(0, len(values), chunk_size):
+            result = await session.execute(_insert_ignore(ReportReceiver.__table__).values(values[start:start + chunk_size]))
+            inserted += result.rowcount
+        await _commit(session)
+    return (inserted, submitted - inserted)
 
 async def delete_report_receiver(receiver_id: int) -> bool:
-    async with async_session_maker() as session:
+    async with get_session() as session:
         result = await session.execute(select(ReportReceiver).where(ReportReceiver.id == receiver_id))
         receiver = result.scalar_one_or_none()
         if not receiver:
             return False
         receiver.is_active = False
-        await session.commit()
+        await _commit(session)
         return True
 
 async def get_all_report_receivers() -> List[ReportReceiver]:
-    async with async_session_maker() as session:
+    async with get_session() as session:
         result = await session.execute(select(ReportReceiver).where(ReportReceiver.is_active == True))
         return list(result.scalars().all())
 
 async def update_report_receiver_telegram_id(identifier: str, telegram_id: int):
-    async with async_session_maker() as session:
-        result = await session.execute(select(ReportReceiver).where(ReportReceiver.identifier == identifier))
-        receiver = result.scalar_one_or_none()
-        if receiver:
-            receiver.telegram_id = telegram_id
-            await session.commit()
+    await update_report_receiver_telegram_ids({identifier: telegram_id})
+
+async def update_report_receiver_telegram_ids(resolved: Dict[str, int]):
+    if not resolved:
+        return
+    table = ReportReceiver.__table__
+    async with get_session() as session:
+        await session.execute(update(table).where(table.c.identifier == bindparam('b_identifier')).values(telegram_id=bindparam('b_telegram_id')), [{'b_identifier': identifier, 'b_telegram_id': telegram_id} for identifier, telegram_id in resolved.items()])
+        await _commit(session)
 
 async def get_daily_campaigns(date: datetime) -> List[MailingCampaign]:
-    async with async_session_maker() as session:
+    async with get_read_session() as session:
         start_date = date.replace(hour=0, minute=0, second=0, microsecond=0)
         end_date = date.replace(hour=23, minute=59, second=59, microsecond=999999)
         result = await session.execute(select(MailingCampaign).where(and_(MailingCampaign.created_at >= start_date, MailingCampaign.created_at <= end_date)).order_by(MailingCampaign.created_at.desc()))
         return list(result.scalars().all())
 
 async def get_error_statistics(start_date: datetime, end_date: datetime) -> Dict:
-    async with async_session_maker() as session:
-        result = await session.execute(select(SendingHistory.error_type, func.count(SendingHistory.id).label('count')).join(MailingCampaign, SendingHistory.campaign_id == MailingCampaign.id).where(and_(SendingHistory.success == False, MailingCampaign.created_at >= start_date, MailingCampaign.created_at <= end_date)).group_by(SendingHistory.error_type).order_by(func.count(SendingHistory.id).desc()))
+    async with get_read_session() as session:
+        result = await session.execute(select(ErrorType.code.label('error_type'), func.count(SendingHistory.id).label('count')).select_from(SendingHistory).join(MailingCampaign, SendingHistory.campaign_id == MailingCampaign.id).outerjoin(ErrorType, SendingHistory.error_code == ErrorType.id).where(and_(SendingHistory.success == False, MailingCampaign.created_at >= start_date, MailingCampaign.created_at <= end_date)).group_by(ErrorType.code).order_by(func.count(SendingHistory.id).desc()))
         error_stats = {}
         for row in result.all():
             error_stats[row.error_type or 'unknown'] = row.count
         return error_stats
 
 async def add_or_update_bot_group(chat_id: int, title: Optional[str]=None, username: Optional[str]=None, chat_type: str='group', members_count: Optional[int]=None, is_active: bool=True) -> BotGroup:
-    async with async_session_maker() as session:
+    async with get_session() as session:
         result = await session.execute(select(BotGroup).where(BotGroup.chat_id == chat_id))
         bot_group = result.scalar_one_or_none()
         if not bot_group:
@@ -427,17 +769,17 @@ async def add_or_update_bot_group(chat_id: int, title: Optional[str]=None, usern
             bot_group.members_count = members_count or bot_group.members_count
             bot_group.is_active = is_active
             bot_group.updated_at = datetime.now()
-        await session.commit()
+        await _commit(session)
         await session.refresh(bot_group)
         return bot_group
 
 async def get_bot_group(chat_id: int) -> Optional[BotGroup]:
-    async with async_session_maker() as session:
+    async with get_session() as session:
         result = await session.execute(select(BotGroup).where(BotGroup.chat_id == chat_id))
         return result.scalar_one_or_none()
 
 async def get_all_bot_groups(active_only: bool=True) -> List[BotGroup]:
-    async with async_session_maker() as session:
+    async with get_session() as session:
         query = select(BotGroup)
         if active_only:
             query = query.where(BotGroup.is_active == True)
@@ -446,21 +788,34 @@ async def get_all_bot_groups(active_only: bool=True) -> List[BotGroup]:
         return list(result.scalars().all())
 
 async def remove_bot_group(chat_id: int) -> bool:
-    async with async_session_maker() as session:
+    async with get_session() as session:
         result = await session.execute(select(BotGroup).where(BotGroup.chat_id == chat_id))
         bot_group = result.scalar_one_or_none()
         if bot_group:
             bot_group.is_active = False
             bot_group.updated_at = datetime.now()
-            await session.commit()
+            await _commit(session)
             return True
         return False
 
+async def upsert_bot_groups(groups: List[Dict]) -> int:
+    if not groups:
+        return 0
+    table = BotGroup.__table__
+    now = datetime.now()
+    async with get_session() as session:
+        new_groups = [{'chat_id': group['chat_id'], 'title': group.get('title'), 'username': group.get('username'), 'chat_type': group['chat_type'], 'members_count': group.get('members_count'), 'is_active': True, 'added_at': now, 'updated_at': now} for group in groups if group.get('is_active')]
+        if new_groups:
+            await session.execute(_insert_ignore(table), new_groups)
+        await session.execute(update(table).where(table.c.chat_id == bindparam('b_chat_id')).values(title=func.coalesce(bindparam('b_title'), table.c.title), username=func.coalesce(bindparam('b_username'), table.c.username), chat_type=func.coalesce(bindparam('b_chat_type'), table.c.chat_type), members_count=func.coalesce(bindparam('b_members_count'), table.c.members_count), is_active=func.coalesce(bindparam('b_is_active'), table.c.is_active), updated_at=now), [{'b_chat_id': group['chat_id'], 'b_title': group.get('title'), 'b_username': group.get('username'), 'b_chat_type': group.get('chat_type'), 'b_members_count': group.get('members_count'), 'b_is_active': group.get('is_active')} for group in groups])
+        await _commit(session)
+    return len(groups)
+
 async def update_bot_group_members_count(chat_id: int, members_count: int):
-    async with async_session_maker() as session:
+    async with get_session() as session:
         result = await session.execute(select(BotGroup).where(BotGroup.chat_id == chat_id))
         bot_group = result.scalar_one_or_none()
         if bot_group:
             bot_group.members_count = members_count
             bot_group.updated_at = datetime.now()
-            await session.commit()
+            await _commit(session)
@@ -0,0 +1,102 @@
+import asyncio
+import time
+from contextlib import suppress
+from typing import Dict, Optional, Set
+from aiogram import Bot
+from aiogram.types import ChatMemberUpdated
+import database as crud
+from config import GROUP_REGISTRY_FLUSH_SECONDS, GROUP_MEMBERS_COUNT_TTL
+from utils import logger
+ACTIVE_STATUSES = ('member', 'administrator')
+INACTIVE_STATUSES = ('left', 'kicked')
+
+class GroupRegistryWriter:
+    def __init__(self, flush_seconds: float=GROUP_REGISTRY_FLUSH_SECONDS, members_ttl: float=GROUP_MEMBERS_COUNT_TTL):
+        self.flush_seconds = flush_seconds
+        self.members_ttl = members_ttl
+        self._pending: Dict[int, Dict] = {}
+        self._members_checked: Dict[int, float] = {}
+        self._members_tasks: Set[asyncio.Task] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _merge(self, group: Dict):
+        pending = self._pending.get(group['chat_id'])
+        if pending is None:
+            self._pending[group['chat_id']] = group
+        else:
+            for key, value in group.items():
+                if value is not None:
+                    pending[key] = value
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    def submit(self, bot: Bot, event: ChatMemberUpdated) -> bool:
+        chat = event.chat
+        status = event.new_chat_member.status
+        if status in ACTIVE_STATUSES:
+            is_active = True
+        elif status in INACTIVE_STATUSES:
+            is_active = False
+        else:
+            return False
+        self._merge({'chat_id': chat.id, 'title': chat.title, 'username': chat.username, 'chat_type': chat.type, 'members_count': None, 'is_active': is_active})
+        if is_active and chat.type in ('group', 'supergroup'):
+            self._refresh_members_count(bot, chat.id)
+        return True
+
+    def _refresh_members_count(self, bot: Bot, chat_id: int):
+        now = time.monotonic()
+        if now - self._members_checked.get(chat_id, -self.members_ttl) < self.members_ttl:
+            return
+        self._members_checked[chat_id] = now
+        task = asyncio.create_task(self._fetch_members_count(bot, chat_id))
+        self._members_tasks.add(task)
+        task.add_done_callback(self._members_tasks.discard)
+
+    async def _fetch_members_count(self, bot: Bot, chat_id: int):
+        try:
+            members_count = await bot.get_chat_member_count(chat_id)
+        except Exception as e:
+            logger.debug(f'Не удалось получить количество участников для {chat_id}: {e}')
+            return
+        self._merge({'chat_id': chat_id, 'members_count': members_count})
+
+    async def _flush_later(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            await self.flush()
+            if not self._pending:
+                return
+
+    def _requeue(self, groups: Dict[int, Dict]):
+        for chat_id, group in groups.items():
+            newer = self._pending.get(chat_id)
+            if newer is not None:
+                group.update({key: value for key, value in newer.items() if value is not None})
+            self._pending[chat_id] = group
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        groups, self._pending = self._pending, {}
+        try:
+            written = await crud.upsert_bot_groups(list(groups.values()))
+        except asyncio.CancelledError:
+            self._requeue(groups)
+            raise
+        except Exception as e:
+            logger.error(f'Ошибка при сохранении групп бота ({len(groups)} шт.): {e}', exc_info=True)
+            self._requeue(groups)
+            return 0
+        logger.info(f'Реестр групп бота обновлен: {written} чатов')
+        return written
+
+    async def close(self):
+        for task in list(self._members_tasks):
+            task.cancel()
+        if self._flush_task is not None and (not self._flush_task.done()):
+            self._flush_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._flush_task
+        await self.flush()
+group_registry = GroupRegistryWriter()
@@ -7,11 +7,19 @@ import database as crud
 from database import async_session_maker
 from utils import validate_template_name, validate_template_text
 from utils import logger
-from config import MAIN_ADMIN_ID
+from config import MAIN_ADMIN_ID, RECEIVERS_PAGE_SIZE
 from keyboards import get_main_keyboard, get_cancel_keyboard
 from keyboards import get_templates_keyboard
 from keyboards import get_cancel_keyboard
+from callbacks import callback_registry, SelectTemplate, EditTemplate, EditTemplateName, EditTemplateText, EditTemplateBoth, DeleteTemplate, ConfirmDeleteTemplate
+from metrics import setup_handler_metrics
+from callbacks import SelectReceiverList, AddToReceiverList, EditReceiverList, DeleteReceiverList, ConfirmDeleteReceiverList, ManageReceivers, DeleteReceiver
 router = Router()
+setup_handler_metrics(router)
+
+@router.callback_query()
+async def dispatch_callback(callback: CallbackQuery, state: FSMContext, **data):
+    return await callback_registry.dispatch(callback, state, **data)
 
 def is_admin(user_id: int) -> bool:
     return user_id == MAIN_ADMIN_ID
@@ -48,14 +56,14 @@ async def cmd_add_template(message: Message, state: FSMContext):
     from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
     keyboard = []
     for template in templates:
-        keyboard.append([InlineKeyboardButton(text=f'📝 {template.name}', callback_data=f'select_template_{template.id}')])
+        keyboard.append([InlineKeyboardButton(text=f'📝 {template.name}', callback_data=SelectTemplate(template_id=template.id).pack())])
     keyboard.append([InlineKeyboardButton(text='➕ Новый шаблон', callback_data='new_template')])
     keyboard.append([InlineKeyboardButton(text='❌ Отмена', callback_data='cancel_templates')])
     reply_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
     await message.answer(text, reply_markup=reply_markup)
     await state.clear()
 
-@router.callback_query(F.data == 'save_template_with_media')
+@callback_registry.route('save_template_with_media')
 async def save_template_with_media_handler(callback: CallbackQuery, state: FSMContext):
     if not is_admin(callback.from_user.id):
         await callback.answer('❌ У вас нет прав', show_alert=True)
@@ -74,7 +82,7 @@ async def save_template_with_media_handler(callback: CallbackQuery, state: FSMCo
     await callback.answer('Шаблон сохранен!')
     logger.info(f"Создан шаблон #{template.id} '{template_name}' пользователем {callback.from_user.id}")
 
-@router.callback_query(F.data == 'save_template_no_media')
+@callback_registry.route('save_template_no_media')
 async def save_template_no_media_handler(callback: CallbackQuery, state: FSMContext):
     if not is_admin(callback.from_user.id):
         await callback.answer('❌ У вас нет прав', show_alert=True)
@@ -91,7 +99,7 @@ async def save_template_no_media_handler(callback: CallbackQuery, state: FSMCont
     await callback.answer('Шаблон сохранен!')
     logger.info(f"Создан шаблон #{template.id} '{template_name}' пользователем {callback.from_user.id}")
 
-@router.callback_query(F.data == 'add_media_to_template')
+@callback_registry.route('add_media_to_template')
 async def add_media_to_template_handler(callback: CallbackQuery, state: FSMContext):
     if not is_admin(callback.from_user.id):
         await callback.answer('❌ У вас нет прав', show_alert=True)
@@ -100,14 +108,14 @@ async def add_media_to_template_handler(callback: CallbackQuery, state: FSMConte
     await state.set_state(TemplateStates.waiting_for_media)
     await callback.answer()
 
-@router.callback_query(F.data == 'add_more_media')
+@callback_registry.route('add_more_media')
 async def add_more_media_handler(callback: CallbackQuery, state: FSMContext):
     if not is_admin(callback.from_user.id):
         await callback.answer('❌ У вас нет прав', show_alert=True)
         return
     await callback.answer('⚠️ Пока поддерживается только одно медиа на шаблон. Используйте существующее или замените его.', show_alert=True)
 
-@router.callback_query(F.data == 'cancel_template')
+@callback_registry.route('cancel_template')
 async def cancel_template_handler(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.edit_text('❌ Создание шаблона отменено.', reply_markup=None)
@@ -164,13 +172,13 @@ async def process_template_media(message: Message, state: FSMContext):
     media_names = {'photo': '📷 Фото', 'video': '🎥 Видео', 'document': '📄 Документ', 'audio': '🎵 Аудио', 'voice': '🎤 Голосовое сообщение', 'video_note': '📹 Видео-кружок', 'animation': '🎬 GIF/Анимация'}
     await message.answer(f'✅ Медиа получено: {media_names.get(media_type, media_type)}\n\nТекст подписи: {(template_text if template_text else '(без подписи)')}\n\nГотово к сохранению!', reply_markup=keyboard)
 
-@router.callback_query(F.data.startswith('select_template_'))
-async def select_template_handler(callback: CallbackQuery, state: FSMContext):
+@callback_registry.route(SelectTemplate)
+async def select_template_handler(callback: CallbackQuery, callback_data: SelectTemplate, state: FSMContext):
     if not is_admin(callback.from_user.id):
         await callback.answer('❌ У вас нет прав', show_alert=True)
         return
     try:
-        template_id = int(callback.data.split('_')[2])
+        template_id = callback_data.template_id
         template = await crud.get_template(template_id)
         if not template:
             await callback.answer('Шаблон не найден', show_alert=True)
@@ -182,14 +190,14 @@ async def select_template_handler(callback: CallbackQuery, state: FSMContext):
             display_text += f'Медиа: {media_names.get(template.media_type, template.media_type)}\n\n'
         display_text += f'📄 Текст:\n━━━━━━━━━━━━━━━━━━━━\n{template_text}\n━━━━━━━━━━━━━━━━━━━━\n\n'
         display_text += 'Выберите действие:'
-        await callback.message.edit_text(display_text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text='✏️ Редактировать', callback_data=f'edit_template_{template_id}'), InlineKeyboardButton(text='🗑️ Удалить', callback_data=f'delete_template_{template_id}')], [InlineKeyboardButton(text='❌ Отмена', callback_data='cancel_templates')]]))
+        await callback.message.edit_text(display_text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text='✏️ Редактировать', callback_data=EditTemplate(template_id=template_id).pack()), InlineKeyboardButton(text='🗑️ Удалить', callback_data=DeleteTemplate(template_id=template_id).pack())], [InlineKeyboardButton(text='❌ Отмена', callback_data='cancel_templates')]]))
         await callback.answer()
         await state.clear()
     except Exception as e:
         logger.error(f'Ошибка при выборе шаблона: {e}', exc_info=True)
         await callback.answer('Произошла ошибка', show_alert=True)
 
-@router.callback_query(F.data == 'new_template')
+@callback_registry.route('new_template')
 async def new_template_handler(callback: CallbackQuery, state: FSMContext):
     if not is_admin(callback.from_user.id):
         await callback.answer('❌ У вас нет прав', show_alert=True)
@@ -280,26 +288,24 @@ async def cmd_set_report_receivers(message: Message, state: FSMContext):
     await message.answer('Введите список получателей сводных отчетов.\n\nПоддерживаемые форматы:\n• @username (пользователи)\n• user_id (число)\n• Ссылки: https://t.me/user\n• Группы/каналы: @groupname или https://t.me/groupname\n\nПример: @user1 @user2 123456789 @mygroup', reply_markup=get_cancel_keyboard())
     await state.set_state(ReportReceiversStates.waiting_for_receivers)
 
-@router.callback_query(F.data == 'report_receivers_menu')
+@callback_registry.route('report_receivers_menu')
 async def report_receivers_menu_handler(callback: CallbackQuery, state: FSMContext):
     if not is_admin(callback.from_user.id):
         await callback.answer('❌ У вас нет прав', show_alert=True)
         return
-    lists = await crud.get_all_report_receiver_lists()
+    lists = await crud.get_report_receiver_list_summaries()
     text = '📋 ПОЛУЧАТЕЛИ ОТЧЕТОВ\n\n'
     if lists:
         text += '📝 Существующие списки:\n'
         for i, receiver_list in enumerate(lists, 1):
-            receivers = await crud.get_receivers_by_list(receiver_list.id)
-            text += f'{i}. {receiver_list.name} ({len(receivers)} получателей)\n'
+            text += f'{i}. {receiver_list.name} ({receiver_list.receivers_count} получателей)\n'
         text += '\n'
     else:
         text += '📝 Списков пока нет.\n\n'
     text += '💡 Выберите список или создайте новый:'
     keyboard = []
     for receiver_list in lists:
-        receivers = await crud.get_receivers_by_list(receiver_list.id)
-        keyboard.append([InlineKeyboardButton(text=f'📋 {receiver_list.name} ({len(receivers)})', callback_data=f'select_receiver_list_{receiver_list.id}')])
+        keyboard.append([InlineKeyboardButton(text=f'📋 {receiver_list.name} ({receiver_list.receivers_count})', callback_data=SelectReceiverList(list_id=receiver_list.id).pack())])
     keyboard.append([InlineKeyboardButton(text='➕ Новый список', callback_data='new_receiver_list')])
     keyboard.append([InlineKeyboardButton(text='❌ Отмена', callback_data='cancel_receiver_lists')])
     reply_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
@@ -307,7 +313,7 @@ async def report_receivers_menu_handler(callback: CallbackQuery, state: FSMConte
     await callback.answer()
     await state.clear()
 
-@router.callback_query(F.data == 'new_receiver_list')
+@callback_registry.route('new_receiver_list')
 async def new_receiver_list_handler(callback: CallbackQuery, state: FSMContext):
     if not is_admin(callback.from_user.id):
         await callback.answer('❌ У вас нет прав', show_alert=True)
@@ -333,31 +339,31 @@ async def process_list_name(message: Message, state: FSMContext):
     await state.set_state(ReportReceiversStates.waiting_for_receivers)
     logger.info(f"Создан список получателей '{list_name}' пользователем {message.from_user.id}")
 
-@router.callback_query(F.data.startswith('select_receiver_list_'))
-async def select_receiver_list_handler(callback: CallbackQuery, state: FSMContext):
+@callback_registry.route(SelectReceiverList)
+async def select_receiver_list_handler(callback: CallbackQuery, callback_data: SelectReceiverList, state: FSMContext):
     if not is_admin(callback.from_user.id):
         await callback.answer('❌ У вас нет прав', show_alert=True)
         return
     try:
-        list_id = int(callback.data.split('_')[3])
+        list_id = callback_data.list_id
         receiver_list = await crud.get_report_receiver_list(list_id)
         if not receiver_list:
             await callback.answer('Список не найден', show_alert=True)
             return
-        receivers = await crud.get_receivers_by_list(list_id)
+        receivers, receivers_total = await crud.get_receivers_page(list_id, limit=20)
         text = f'📋 СПИСОК: {receiver_list.name}\n\n'
         if receivers:
-            text += f'📝 Получатели ({len(receivers)}):\n'
-            for i, receiver in enumerate(receivers[:20], 1):
+            text += f'📝 Получатели ({receivers_total}):\n'
+            for i, receiver in enumerate(receivers, 1):
                 text += f'{i}. {receiver.identifier}\n'
-            if len(receivers) > 20:
-                text += f'\n... и еще {len(receivers) - 20} получателей\n'
+            if receivers_total > 20:
+                text += f'\n... и еще {receivers_total - 20} получателей\n'
         else:
             text += '📝 Получателей пока нет.\n'
         text += '\nВыберите действие:'
-        keyboard_buttons = [[InlineKeyboardButton(text='✏️ Редактировать название', callback_data=f'edit_receiver_list_{list_id}'), InlineKeyboardButton(text='➕ Добавить получателей', callback_data=f'add_to_list_{list_id}')], [InlineKeyboardButton(text='🗑️ Удалить список', callback_data=f'delete_receiver_list_{list_id}')]]
+        keyboard_buttons = [[InlineKeyboardButton(text='✏️ Редактировать название', callback_data=EditReceiverList(list_id=list_id).pack()), InlineKeyboardButton(text='➕ Добавить получателей', callback_data=AddToReceiverList(list_id=list_id).pack())], [InlineKeyboardButton(text='🗑️ Удалить список', callback_data=DeleteReceiverList(list_id=list_id).pack())]]
         if receivers:
-            keyboard_buttons.append([InlineKeyboardButton(text='📝 Управление получателями', callback_data=f'manage_receivers_{list_id}')])
+            keyboard_buttons.append([InlineKeyboardButton(text='📝 Управление получателями', callback_data=ManageReceivers(list_id=list_id).pack())])
         keyboard_buttons.append([InlineKeyboardButton(text='❌ Отмена', callback_data='cancel_receiver_lists')])
         await callback.message.edit_text(text, parse_mode=None, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard_buttons))
         await callback.answer()
@@ -366,13 +372,13 @@ async def select_receiver_list_handler(callback: CallbackQuery, state: FSMContex
         logger.error(f'Ошибка при выборе списка получателей: {e}', exc_info=True)
         await callback.answer('Произошла ошибка', show_alert=True)
 
-@router.callback_query(F.data.startswith('add_to_list_'))
-async def add_to_list_handler(callback: CallbackQuery, state: FSMContext):
+@callback_registry.route(AddToReceiverList)
+async def add_to_list_handler(callback: CallbackQuery, callback_data: AddToReceiverList, state: FSMContext):
     if not is_admin(callback.from_user.id):
         await callback.answer('❌ У вас нет прав', show_alert=True)
         return
     try:
-        list_id = int(callback.data.split('_')[3])
+        list_id = callback_data.list_id
         receiver_list = await crud.get_report_receiver_list(list_id)
         if not receiver_list:
             await callback.answer('Список не найден', show_alert=True)
@@ -415,25 +421,28 @@ async def process_report_receivers(message: Message, state: FSMContext):
         await message.answer(f'❌ {error}\n\nПопробуйте еще раз. Введите список получателей:', reply_markup=get_cancel_keyboard())
         return
     identifiers = [r['original'] for r in recipients]
-    receivers = await crud.add_report_receivers_to_list(list_id, identifiers)
+    inserted, skipped = await crud.add_report_receivers_to_list(list_id, identifiers)
     await state.clear()
     receiver_list = await crud.get_report_receiver_list(list_id)
-    updated_receivers = await crud.get_receivers_by_list(list_id)
-    text = f"✅ Добавлено получателей в список '{list_name}': {len(receivers)}\n\n"
+    updated_receivers, receivers_total = await crud.get_receivers_page(list_id, limit=10)
+    text = f"✅ Добавлено получателей в список '{list_name}': {inserted}\n"
+    if skipped:
+        text += f'⏭ Пропущено (уже в списке): {skipped}\n'
+    text += '\n'
     text += f'📋 СПИСОК: {receiver_list.name}\n\n'
     if updated_receivers:
-        text += f'📝 Получатели ({len(updated_receivers)}):\n'
-        for i, receiver in enumerate(updated_receivers[:10], 1):
+        text += f'📝 Получатели ({receivers_total}):\n'
+        for i, receiver in enumerate(updated_receivers, 1):
             text += f'{i}. {receiver.identifier}\n'
-        if len(updated_receivers) > 10:
-            text += f'\n... и еще {len(updated_receivers) - 10} получателей\n'
+        if receivers_total > 10:
+            text += f'\n... и еще {receivers_total - 10} получателей\n'
     text += '\nВыберите действие:'
-    keyboard_buttons = [[InlineKeyboardButton(text='✏️ Редактировать название', callback_data=f'edit_receiver_list_{list_id}'), InlineKeyboardButton(text='➕ Добавить получателей', callback_data=f'add_to_list_{list_id}')], [InlineKeyboardButton(text='🗑️ Удалить список', callback_data=f'delete_receiver_list_{list_id}')]]
+    keyboard_buttons = [[InlineKeyboardButton(text='✏️ Редактировать название', callback_data=EditReceiverList(list_id=list_id).pack()), InlineKeyboardButton(text='➕ Добавить получателей', callback_data=AddToReceiverList(list_id=list_id).pack())], [InlineKeyboardButton(text='🗑️ Удалить список', callback_data=DeleteReceiverList(list_id=list_id).pack())]]
     if updated_receivers:
-        keyboard_buttons.append([InlineKeyboardButton(text='📝 Управление получателями', callback_data=f'manage_receivers_{list_id}')])
+        keyboard_buttons.append([InlineKeyboardButton(text='📝 Управление получателями', callback_data=ManageReceivers(list_id=list_id).pack())])
     keyboard_buttons.append([InlineKeyboardButton(text='❌ Закрыть', callback_data='cancel_receiver_lists')])
     await message.answer(text, parse_mode=None, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard_buttons))
-    logger.info(f'Добавлено {len(receivers)} получателей в список {list_id} пользователем {message.from_user.id}')
+    logger.info(f'Добавлено {inserted} получателей в список {list_id} (пропущено {skipped}) пользователем {message.from_user.id}')
 
 @router.message(Command('templates_list'))
 async def cmd_templates_list(message: Message):
@@ -446,9 +455,9 @@ async def cmd_templates_list(message: Message):
         return
     await message.answer('📝 Управление шаблонами:\n\nВыберите шаблон для редактирования или удаления:', reply_markup=get_templates_keyboard(templates, for_selection=False))
 
-@router.callback_query(F.data.startswith('edit_template_name_'))
-async def edit_template_name_handler(callback: CallbackQuery, state: FSMContext):
-    template_id = int(callback.data.split('_')[3])
+@callback_registry.route(EditTemplateName)
+async def edit_template_name_handler(callback: CallbackQuery, callback_data: EditTemplateName, state: FSMContext):
+    template_id = callback_data.template_id
     template = await crud.get_template(template_id)
     await state.update_data(template_id=template_id, editing_field='name')
     await state.set_state(TemplateStates.editing_name)
@@ -456,9 +465,9 @@ async def edit_template_name_handler(callback: CallbackQuery, state: FSMContext)
     await callback.message.answer('Введите новое название:', reply_markup=get_cancel_keyboard())
     await callback.answer()
 
-@router.callback_query(F.data.startswith('edit_template_text_'))
-async def edit_template_text_handler(callback: CallbackQuery, state: FSMContext):
-    template_id = int(callback.data.split('_')[3])
+@callback_registry.route(EditTemplateText)
+async def edit_template_text_handler(callback: CallbackQuery, callback_data: EditTemplateText, state: FSMContext):
+    template_id = callback_data.template_id
     template = await crud.get_template(template_id)
     await state.update_data(template_id=template_id, editing_field='text')
     await state.set_state(TemplateStates.editing_text)
@@ -466,9 +475,9 @@ async def edit_template_text_handler(callback: CallbackQuery, state: FSMContext)
     await callback.message.answer('Введите новый текст (поддерживается Markdown):', reply_markup=get_cancel_keyboard())
     await callback.answer()
 
-@router.callback_query(F.data.startswith('edit_template_both_'))
-async def edit_template_both_handler(callback: CallbackQuery, state: FSMContext):
-    template_id = int(callback.data.split('_')[3])
+@callback_registry.route(EditTemplateBoth)
+async def edit_template_both_handler(callback: CallbackQuery, callback_data: EditTemplateBoth, state: FSMContext):
+    template_id = callback_data.template_id
     template = await crud.get_template(template_id)
     await state.update_data(template_id=template_id, editing_field='both')
     await state.set_state(TemplateStates.editing_name)
@@ -476,19 +485,19 @@ async def edit_template_both_handler(callback: CallbackQuery, state: FSMContext)
     await callback.message.answer('Введите новое название:', reply_markup=get_cancel_keyboard())
     await callback.answer()
 
-@router.callback_query(F.data.startswith('edit_template_'))
-async def edit_template_start(callback: CallbackQuery, state: FSMContext):
+@callback_registry.route(EditTemplate)
+async def edit_template_start(callback: CallbackQuery, callback_data: EditTemplate, state: FSMContext):
     if not is_admin(callback.from_user.id):
         await callback.answer('❌ У вас нет прав', show_alert=True)
         return
     try:
-        template_id = int(callback.data.split('_')[2])
+        template_id = callback_data.template_id
         template = await crud.get_template(template_id)
         if not template:
             await callback.answer('Шаблон не найден', show_alert=True)
             return
         await state.update_data(template_id=template_id, template_name=template.name, template_text=template.text)
-        await callback.message.edit_text(f'✏️ Редактирование шаблона: **{template.name}**\n\nЧто вы хотите изменить?\n1️⃣ Название\n2️⃣ Текст\n3️⃣ И то, и другое', parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text='1️⃣ Название', callback_data=f'edit_template_name_{template_id}'), InlineKeyboardButton(text='2️⃣ Текст', callback_data=f'edit_template_text_{template_id}')], [InlineKeyboardButton(text='3️⃣ Оба', callback_data=f'edit_template_both_{template_id}')], [InlineKeyboardButton(text='❌ Отмена', callback_data='cancel_templates')]]))
+        await callback.message.edit_text(f'✏️ Редактирование шаблона: **{template.name}**\n\nЧто вы хотите изменить?\n1️⃣ Название\n2️⃣ Текст\n3️⃣ И то, и другое', parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text='1️⃣ Название', callback_data=EditTemplateName(template_id=template_id).pack()), InlineKeyboardButton(text='2️⃣ Текст', callback_data=EditTemplateText(template_id=template_id).pack())], [InlineKeyboardButton(text='3️⃣ Оба', callback_data=EditTemplateBoth(template_id=template_id).pack())], [InlineKeyboardButton(text='❌ Отмена', callback_data='cancel_templates')]]))
         await callback.answer()
     except Exception as e:
         logger.error(f'Ошибка при начале редактирования шаблона: {e}', exc_info=True)
@@ -513,7 +522,8 @@ async def process_editing_name(message: Message, state: FSMContext):
         template = await crud.get_template(template_id)
         await message.answer(f'✅ Название сохранено: **{message.text}**\n\nТекущий текст:\n━━━━━━━━━━━━━━━━━━━━\n{template.text}\n━━━━━━━━━━━━━━━━━━━━\n\nТеперь введите новый текст:', parse_mode='Markdown', reply_markup=get_cancel_keyboard())
     else:
-        template = await crud.update_template(template_id, name=message.text)
+        from services import update_template
+        template = await update_template(template_id, name=message.text)
         await state.clear()
         await message.answer(f'✅ Название шаблона обновлено!\n\nНовое название: **{template.name}**', parse_mode='Markdown', reply_markup=get_main_keyboard(is_admin=True))
         logger.info(f"Создан шаблон #{template.id} '{template_name}' пользователем {callback.from_user.id}")
@@ -532,40 +542,42 @@ async def process_editing_text(message: Message, state: FSMContext):
     editing_field = data.get('editing_field', 'text')
     template_name = data.get('template_name')
     if editing_field == 'both' and template_name:
-        template = await crud.update_template(template_id, name=template_name, text=message.text)
+        from services import update_template
+        template = await update_template(template_id, name=template_name, text=message.text)
         await state.clear()
         await message.answer(f'✅ Шаблон полностью обновлен!\n\nНазвание: **{template.name}**\nТекст обновлен', parse_mode='Markdown', reply_markup=get_main_keyboard(is_admin=True))
         logger.info(f"Создан шаблон #{template.id} '{template_name}' пользователем {callback.from_user.id}")
     else:
-        template = await crud.update_template(template_id, text=message.text)
+        from services import update_template
+        template = await update_template(template_id, text=message.text)
         await state.clear()
         await message.answer(f'✅ Текст шаблона обновлен!\n\nШаблон: **{template.name}**', parse_mode='Markdown', reply_markup=get_main_keyboard(is_admin=True))
         logger.info(f"Текст шаблона #{template_id} обновлен пользователем {message.from_user.id}")
-@router.callback_query(F.data.startswith('delete_template_'))
-async def delete_template_handler(callback: CallbackQuery):
+@callback_registry.route(DeleteTemplate)
+async def delete_template_handler(callback: CallbackQuery, callback_data: DeleteTemplate):
     if not is_admin(callback.from_user.id):
         await callback.answer('❌ У вас нет прав', show_alert=True)
         return
     try:
-        template_id = int(callback.data.split('_')[2])
+        template_id = callback_data.template_id
         template = await crud.get_template(template_id)
         if not template:
             await callback.answer('Шаблон не найден', show_alert=True)
             return
-        await callback.message.edit_text(f'🗑️ Удаление шаблона\n\nНазвание: **{template.name}**\n\n⚠️ Вы уверены? Шаблон будет помечен как неактивный.', parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text='✅ Да, удалить', callback_data=f'confirm_delete_{template_id}'), InlineKeyboardButton(text='❌ Отмена', callback_data='cancel_templates')]]))
+        await callback.message.edit_text(f'🗑️ Удаление шаблона\n\nНазвание: **{template.name}**\n\n⚠️ Вы уверены? Шаблон будет помечен как неактивный.', parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text='✅ Да, удалить', callback_data=ConfirmDeleteTemplate(template_id=template_id).pack()), InlineKeyboardButton(text='❌ Отмена', callback_data='cancel_templates')]]))
         await callback.answer()
     except Exception as e:
         logger.error(f'Ошибка при удалении шаблона: {e}', exc_info=True)
         await callback.answer('Произошла ошибка', show_alert=True)
 
-@router.callback_query(F.data == 'cancel_templates')
+@callback_registry.route('cancel_templates')
 async def cancel_templates_handler(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.edit_text('❌ Отменено.')
     await callback.answer()
     await callback.message.answer('Выберите действие:', reply_markup=get_main_keyboard(is_admin=True))
 
-@router.callback_query(F.data == 'open_templates')
+@callback_registry.route('open_templates')
 async def open_templates_handler(callback: CallbackQuery, state: FSMContext):
     if not is_admin(callback.from_user.id):
         await callback.answer('❌ У вас нет прав', show_alert=True)
@@ -582,20 +594,20 @@ async def open_templates_handler(callback: CallbackQuery, state: FSMContext):
     text += '💡 Выберите шаблон из списка или создайте новый:'
     keyboard = []
     for template in templates:
-        keyboard.append([InlineKeyboardButton(text=f'📝 {template.name}', callback_data=f'select_template_{template.id}')])
+        keyboard.append([InlineKeyboardButton(text=f'📝 {template.name}', callback_data=SelectTemplate(template_id=template.id).pack())])
     keyboard.append([InlineKeyboardButton(text='➕ Новый шаблон', callback_data='new_template')])
     keyboard.append([InlineKeyboardButton(text='❌ Отмена', callback_data='cancel_templates')])
     reply_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
     await callback.message.edit_text(text, reply_markup=reply_markup)
     await callback.answer()
 
-@router.callback_query(F.data.startswith('edit_receiver_list_'))
-async def edit_receiver_list_handler(callback: CallbackQuery, state: FSMContext):
+@callback_registry.route(EditReceiverList)
+async def edit_receiver_list_handler(callback: CallbackQuery, callback_data: EditReceiverList, state: FSMContext):
     if not is_admin(callback.from_user.id):
         await callback.answer('❌ У вас нет прав', show_alert=True)
         return
     try:
-        list_id = int(callback.data.split('_')[3])
+        list_id = callback_data.list_id
         receiver_list = await crud.get_report_receiver_list(list_id)
         if not receiver_list:
             await callback.answer('Список не найден', show_alert=True)
@@ -627,21 +639,21 @@ async def process_editing_list_name(message: Message, state: FSMContext):
     receiver_list = await crud.update_report_receiver_list(list_id, name=message.text.strip())
     if receiver_list:
         await state.clear()
-        receivers = await crud.get_receivers_by_list(list_id)
+        receivers, receivers_total = await crud.get_receivers_page(list_id, limit=10)
         text = f'✅ Название списка обновлено!\n\n'
         text += f'📋 СПИСОК: {receiver_list.name}\n\n'
         if receivers:
-            text += f'📝 Получатели ({len(receivers)}):\n'
-            for i, receiver in enumerate(receivers[:10], 1):
+            text += f'📝 Получатели ({receivers_total}):\n'
+            for i, receiver in enumerate(receivers, 1):
                 text += f'{i}. {receiver.identifier}\n'
-            if len(receivers) > 10:
-                text += f'\n... и еще {len(receivers) - 10} получателей\n'
+            if receivers_total > 10:
+                text += f'\n... и еще {receivers_total - 10} получателей\n'
         else:
             text += '📝 Получателей пока нет.\n'
         text += '\nВыберите действие:'
-        keyboard_buttons = [[InlineKeyboardButton(text='✏️ Редактировать название', callback_data=f'edit_receiver_list_{list_id}'), InlineKeyboardButton(text='➕ Добавить получателей', callback_data=f'add_to_list_{list_id}')], [InlineKeyboardButton(text='🗑️ Удалить список', callback_data=f'delete_receiver_list_{list_id}')]]
+        keyboard_buttons = [[InlineKeyboardButton(text='✏️ Редактировать название', callback_data=EditReceiverList(list_id=list_id).pack()), InlineKeyboardButton(text='➕ Добавить получателей', callback_data=AddToReceiverList(list_id=list_id).pack())], [InlineKeyboardButton(text='🗑️ Удалить список', callback_data=DeleteReceiverList(list_id=list_id).pack())]]
         if receivers:
-            keyboard_buttons.append([InlineKeyboardButton(text='📝 Управление получателями', callback_data=f'manage_receivers_{list_id}')])
+            keyboard_buttons.append([InlineKeyboardButton(text='📝 Управление получателями', callback_data=ManageReceivers(list_id=list_id).pack())])
         keyboard_buttons.append([InlineKeyboardButton(text='❌ Закрыть', callback_data='cancel_receiver_lists')])
         await message.answer(text, parse_mode=None, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard_buttons))
         await message.answer(
@@ -653,27 +665,27 @@ async def process_editing_list_name(message: Message, state: FSMContext):
         await message.answer('❌ Не удалось обновить список', reply_markup=get_main_keyboard(is_admin=True))
         await state.clear()
 
-@router.callback_query(F.data.startswith('delete_receiver_list_'))
-async def delete_receiver_list_handler(callback: CallbackQuery):
+@callback_registry.route(DeleteReceiverList)
+async def delete_receiver_list_handler(callback: CallbackQuery, callback_data: DeleteReceiverList):
     if not is_admin(callback.from_user.id):
         await callback.answer('❌ У вас нет прав', show_alert=True)
         return
     try:
-        list_id = int(callback.data.split('_')[3])
+        list_id = callback_data.list_id
         receiver_list = await crud.get_report_receiver_list(list_id)
         if not receiver_list:
             await callback.answer('Список не найден', show_alert=True)
             return
-        receivers = await crud.get_receivers_by_list(list_id)
-        await callback.message.edit_text(f'🗑️ УДАЛЕНИЕ СПИСКА\n\nНазвание: {receiver_list.name}\nПолучателей: {len(receivers)}\n\n⚠️ Вы уверены? Список будет помечен как неактивный.', parse_mode=None, reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text='✅ Да, удалить', callback_data=f'confirm_delete_list_{list_id}'), InlineKeyboardButton(text='❌ Отмена', callback_data='cancel_receiver_lists')]]))
+        _, receivers_total = await crud.get_receivers_page(list_id, limit=1)
+        await callback.message.edit_text(f'🗑️ УДАЛЕНИЕ СПИСКА\n\nНазвание: {receiver_list.name}\nПолучателей: {receivers_total}\n\n⚠️ Вы уверены? Список будет помечен как неактивный.', parse_mode=None, reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text='✅ Да, удалить', callback_data=ConfirmDeleteReceiverList(list_id=list_id).pack()), InlineKeyboardButton(text='❌ Отмена', callback_data='cancel_receiver_lists')]]))
         await callback.answer()
     except Exception as e:
         logger.error(f'Ошибка при удалении списка: {e}', exc_info=True)
         await callback.answer('Произошла ошибка', show_alert=True)
 
-@router.callback_query(F.data.startswith('confirm_delete_list_'))
-async def confirm_delete_list_handler(callback: CallbackQuery):
-    list_id = int(callback.data.split('_')[3])
+@callback_registry.route(ConfirmDeleteReceiverList)
+async def confirm_delete_list_handler(callback: CallbackQuery, callback_data: ConfirmDeleteReceiverList):
+    list_id = callback_data.list_id
     success = await crud.delete_report_receiver_list(list_id)
     if success:
         await callback.message.edit_text('✅ Список удален (помечен как неактивный)')
@@ -683,9 +695,9 @@ async def confirm_delete_list_handler(callback: CallbackQuery):
         await callback.message.edit_text('❌ Не удалось удалить список')
         await callback.answer('Ошибка', show_alert=True)
 
-@router.callback_query(F.data.startswith('confirm_delete_'))
-async def confirm_delete_template(callback: CallbackQuery):
-    template_id = int(callback.data.split('_')[2])
+@callback_registry.route(ConfirmDeleteTemplate)
+async def confirm_delete_template(callback: CallbackQuery, callback_data: ConfirmDeleteTemplate):
+    template_id = callback_data.template_id
     success = await crud.delete_template(template_id)
     if success:
         await callback.message.edit_text('✅ Шаблон удален (помечен как неактивный)')
@@ -695,32 +707,41 @@ async def confirm_delete_template(callback: CallbackQuery):
         await callback.message.edit_text('❌ Не удалось удалить шаблон')
         await callback.answer('Ошибка', show_alert=True)
 
-@router.callback_query(F.data.startswith('manage_receivers_'))
-async def manage_receivers_handler(callback: CallbackQuery, state: FSMContext):
+@callback_registry.route(ManageReceivers)
+async def manage_receivers_handler(callback: CallbackQuery, callback_data: ManageReceivers, state: FSMContext):
     if not is_admin(callback.from_user.id):
         await callback.answer('❌ У вас нет прав', show_alert=True)
         return
     try:
-        list_id = int(callback.data.split('_')[2])
+        list_id = callback_data.list_id
         receiver_list = await crud.get_report_receiver_list(list_id)
         if not receiver_list:
             await callback.answer('Список не найден', show_alert=True)
             return
-        receivers = await crud.get_receivers_by_list(list_id)
+        page = callback_data.page
+        receivers, receivers_total = await crud.get_receivers_page(list_id, offset=page * RECEIVERS_PAGE_SIZE, limit=RECEIVERS_PAGE_SIZE)
         if not receivers:
             await callback.answer('В списке нет получателей', show_alert=True)
             return
         text = f'📝 УПРАВЛЕНИЕ ПОЛУЧАТЕЛЯМИ\n\n'
-        text += f'Список: {receiver_list.name}\n\n'
+        text += f'Список: {receiver_list.name}\n'
+        text += f'Получателей: {receivers_total}, страница {page + 1} из {(receivers_total + RECEIVERS_PAGE_SIZE - 1) // RECEIVERS_PAGE_SIZE}\n\n'
         text += 'Выберите получателя для удаления:\n\n'
         keyboard = []
         for i in range(0, len(receivers), 2):
             row = []
-            row.append(InlineKeyboardButton(text=f'🗑️ {receivers[i].identifier[:20]}', callback_data=f'delete_receiver_{receivers[i].id}'))
+            row.append(InlineKeyboardButton(text=f'🗑️ {receivers[i].identifier[:20]}', callback_data=DeleteReceiver(receiver_id=receivers[i].id).pack()))
             if i + 1 < len(receivers):
-                row.append(InlineKeyboardButton(text=f'🗑️ {receivers[i + 1].identifier[:20]}', callback_data=f'delete_receiver_{receivers[i + 1].id}'))
+                row.append(InlineKeyboardButton(text=f'🗑️ {receivers[i + 1].identifier[:20]}', callback_data=DeleteReceiver(receiver_id=receivers[i + 1].id).pack()))
             keyboard.append(row)
-        keyboard.append([InlineKeyboardButton(text='◀️ Назад к списку', callback_data=f'select_receiver_list_{list_id}')])
+        nav_buttons = []
+        if page > 0:
+            nav_buttons.append(InlineKeyboardButton(text='◀️ Назад', callback_data=ManageReceivers(list_id=list_id, page=page - 1).pack()))
+        if (page + 1) * RECEIVERS_PAGE_SIZE < receivers_total:
+            nav_buttons.append(InlineKeyboardButton(text='Вперед ▶️', callback_data=ManageReceivers(list_id=list_id, page=page + 1).pack()))
+        if nav_buttons:
+            keyboard.append(nav_buttons)
+        keyboard.append([InlineKeyboardButton(text='◀️ Назад к списку', callback_data=SelectReceiverList(list_id=list_id).pack())])
         keyboard.append([InlineKeyboardButton(text='❌ Отмена', callback_data='cancel_receiver_lists')])
         await callback.message.edit_text(text, parse_mode=None, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
         await callback.answer()
@@ -729,13 +750,13 @@ async def manage_receivers_handler(callback: CallbackQuery, state: FSMContext):
         logger.error(f'Ошибка при управлении получателями: {e}', exc_info=True)
         await callback.answer('Произошла ошибка', show_alert=True)
 
-@router.callback_query(F.data.startswith('delete_receiver_'))
-async def delete_receiver_handler(callback: CallbackQuery):
+@callback_registry.route(DeleteReceiver)
+async def delete_receiver_handler(callback: CallbackQuery, callback_data: DeleteReceiver):
     if not is_admin(callback.from_user.id):
         await callback.answer('❌ У вас нет прав', show_alert=True)
         return
     try:
-        receiver_id = int(callback.data.split('_')[2])
+        receiver_id = callback_data.receiver_id
         from database import ReportReceiver, async_session_maker
         from sqlalchemy import select
         async with async_session_maker() as session:
@@ -750,20 +771,20 @@ async def delete_receiver_handler(callback: CallbackQuery):
         if success:
             await callback.answer(f'✅ Получатель {identifier} удален')
             receiver_list = await crud.get_report_receiver_list(list_id)
-            receivers = await crud.get_receivers_by_list(list_id)
+            receivers, receivers_total = await crud.get_receivers_page(list_id, limit=20)
             text = f'📋 СПИСОК: {receiver_list.name}\n\n'
             if receivers:
-                text += f'📝 Получатели ({len(receivers)}):\n'
-                for i, rec in enumerate(receivers[:20], 1):
+                text += f'📝 Получатели ({receivers_total}):\n'
+                for i, rec in enumerate(receivers, 1):
                     text += f'{i}. {rec.identifier}\n'
-                if len(receivers) > 20:
-                    text += f'\n... и еще {len(receivers) - 20} получателей\n'
+                if receivers_total > 20:
+                    text += f'\n... и еще {receivers_total - 20} получателей\n'
             else:
                 text += '📝 Получателей пока нет.\n'
             text += '\nВыберите действие:'
-            keyboard_buttons = [[InlineKeyboardButton(text='✏️ Редактировать название', callback_data=f'edit_receiver_list_{list_id}'), InlineKeyboardButton(text='➕ Добавить получателей', callback_data=f'add_to_list_{list_id}')], [InlineKeyboardButton(text='🗑️ Удалить список', callback_data=f'delete_receiver_list_{list_id}')]]
+            keyboard_buttons = [[InlineKeyboardButton(text='✏️ Редактировать название', callback_data=EditReceiverList(list_id=list_id).pack()), InlineKeyboardButton(text='➕ Добавить получателей', callback_data=AddToReceiverList(list_id=list_id).pack())], [InlineKeyboardButton(text='🗑️ Удалить список', callback_data=DeleteReceiverList(list_id=list_id).pack())]]
             if receivers:
-                keyboard_buttons.append([InlineKeyboardButton(text='📝 Управление получателями', callback_data=f'manage_receivers_{list_id}')])
+                keyboard_buttons.append([InlineKeyboardButton(text='📝 Управление получателями', callback_data=ManageReceivers(list_id=list_id).pack())])
             keyboard_buttons.append([InlineKeyboardButton(text='❌ Отмена', callback_data='cancel_receiver_lists')])
             await callback.message.edit_text(text, parse_mode=None, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard_buttons))
             logger.info(f"Получатель #{receiver_id} удален из списка {list_id} пользователем {callback.from_user.id}")
@@ -773,14 +794,14 @@ async def delete_receiver_handler(callback: CallbackQuery):
         logger.error(f'Ошибка при удалении получателя: {e}', exc_info=True)
         await callback.answer('Произошла ошибка', show_alert=True)
 
-@router.callback_query(F.data == 'cancel_receiver_lists')
+@callback_registry.route('cancel_receiver_lists')
 async def cancel_receiver_lists_handler(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.edit_text('❌ Отменено.')
     await callback.answer()
     await callback.message.answer('Выберите действие:', reply_markup=get_main_keyboard(is_admin=True))
 
-@router.callback_query(F.data == 'close_settings')
+@callback_registry.route('close_settings')
 async def close_settings_handler(callback: CallbackQuery):
     await callback.message.edit_text('⚙️ Настройки закрыты')
     await callback.answer()
@@ -796,19 +817,27 @@ async def cmd_settings(message: Message):
     keyboard = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text='📋 Получатели отчетов', callback_data='report_receivers_menu')], [InlineKeyboardButton(text='📝 Шаблоны', callback_data='open_templates')], [InlineKeyboardButton(text='❌ Закрыть', callback_data='close_settings')]])
     await message.answer(settings_text, reply_markup=keyboard)
 import asyncio
+import os
+from datetime import datetime
 from aiogram import Router, F, Bot
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import Message, CallbackQuery, ChatMemberUpdated
+from functools import lru_cache
+from typing import Optional
+from aiogram.types import Message, CallbackQuery, ChatMemberUpdated, FSInputFile, User
+from aiogram.fsm.storage.base import BaseStorage
 import database as crud
 from utils import parse_recipients_list, validate_recipients_list, format_recipient_list
 from utils import logger
-from config import MAIN_ADMIN_ID
+from config import MAIN_ADMIN_ID, CAMPAIGN_EXECUTION
 from keyboards import get_main_keyboard, get_cancel_keyboard, get_recipients_keyboard
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 from keyboards import get_templates_keyboard, get_confirm_mailing_keyboard, get_campaigns_keyboard, get_delay_keyboard, get_max_recipients_keyboard
-from services import generate_personal_report
+from keyboards import get_report_keyboard
+from callbacks import callback_registry, PickTemplate, TemplatesPage, Delay, MaxRecipients, ConfirmMailing, SelectBotGroup, SelectGroup, ViewCampaign, CampaignsPage, ReportPage, ReportCsv
+from services import render_personal_report_page, build_personal_report_csv, export_sending_history
+from group_registry import group_registry
 
 def is_admin(user_id: int) -> bool:
     return user_id == MAIN_ADMIN_ID
@@ -824,42 +853,24 @@ class MailingStates(StatesGroup):
 class GroupStates(StatesGroup):
     waiting_for_group_link = State()
 
+@lru_cache(maxsize=None)
 def get_cancel_keyboard_for_groups() -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text='❌ Отмена')]], resize_keyboard=True)
 
 @router.message(Command('start'))
-async def cmd_start(message: Message):
+async def cmd_start(message: Message, bot_info: User):
     user = await crud.get_or_create_user(telegram_id=message.from_user.id, username=message.from_user.username, first_name=message.from_user.first_name, last_name=message.from_user.last_name)
     is_admin_user = is_admin(message.from_user.id)
     welcome_text = f'👋 Добро пожаловать в бота для рассылок!\n\nВы можете:\n📧 Создавать новые рассылки\n📊 Просматривать свои рассылки и отчеты\nℹ️ Получать помощь\n\nИспользуйте меню или команды для навигации.'
     if is_admin_user:
         welcome_text += '\n\n🔑 Вы являетесь администратором и имеете доступ к дополнительным функциям.'
-    try:
-        bot_info = await message.bot.get_me()
-        bot_username = bot_info.username
-        if bot_username:
-            welcome_text += f'\n\n🤖 Чтобы добавить бота в группу/канал, используйте команду /invite'
-    except:
-        pass
+    if bot_info.username:
+        welcome_text += '\n\n🤖 Чтобы добавить бота в группу/канал, используйте команду /invite'
     await message.answer(welcome_text, reply_markup=get_main_keyboard(is_admin=is_admin_user))
     logger.info(f'Пользователь {message.from_user.id} зарегистрирован/вошел в бота')
 
-@router.message(Command('help'))
-@router.message(F.text == 'ℹ️ Помощь')
-async def cmd_help(message: Message, bot: Bot):
-    is_admin_user = is_admin(message.from_user.id)
-    try:
-        bot_info = await bot.get_me()
-        bot_username = bot_info.username
-        if bot_username:
-            add_to_group_link = f'https://t.me/{bot_username}?startgroup'
-            add_to_channel_link = f'https://t.me/{bot_username}?startchannel'
-            invite_text = f'\n🤖 ДОБАВЛЕНИЕ БОТА В ГРУППУ/КАНАЛ:\n\n📱 Добавить в группу:\n{add_to_group_link}\n\n📢 Добавить в канал:\n{add_to_channel_link}\n\n💡 ИНСТРУКЦИЯ:\n1. Откройте ссылку выше\n2. Выберите группу/канал\n3. Нажмите "Добавить" или "Пригласить"\n4. Бот будет добавлен в группу/канал\n\n⚠️ ВАЖНО:\n• Бот должен быть администратором группы/канала для работы некоторых функций\n• После добавления бот автоматически появится в меню "👥 Группы"\n'
-        else:
-            invite_text = '\n🤖 ДОБАВЛЕНИЕ БОТА В ГРУППУ/КАНАЛ:\n\n⚠️ У бота нет username. Для добавления бота:\n1. Откройте настройки группы/канала\n2. Перейдите в "Участники" → "Добавить участников"\n3. Найдите бота по его ID или попросите администратора добавить его\n\nИли настройте username для бота через @BotFather\n'
-    except Exception as e:
-        logger.error(f'Ошибка при получении информации о боте: {e}')
-        invite_text = '\n\n⚠️ Не удалось получить ссылки для добавления бота'
+@lru_cache(maxsize=None)
+def _help_text(is_admin_user: bool, bot_username: Optional[str]) -> str:
     help_text = 'ℹ️ СПРАВКА ПО ИСПОЛЬЗОВАНИЮ БОТА\n\n📋 ОСНОВНЫЕ ФУНКЦИИ:\n\n📧 Новая рассылка\n   Создайте новую рассылку по вашим получателям\n   • Выберите шаблон\n   • Введите список получателей\n   • Подтвердите запуск\n\n📊 Мои рассылки\n   Просмотрите историю ваших рассылок\n   • Список всех ваших рассылок\n   • Просмотр детальных отчетов\n   • Статистика по каждой рассылке\n\n📝 Команды:\n   /start - регистрация и главное меню\n   /help - эта справка\n   /invite - получить ссылки для добавления бота в группы/каналы\n   /report <ID> - просмотр отчета по ID рассылки\n   Пример: /report 123\n\n📝 ФОРМАТ СПИСКА ПОЛУЧАТЕЛЕЙ:\n   • @username (пользователи)\n   • user_id (число, например: 123456789)\n   • Ссылки: https://t.me/user или t.me/user\n   • Группы/каналы: @groupname или https://t.me/groupname\n   • Разделители: запятая, пробел, новая строка\n   \n   Пример:\n   @user1, 123456789, @user2\n   https://t.me/user3'
     if is_admin_user:
         help_text += '\n\n🔑 АДМИН-ФУНКЦИИ:\n\n'
@@ -873,7 +884,10 @@ async def cmd_help(message: Message, bot: Bot):
         help_text += '📝 АДМИН-КОМАНДЫ:\n'
         help_text += '   /add_template - создать шаблон\n'
         help_text += '   /set_report_receivers - настройка получателей отчетов\n'
-        help_text += '   /templates_list - список всех шаблонов'
+        help_text += '   /templates_list - список всех шаблонов\n'
+        help_text += '   /export_history <ID | дата дата> [csv|jsonl] [gz] - выгрузка истории отправок\n'
+        help_text += '   /slow_handlers [N] - самые медленные обработчики\n'
+        help_text += '   /memory [start|stop|top|diff|objects] - профилирование памяти'
     else:
         help_text += '\n\n💡 СОВЕТ:\n'
         help_text += 'Если у вас нет шаблонов для рассылок,\n'
@@ -881,29 +895,36 @@ async def cmd_help(message: Message, bot: Bot):
         help_text += '📱 ОТПРАВКА ОТ ВАШЕГО ИМЕНИ:\n'
         help_text += '/setup_my_client - настроить отправку от вашего имени\n'
         help_text += '/my_client_status - проверить статус'
-    try:
-        bot_info = await bot.get_me()
-        bot_username = bot_info.username
-        if bot_username:
-            add_to_group_link = f'https://t.me/{bot_username}?startgroup'
-            add_to_channel_link = f'https://t.me/{bot_username}?startchannel'
-            invite_text = f'\n\n🤖 ДОБАВЛЕНИЕ БОТА В ГРУППУ/КАНАЛ:\n\n📱 Добавить в группу:\n{add_to_group_link}\n\n📢 Добавить в канал:\n{add_to_channel_link}\n\n💡 ИНСТРУКЦИЯ:\n1. Нажмите на ссылку выше (для группы или канала)\n2. Выберите группу/канал из списка\n3. Нажмите "Добавить" или "Пригласить"\n4. Бот будет добавлен в группу/канал\n\n⚠️ ВАЖНО:\n• После добавления бот автоматически появится в меню "👥 Группы"\n• Для некоторых функций бот должен быть администратором\n• Если ссылки не работают, попробуйте добавить бота через настройки группы:\n  Настройки → Участники → Добавить участников → Найдите @{bot_username}\n\n💬 Или используйте команду /invite для получения ссылок'
-        else:
-            invite_text = '\n\n🤖 ДОБАВЛЕНИЕ БОТА В ГРУППУ/КАНАЛ:\n\n⚠️ У бота нет username. Для добавления бота:\n1. Откройте настройки группы/канала\n2. Перейдите в "Участники" → "Добавить участников"\n3. Найдите бота по его ID или попросите администратора добавить его\n\n💡 Чтобы настроить username для бота:\n1. Откройте @BotFather в Telegram\n2. Отправьте /mybots\n3. Выберите вашего бота\n4. Выберите "Edit Bot" → "Edit Username"\n5. Установите username (например: my_mailing_bot)\n\nПосле настройки username вы сможете использовать ссылки для добавления бота.'
-    except Exception as e:
-        logger.error(f'Ошибка при получении информации о боте: {e}')
-        invite_text = '\n\n⚠️ Не удалось получить ссылки для добавления бота'
-    await message.answer(help_text + invite_text, reply_markup=get_main_keyboard(is_admin=is_admin_user), parse_mode=None)
+    if bot_username:
+        add_to_group_link = f'https://t.me/{bot_username}?startgroup'
+        add_to_channel_link = f'https://t.me/{bot_username}?startchannel'
+        invite_text = f'\n\n🤖 ДОБАВЛЕНИЕ БОТА В ГРУППУ/КАНАЛ:\n\n📱 Добавить в группу:\n{add_to_group_link}\n\n📢 Добавить в канал:\n{add_to_channel_link}\n\n💡 ИНСТРУКЦИЯ:\n1. Нажмите на ссылку выше (для группы или канала)\n2. Выберите группу/канал из списка\n3. Нажмите "Добавить" или "Пригласить"\n4. Бот будет добавлен в группу/канал\n\n⚠️ ВАЖНО:\n• После добавления бот автоматически появится в меню "👥 Группы"\n• Для некоторых функций бот должен быть администратором\n• Если ссылки не работают, попробуйте добавить бота через настройки группы:\n  Настройки → Участники → Добавить участников → Найдите @{bot_username}\n\n💬 Или используйте команду /invite для получения ссылок'
+    else:
+        invite_text = '\n\n🤖 ДОБАВЛЕНИЕ БОТА В ГРУППУ/КАНАЛ:\n\n⚠️ У бота нет username. Для добавления бота:\n1. Откройте настройки группы/канала\n2. Перейдите в "Участники" → "Добавить участников"\n3. Найдите бота по его ID или попросите администратора добавить его\n\n💡 Чтобы настроить username для бота:\n1. Откройте @BotFather в Telegram\n2. Отправьте /mybots\n3. Выберите вашего бота\n4. Выберите "Edit Bot" → "Edit Username"\n5. Установите username (например: my_mailing_bot)\n\nПосле настройки username вы сможете использовать ссылки для добавления бота.'
+    return help_text + invite_text
+
+@router.message(Command('help'))
+@router.message(F.text == 'ℹ️ Помощь')
+async def cmd_help(message: Message, bot_info: User):
+    is_admin_user = is_admin(message.from_user.id)
+    await message.answer(_help_text(is_admin_user, bot_info.username), reply_markup=get_main_keyboard(is_admin=is_admin_user), parse_mode=None)
+
+INVITE_TROUBLESHOOTING_TEXT = '\n\n🔧 ЕСЛИ НЕ ПОЛУЧАЕТСЯ ДОБАВИТЬ:\n\n1. Проверьте права:\n   • Вы должны быть администратором группы/канала\n   • Или попросите администратора добавить бота\n\n2. Попробуйте разные способы:\n   • Через ссылку (если есть username)\n   • Через поиск @username\n   • Через ID бота\n\n3. Если ничего не помогает:\n   • Убедитесь, что бот активен\n   • Проверьте, что группа/канал не заблокированы\n   • Попробуйте добавить бота через веб-версию Telegram\n\n4. После добавления:\n   • Бот автоматически появится в меню "👥 Группы"\n   • Для работы некоторых функций бот должен быть администратором'
+
+@lru_cache(maxsize=None)
+def _invite_text(bot_username: Optional[str], bot_id: int) -> str:
+    if bot_username:
+        add_to_group_link = f'https://t.me/{bot_username}?startgroup'
+        add_to_channel_link = f'https://t.me/{bot_username}?startchannel'
+        return f'🤖 ДОБАВЛЕНИЕ БОТА В ГРУППУ/КАНАЛ\n\n📱 СПОСОБ 1: Через ссылку (рекомендуется)\nДобавить в группу:\n{add_to_group_link}\n\nДобавить в канал:\n{add_to_channel_link}\n\n💡 ИНСТРУКЦИЯ для ссылок:\n1. Нажмите на ссылку выше\n2. Выберите группу/канал из списка\n3. Нажмите "Добавить" или "Пригласить"\n\n📱 СПОСОБ 2: Через настройки группы\n1. Откройте группу/канал\n2. Настройки → Участники → Добавить участников\n3. Введите: @{bot_username}\n4. Или найдите бота в списке и добавьте\n\n📱 СПОСОБ 3: Через поиск по ID\n1. Откройте группу/канал\n2. Настройки → Участники → Добавить участников\n3. Введите ID бота: {bot_id}\n4. Добавьте бота\n\n⚠️ ВАЖНО:\n• После добавления бот автоматически появится в меню "👥 Группы"\n• Для некоторых функций бот должен быть администратором\n• Если вы администратор группы, вы можете добавить бота напрямую\n• Если вы не администратор, попросите администратора добавить бота'
+    return f'🤖 ДОБАВЛЕНИЕ БОТА В ГРУППУ/КАНАЛ\n\n⚠️ У бота нет username. Для добавления бота:\n\n📱 СПОСОБ 1: Через ID бота\n1. Откройте настройки группы/канала\n2. Перейдите в "Участники" → "Добавить участников"\n3. Введите ID бота: {bot_id}\n4. Добавьте бота\n\n📱 СПОСОБ 2: Через @BotFather\n1. Откройте @BotFather в Telegram\n2. Отправьте /mybots\n3. Выберите вашего бота\n4. Выберите "Edit Bot" → "Edit Username"\n5. Установите username (например: my_mailing_bot)\n6. После настройки username используйте команду /invite для получения ссылок\n\n💡 РЕКОМЕНДАЦИЯ:\nНастройте username для бота - это самый простой способ добавления в группы.'
 
 @router.message(Command('invite'))
-async def cmd_invite(message: Message, bot: Bot):
+async def cmd_invite(message: Message, bot_info: User):
     try:
-        bot_info = await bot.get_me()
         bot_username = bot_info.username
-        bot_id = bot_info.id
+        invite_text = _invite_text(bot_username, bot_info.id)
         if bot_username:
-            add_to_group_link = f'https://t.me/{bot_username}?startgroup'
-            add_to_channel_link = f'https://t.me/{bot_username}?startchannel'
             user_groups_text = ''
             try:
                 from services import get_user_groups
@@ -922,11 +943,8 @@ async def cmd_invite(message: Message, bot: Bot):
                         user_groups_text += f'... и еще {len(user_groups) - 10} групп\n'
             except Exception as e:
                 logger.warning(f'Не удалось получить группы пользователя через Client API: {e}')
-            invite_text = f'🤖 ДОБАВЛЕНИЕ БОТА В ГРУППУ/КАНАЛ\n\n📱 СПОСОБ 1: Через ссылку (рекомендуется)\nДобавить в группу:\n{add_to_group_link}\n\nДобавить в канал:\n{add_to_channel_link}\n\n💡 ИНСТРУКЦИЯ для ссылок:\n1. Нажмите на ссылку выше\n2. Выберите группу/канал из списка\n3. Нажмите "Добавить" или "Пригласить"\n\n📱 СПОСОБ 2: Через настройки группы\n1. Откройте группу/канал\n2. Настройки → Участники → Добавить участников\n3. Введите: @{bot_username}\n4. Или найдите бота в списке и добавьте\n\n📱 СПОСОБ 3: Через поиск по ID\n1. Откройте группу/канал\n2. Настройки → Участники → Добавить участников\n3. Введите ID бота: {bot_id}\n4. Добавьте бота\n\n⚠️ ВАЖНО:\n• После добавления бот автоматически появится в меню "👥 Группы"\n• Для некоторых функций бот должен быть администратором\n• Если вы администратор группы, вы можете добавить бота напрямую\n• Если вы не администратор, попросите администратора добавить бота{user_groups_text}'
-        else:
-            invite_text = f'🤖 ДОБАВЛЕНИЕ БОТА В ГРУППУ/КАНАЛ\n\n⚠️ У бота нет username. Для добавления бота:\n\n📱 СПОСОБ 1: Через ID бота\n1. Откройте настройки группы/канала\n2. Перейдите в "Участники" → "Добавить участников"\n3. Введите ID бота: {bot_id}\n4. Добавьте бота\n\n📱 СПОСОБ 2: Через @BotFather\n1. Откройте @BotFather в Telegram\n2. Отправьте /mybots\n3. Выберите вашего бота\n4. Выберите "Edit Bot" → "Edit Username"\n5. Установите username (например: my_mailing_bot)\n6. После настройки username используйте команду /invite для получения ссылок\n\n💡 РЕКОМЕНДАЦИЯ:\nНастройте username для бота - это самый простой способ добавления в группы.'
-        additional_info = '\n\n🔧 ЕСЛИ НЕ ПОЛУЧАЕТСЯ ДОБАВИТЬ:\n\n1. Проверьте права:\n   • Вы должны быть администратором группы/канала\n   • Или попросите администратора добавить бота\n\n2. Попробуйте разные способы:\n   • Через ссылку (если есть username)\n   • Через поиск @username\n   • Через ID бота\n\n3. Если ничего не помогает:\n   • Убедитесь, что бот активен\n   • Проверьте, что группа/канал не заблокированы\n   • Попробуйте добавить бота через веб-версию Telegram\n\n4. После добавления:\n   • Бот автоматически появится в меню "👥 Группы"\n   • Для работы некоторых функций бот должен быть администратором'
-        await message.answer(invite_text + additional_info, reply_markup=get_main_keyboard(is_admin=is_admin(message.from_user.id)), parse_mode=None)
+            invite_text += user_groups_text
+        await message.answer(invite_text + INVITE_TROUBLESHOOTING_TEXT, reply_markup=get_main_keyboard(is_admin=is_admin(message.from_user.id)), parse_mode=None)
         logger.info(f'Пользователь {message.from_user.id} запросил ссылки для добавления бота')
     except Exception as e:
         logger.error(f'Ошибка при получении ссылок для добавления бота: {e}', exc_info=True)
@@ -942,20 +960,23 @@ async def cmd_new_mailing(message: Message, state: FSMContext):
     await message.answer('Выберите шаблон для рассылки:', reply_markup=get_templates_keyboard(templates))
     await state.set_state(MailingStates.waiting_for_template)
 
-@router.callback_query(StateFilter(MailingStates.waiting_for_template), F.data.startswith('template_'))
-async def process_template_selection(callback: CallbackQuery, state: FSMContext):
+@callback_registry.route(TemplatesPage)
+async def process_templates_pagination(callback: CallbackQuery, callback_data: TemplatesPage):
+    templates = await crud.get_all_active_templates()
+    await callback.message.edit_reply_markup(reply_markup=get_templates_keyboard(templates, page=callback_data.page, for_selection=callback_data.for_selection))
+    await callback.answer()
+
+RECIPIENTS_PROMPT_TEXT = '📝 Введите список получателей:\n\nФормат:\n• @username (пользователи)\n• user_id (число)\n• Ссылки: https://t.me/user или t.me/user\n• Группы/каналы: @groupname или https://t.me/groupname\n• Приватные группы: https://t.me/joinchat/HASH или t.me/+HASH\n\n⚠️ Для приватных групп: бот автоматически присоединится по invite-ссылке\n\nРазделители: запятая, пробел, новая строка\n\nПример:\n@user1, 123456789, @user2, @mygroup\nhttps://t.me/joinchat/ABC123 (приватная группа)'
+
+@callback_registry.route(PickTemplate, state=MailingStates.waiting_for_template)
+async def process_template_selection(callback: CallbackQuery, callback_data: PickTemplate, state: FSMContext):
     try:
-        if callback.data == 'cancel':
-            await state.clear()
-            await callback.message.edit_text('Отменено.')
-            await callback.answer()
-            return
-        template_id = int(callback.data.split('_')[1])
+        template_id = callback_data.template_id
         template = await crud.get_template(template_id)
         if not template:
             await callback.answer('Шаблон не найден', show_alert=True)
-        logger.warning(f"Шаблон #{template_id} не найден для пользователя {callback.from_user.id}")
-        logger.warning(f"Шаблон #{template_id} не найден для пользователя {callback.from_user.id}")
+            logger.warning(f"Шаблон #{template_id} не найден для пользователя {callback.from_user.id}")
+            return
     except ValueError as e:
         logger.error(f'Ошибка парсинга template_id из {callback.data}: {e}')
         await callback.answer('Ошибка при выборе шаблона', show_alert=True)
@@ -969,7 +990,7 @@ async def process_template_selection(callback: CallbackQuery, state: FSMContext)
     await state.set_state(MailingStates.waiting_for_recipients)
     logger.info(f'Шаг 2: Состояние установлено в waiting_for_recipients для пользователя {callback.from_user.id}')
     await callback.answer(f'✅ Выбран: {template.name}')
-    recipients_text = f'✅ Выбран шаблон: {template.name}\n\n📝 Введите список получателей:\n\nФормат:\n• @username (пользователи)\n• user_id (число)\n• Ссылки: https://t.me/user или t.me/user\n• Группы/каналы: @groupname или https://t.me/groupname\n• Приватные группы: https://t.me/joinchat/HASH или t.me/+HASH\n\n⚠️ Для приватных групп: бот автоматически присоединится по invite-ссылке\n\nРазделители: запятая, пробел, новая строка\n\nПример:\n@user1, 123456789, @user2, @mygroup\nhttps://t.me/joinchat/ABC123 (приватная группа)'
+    recipients_text = f'✅ Выбран шаблон: {template.name}\n\n' + RECIPIENTS_PROMPT_TEXT
     try:
         sent_message = await callback.message.answer(recipients_text, parse_mode=None, reply_markup=get_recipients_keyboard())
         logger.info(f'Шаг 3: Сообщение с инструкциями отправлено пользователю {callback.from_user.id}, message_id: {sent_message.message_id}')
@@ -984,6 +1005,25 @@ async def process_template_selection(callback: CallbackQuery, state: FSMContext)
         await callback.message.answer(f'✅ Выбран шаблон: {template.name}\n\nВведите список получателей (через запятую или пробел):\nПример: @user1, 123456789, @user2', reply_markup=get_cancel_keyboard())
     
     logger.info(f"Пользователь {callback.from_user.id} выбрал шаблон #{template_id} '{template.name}', готов к вводу получателей")
+
+@router.message(StateFilter(MailingStates.waiting_for_recipients))
+async def process_recipients(message: Message, state: FSMContext):
+    if message.text == '❌ Отмена':
+        await state.clear()
+        await message.answer('Отменено.', reply_markup=get_main_keyboard(is_admin=is_admin(message.from_user.id)))
+        return
+    if message.text == '👥 В группе':
+        await show_groups_selection(message, state)
+        return
+    from services import join_chat_by_link, get_chat_info_by_link
+    try:
+        recipients = parse_recipients_list(message.text or '')
+    except Exception as e:
+        logger.error(f'Ошибка при парсинге получателей: {e}', exc_info=True)
+        recipients = []
+    if not recipients:
+        await message.answer("❌ Не удалось распознать получателей в вашем сообщении.\n\nПопробуйте еще раз или нажмите '👥 В группе' для выбора группы:", reply_markup=get_recipients_keyboard())
+        return
     final_recipients = []
     for recipient in recipients:
         if recipient['type'] in ('link', 'invite_link') or 't.me' in recipient['original'].lower():
@@ -1041,15 +1081,10 @@ async def process_template_selection(callback: CallbackQuery, state: FSMContext)
     await state.set_state(MailingStates.waiting_for_delay)
     logger.info(f'Пользователь {message.from_user.id} ввел {len(final_recipients)} получателей (включая участников групп), ожидается выбор интервала')
 
-@router.callback_query(StateFilter(MailingStates.waiting_for_delay), F.data.startswith('delay_'))
-async def process_delay_selection(callback: CallbackQuery, state: FSMContext):
-    if callback.data == 'cancel':
-        await state.clear()
-        await callback.message.edit_text('❌ Создание рассылки отменено.')
-        await callback.answer()
-        return
+@callback_registry.route(Delay, state=MailingStates.waiting_for_delay)
+async def process_delay_selection(callback: CallbackQuery, callback_data: Delay, state: FSMContext):
     try:
-        delay_seconds = int(callback.data.split('_')[1])
+        delay_seconds = callback_data.seconds
     except (ValueError, IndexError):
         await callback.answer('❌ Ошибка: неверный интервал', show_alert=True)
         return
@@ -1069,10 +1104,6 @@ async def process_delay_selection(callback: CallbackQuery, state: FSMContext):
         await callback.answer('❌ Шаблон не найден', show_alert=True)
         await state.clear()
         return
-    campaign = await crud.create_campaign(owner_id=callback.from_user.id, template_id=template_id, delay_seconds=delay_seconds)
-    recipient_data = [{'original': r['original'], 'normalized': r['normalized']} for r in recipients]
-    await crud.add_recipients(campaign.id, recipient_data)
-    await state.update_data(campaign_id=campaign.id)
     if delay_seconds < 60:
         delay_text = f'{delay_seconds} сек'
     else:
@@ -1093,15 +1124,10 @@ async def process_delay_selection(callback: CallbackQuery, state: FSMContext):
     await state.set_state(MailingStates.waiting_for_max_recipients)
     logger.info(f'Пользователь {callback.from_user.id} выбрал интервал {delay_seconds} сек, ожидается выбор количества получателей')
 
-@router.callback_query(StateFilter(MailingStates.waiting_for_max_recipients), F.data.startswith('max_recipients_'))
-async def process_max_recipients_selection(callback: CallbackQuery, state: FSMContext):
-    if callback.data == 'cancel':
-        await state.clear()
-        await callback.message.edit_text('❌ Создание рассылки отменено.')
-        await callback.answer()
-        return
+@callback_registry.route(MaxRecipients, state=MailingStates.waiting_for_max_recipients)
+async def process_max_recipients_selection(callback: CallbackQuery, callback_data: MaxRecipients, state: FSMContext):
     try:
-        max_recipients = int(callback.data.split('_')[2])
+        max_recipients = callback_data.count
     except (ValueError, IndexError):
         await callback.answer('❌ Ошибка: неверное количество', show_alert=True)
         return
@@ -1115,15 +1141,17 @@ async def process_max_recipients_selection(callback: CallbackQuery, state: FSMCo
         await callback.answer('❌ Ошибка: данные не найдены. Начните заново.', show_alert=True)
         await state.clear()
         return
-    template = await crud.get_template(template_id)
+    limited_recipients = recipients[:max_recipients]
+    async with crud.unit_of_work():
+        template = await crud.get_template(template_id)
+        if template:
+            campaign = await crud.create_campaign(owner_id=callback.from_user.id, template_id=template_id, delay_seconds=delay_seconds, max_recipients=max_recipients)
+            recipient_data = [{'original': r['original'], 'normalized': r['normalized']} for r in limited_recipients]
+            await crud.add_recipients(campaign.id, recipient_data)
     if not template:
         await callback.answer('❌ Шаблон не найден', show_alert=True)
         await state.clear()
         return
-    limited_recipients = recipients[:max_recipients]
-    campaign = await crud.create_campaign(owner_id=callback.from_user.id, template_id=template_id, delay_seconds=delay_seconds, max_recipients=max_recipients)
-    recipient_data = [{'original': r['original'], 'normalized': r['normalized']} for r in limited_recipients]
-    await crud.add_recipients(campaign.id, recipient_data)
     await state.update_data(campaign_id=campaign.id)
     if delay_seconds < 60:
         delay_text = f'{delay_seconds} сек'
@@ -1152,11 +1180,11 @@ async def process_max_recipients_selection(callback: CallbackQuery, state: FSMCo
     await state.set_state(MailingStates.confirm_mailing)
     logger.info(f'Создана рассылка #{campaign.id} пользователем {callback.from_user.id}')
 
-@router.callback_query(StateFilter(MailingStates.confirm_mailing), F.data.startswith('confirm_mailing_'))
-async def confirm_mailing(callback: CallbackQuery, state: FSMContext):
+@callback_registry.route(ConfirmMailing, state=MailingStates.confirm_mailing)
+async def confirm_mailing(callback: CallbackQuery, callback_data: ConfirmMailing, state: FSMContext):
     from services import is_within_allowed_time
     from datetime import datetime
-    campaign_id = int(callback.data.split('_')[2])
+    campaign_id = callback_data.campaign_id
     campaign = await crud.get_campaign(campaign_id)
     if not campaign:
         await callback.answer('Рассылка не найдена', show_alert=True)
@@ -1169,19 +1197,24 @@ async def confirm_mailing(callback: CallbackQuery, state: FSMContext):
         await callback.message.edit_text(f'❌ Рассылка не может быть запущена вне разрешенного времени.\n\n⏰ Текущее время: {current_time}\n✅ Разрешенное время: с 09:00 до 22:00\n\nПопробуйте запустить рассылку позже.', parse_mode=None)
         await callback.answer('Рассылка разрешена только с 09:00 до 22:00', show_alert=True)
         return
+    if CAMPAIGN_EXECUTION == 'worker':
+        await crud.queue_campaign(campaign.id)
+        await callback.message.edit_text('✅ Рассылка поставлена в очередь! Обработка начнется в ближайшее время...')
+        await callback.answer()
+        await state.clear()
+        await callback.message.answer(f'📥 Рассылка #{campaign.id} в очереди.\nИдентификатор: {campaign.campaign_id}\n\nОтчет будет отправлен после завершения.', reply_markup=get_main_keyboard(is_admin=is_admin(callback.from_user.id)))
+        return
     await callback.message.edit_text('✅ Рассылка запущена! Обработка началась...')
     await callback.answer()
     await state.clear()
     from services import process_mailing
-    from database import Recipient, async_session_maker
-    from sqlalchemy import select
     bot = callback.bot
-    template = await crud.get_template(campaign.template_id)
-    async with async_session_maker() as session:
-        result = await session.execute(select(Recipient).where(Recipient.campaign_id == campaign.id))
-        recipients = list(result.scalars().all())
+    plan = await crud.load_campaign_plan(campaign.id)
+    if not plan:
+        await callback.message.answer('❌ Шаблон рассылки не найден.')
+        return
     import asyncio
-    asyncio.create_task(process_mailing(bot, campaign, template, recipients))
+    asyncio.create_task(process_mailing(bot, plan))
     await callback.message.answer(
         f'📧 Рассылка #{campaign.id} запущена!\n'
         f'Идентификатор: {campaign.campaign_id}\n\n'
@@ -1189,13 +1222,14 @@ async def confirm_mailing(callback: CallbackQuery, state: FSMContext):
         reply_markup=get_main_keyboard(is_admin=is_admin(callback.from_user.id))
     )
 
-@router.callback_query(StateFilter(MailingStates.waiting_for_max_recipients), F.data == 'cancel')
+@callback_registry.route('cancel', state=MailingStates.waiting_for_delay)
+@callback_registry.route('cancel', state=MailingStates.waiting_for_max_recipients)
 async def cancel_max_recipients(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.edit_text('❌ Создание рассылки отменено.')
     await callback.answer()
 
-@router.callback_query(F.data == 'cancel')
+@callback_registry.route('cancel')
 async def cancel_action(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.edit_text('Отменено.')
@@ -1222,23 +1256,23 @@ async def show_groups_selection(message: Message, state: FSMContext):
             username_text = f' @{group.username}' if group.username else ''
             button_text = f'🤖 {group.title or 'Без названия'}{username_text} {members_text}'
             button_text = button_text[:60]
-            keyboard.append([InlineKeyboardButton(text=button_text, callback_data=f'select_bot_group_{group.chat_id}')])
+            keyboard.append([InlineKeyboardButton(text=button_text, callback_data=SelectBotGroup(chat_id=group.chat_id).pack())])
     if user_groups_filtered:
         for group in user_groups_filtered[:10]:
             group_type_emoji = '👥'
             members_text = f'({group['members_count']} участн.)' if group['members_count'] > 0 else ''
             button_text = f'{group_type_emoji} {group['title'][:40]} {members_text}'
             button_text = button_text[:60]
-            keyboard.append([InlineKeyboardButton(text=button_text, callback_data=f'select_group_{group['id']}')])
+            keyboard.append([InlineKeyboardButton(text=button_text, callback_data=SelectGroup(group_id=group['id']).pack())])
     keyboard.append([InlineKeyboardButton(text='❌ Отмена', callback_data='cancel_group_selection')])
     await message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
     await state.set_state(MailingStates.waiting_for_group_selection)
 
-@router.callback_query(StateFilter(MailingStates.waiting_for_group_selection), F.data.startswith('select_bot_group_'))
-async def process_bot_group_selection(callback: CallbackQuery, state: FSMContext, bot: Bot):
+@callback_registry.route(SelectBotGroup, state=MailingStates.waiting_for_group_selection)
+async def process_bot_group_selection(callback: CallbackQuery, callback_data: SelectBotGroup, state: FSMContext, bot: Bot):
     from services import get_group_members
     try:
-        group_id = int(callback.data.split('_')[3])
+        group_id = callback_data.chat_id
         bot_group = await crud.get_bot_group(group_id)
         if not bot_group or not bot_group.is_active:
             await callback.answer('Группа не найдена', show_alert=True)
@@ -1268,11 +1302,11 @@ async def process_bot_group_selection(callback: CallbackQuery, state: FSMContext
         await callback.answer('Произошла ошибка', show_alert=True)
         await state.clear()
 
-@router.callback_query(StateFilter(MailingStates.waiting_for_group_selection), F.data.startswith('select_group_'))
-async def process_group_selection(callback: CallbackQuery, state: FSMContext):
+@callback_registry.route(SelectGroup, state=MailingStates.waiting_for_group_selection)
+async def process_group_selection(callback: CallbackQuery, callback_data: SelectGroup, state: FSMContext):
     from services import get_group_members, get_user_groups
     try:
-        group_id = int(callback.data.split('_')[2])
+        group_id = callback_data.group_id
         groups = await get_user_groups(callback.from_user.id)
         selected_group = None
         for group in groups:
@@ -1304,7 +1338,7 @@ async def process_group_selection(callback: CallbackQuery, state: FSMContext):
         await callback.answer('Произошла ошибка', show_alert=True)
         await state.clear()
 
-@router.callback_query(StateFilter(MailingStates.waiting_for_group_selection), F.data == 'cancel_group_selection')
+@callback_registry.route('cancel_group_selection', state=MailingStates.waiting_for_group_selection)
 async def cancel_group_selection(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.edit_text('❌ Отменено.')
@@ -1321,21 +1355,11 @@ async def handle_bot_chat_member(event: ChatMemberUpdated, bot: Bot):
         if chat.type not in ('group', 'supergroup', 'channel'):
             logger.debug(f'Пропускаем чат типа {chat.type}')
             return
-        chat_type = chat.type
+        group_registry.submit(bot, event)
         if new_status in ('member', 'administrator'):
-            members_count = None
-            try:
-                if chat_type in ('group', 'supergroup'):
-                    chat_info = await bot.get_chat(chat.id)
-                    if hasattr(chat_info, 'members_count') and chat_info.members_count:
-                        members_count = chat_info.members_count
-            except Exception as e:
-                logger.debug(f'Не удалось получить количество участников для {chat.id}: {e}')
-            bot_group = await crud.add_or_update_bot_group(chat_id=chat.id, title=chat.title, username=chat.username, chat_type=chat_type, members_count=members_count, is_active=True)
-            logger.info(f'✅ Бот добавлен в {chat_type} {chat.id} ({chat.title}), сохранено в БД: {bot_group.id}')
+            logger.info(f'✅ Бот добавлен в {chat.type} {chat.id} ({chat.title}), запись в БД поставлена в очередь')
         elif new_status in ('left', 'kicked'):
-            await crud.remove_bot_group(chat.id)
-            logger.info(f'❌ Бот удален из {chat_type} {chat.id} ({chat.title})')
+            logger.info(f'❌ Бот удален из {chat.type} {chat.id} ({chat.title})')
     except Exception as e:
         logger.error(f'Ошибка при обработке события my_chat_member: {e}', exc_info=True)
 
@@ -1406,7 +1430,7 @@ async def cmd_groups(message: Message, bot: Bot, state: FSMContext):
                 text += f'... и еще {len(user_channels_list) - 5} каналов\n'
     await message.answer(text, reply_markup=keyboard, parse_mode=None)
 
-@router.callback_query(F.data == 'add_group_by_link')
+@callback_registry.route('add_group_by_link')
 async def add_group_by_link_handler(callback: CallbackQuery, state: FSMContext):
     from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
     try:
@@ -1423,7 +1447,7 @@ async def add_group_by_link_handler(callback: CallbackQuery, state: FSMContext):
         except:
             pass
 
-@router.callback_query(F.data == 'cancel_add_group')
+@callback_registry.route('cancel_add_group')
 async def cancel_add_group_handler(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.edit_text('❌ Добавление чата отменено.', reply_markup=None)
@@ -1487,7 +1511,7 @@ async def process_group_link(message: Message, state: FSMContext, bot: Bot):
                 await message.answer(f'❌ Не удалось получить информацию о чате:\n{error_msg}\n\nПроверьте ссылку и убедитесь, что:\n• Чат существует\n• Вы являетесь участником чата\n• Ссылка правильная', reply_markup=get_main_keyboard(is_admin=is_admin(message.from_user.id)), parse_mode=None)
     await state.clear()
 
-@router.callback_query(F.data == 'close_groups')
+@callback_registry.route('close_groups')
 async def close_groups_handler(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.edit_text('❌ Закрыто.', reply_markup=None)
@@ -1500,7 +1524,7 @@ async def cmd_my_mailings(message: Message):
     if not campaigns:
         await message.answer("📊 У вас пока нет рассылок.\n\nСоздайте первую рассылку через кнопку '📧 Новая рассылка'", reply_markup=get_main_keyboard(is_admin=is_admin(message.from_user.id)))
         return
-    status_emoji = {'pending': '⏳', 'processing': '🔄', 'completed': '✅', 'failed': '❌'}
+    status_emoji = {'pending': '⏳', 'queued': '📥', 'processing': '🔄', 'completed': '✅', 'failed': '❌'}
     text = f'📊 ВАШИ РАССЫЛКИ\n\nВсего: {len(campaigns)}\n\n'
     text += 'Нажмите на рассылку для просмотра деталей:\n\n'
     for campaign in campaigns[:5]:
@@ -1512,9 +1536,9 @@ async def cmd_my_mailings(message: Message):
         text += f'\n... и еще {len(campaigns) - 5} рассылок'
     await message.answer(text, reply_markup=get_campaigns_keyboard(campaigns))
 
-@router.callback_query(F.data.startswith('campaign_'))
-async def view_campaign(callback: CallbackQuery):
-    campaign_id = int(callback.data.split('_')[1])
+@callback_registry.route(ViewCampaign)
+async def view_campaign(callback: CallbackQuery, callback_data: ViewCampaign):
+    campaign_id = callback_data.campaign_id
     campaign = await crud.get_campaign(campaign_id)
     if not campaign:
         await callback.answer('Рассылка не найдена', show_alert=True)
@@ -1522,20 +1546,66 @@ async def view_campaign(callback: CallbackQuery):
     if campaign.owner_id != callback.from_user.id and (not is_admin(callback.from_user.id)):
         await callback.answer('У вас нет прав на эту рассылку', show_alert=True)
         return
-    report = await generate_personal_report(campaign_id)
-    if report:
+    page = await render_personal_report_page(campaign_id, campaign=campaign)
+    if page:
+        keyboard = get_report_keyboard(campaign_id, page['after_id'], page['next_after_id'])
         try:
-            await callback.message.edit_text(report, parse_mode=None)
+            await callback.message.edit_text(page['text'], reply_markup=keyboard, parse_mode=None)
         except Exception as e:
             logger.warning(f'Не удалось отредактировать сообщение: {e}')
-            await callback.message.answer(report, parse_mode=None)
+            await callback.message.answer(page['text'], reply_markup=keyboard, parse_mode=None)
     else:
         await callback.message.edit_text('❌ Не удалось сгенерировать отчет.')
     await callback.answer()
 
-@router.callback_query(F.data.startswith('campaigns_page_'))
-async def process_campaigns_pagination(callback: CallbackQuery):
-    page = int(callback.data.split('_')[2])
+async def _get_report_campaign(callback: CallbackQuery, campaign_id: int):
+    campaign = await crud.get_campaign(campaign_id)
+    if not campaign:
+        await callback.answer('Рассылка не найдена', show_alert=True)
+        return None
+    if campaign.owner_id != callback.from_user.id and (not is_admin(callback.from_user.id)):
+        await callback.answer('У вас нет прав на эту рассылку', show_alert=True)
+        return None
+    return campaign
+
+@callback_registry.route(ReportPage)
+async def process_report_page(callback: CallbackQuery, callback_data: ReportPage):
+    campaign_id = callback_data.campaign_id
+    after_id = callback_data.after_id
+    campaign = await _get_report_campaign(callback, campaign_id)
+    if not campaign:
+        return
+    page = await render_personal_report_page(campaign_id, after_id, campaign=campaign)
+    if not page:
+        await callback.answer('❌ Не удалось сгенерировать отчет.', show_alert=True)
+        return
+    try:
+        await callback.message.edit_text(page['text'], reply_markup=get_report_keyboard(campaign_id, page['after_id'], page['next_after_id']), parse_mode=None)
+    except Exception as e:
+        logger.warning(f'Не удалось отредактировать сообщение: {e}')
+    await callback.answer()
+
+@callback_registry.route(ReportCsv)
+async def process_report_csv(callback: CallbackQuery, callback_data: ReportCsv):
+    campaign_id = callback_data.campaign_id
+    if not await _get_report_campaign(callback, campaign_id):
+        return
+    await callback.answer('⏳ Формирую CSV...')
+    path = await build_personal_report_csv(campaign_id)
+    if not path:
+        await callback.message.answer('❌ Не удалось сгенерировать отчет.')
+        return
+    try:
+        await callback.message.answer_document(FSInputFile(path, filename=f'report_{campaign_id}.csv'), caption=f'📄 Неотправленные по рассылке #{campaign_id}')
+    except Exception as e:
+        logger.error(f'Ошибка при отправке CSV отчета: {e}')
+        await callback.message.answer('❌ Не удалось отправить отчет. Попробуйте позже.')
+    finally:
+        os.remove(path)
+
+@callback_registry.route(CampaignsPage)
+async def process_campaigns_pagination(callback: CallbackQuery, callback_data: CampaignsPage):
+    page = callback_data.page
     campaigns = await crud.get_user_campaigns(callback.from_user.id)
     await callback.message.edit_reply_markup(reply_markup=get_campaigns_keyboard(campaigns, page=page))
     await callback.answer()
@@ -1558,15 +1628,128 @@ async def cmd_report(message: Message):
     if campaign.owner_id != message.from_user.id and (not is_admin(message.from_user.id)):
         await message.answer('❌ У вас нет прав на просмотр этого отчета.')
         return
-    report = await generate_personal_report(campaign_id)
-    if report:
+    page = await render_personal_report_page(campaign_id, campaign=campaign)
+    if page:
         try:
-            await message.answer(report, parse_mode=None)
+            await message.answer(page['text'], reply_markup=get_report_keyboard(campaign_id, page['after_id'], page['next_after_id']), parse_mode=None)
         except Exception as e:
             logger.error(f'Ошибка при отправке отчета: {e}')
             await message.answer('❌ Не удалось отправить отчет. Попробуйте позже.')
     else:
         await message.answer('❌ Не удалось сгенерировать отчет.')
+
+@router.message(Command('slow_handlers'))
+async def cmd_slow_handlers(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer('❌ У вас нет прав для выполнения этой команды.')
+        return
+    from metrics import handler_metrics, loop_lag_monitor
+    from utils import format_slow_handlers
+    args = message.text.split()[1:]
+    if args and args[0].lower() == 'reset':
+        handler_metrics.reset()
+        await message.answer('✅ Статистика обработчиков сброшена.')
+        return
+    try:
+        limit = int(args[0]) if args else 10
+    except ValueError:
+        await message.answer('Использование:\n/slow_handlers [N] - N самых медленных обработчиков по p95\n/slow_handlers reset - сбросить статистику')
+        return
+    loop_lag = loop_lag_monitor.percentiles() + (loop_lag_monitor.max_seconds,) if loop_lag_monitor.samples else None
+    await message.answer(format_slow_handlers(handler_metrics.top(limit), datetime.fromtimestamp(handler_metrics.started_at), loop_lag, loop_lag_monitor.stalls), parse_mode=None)
+
+@router.message(Command('memory'))
+async def cmd_memory(message: Message, fsm_storage: BaseStorage):
+    if not is_admin(message.from_user.id):
+        await message.answer('❌ У вас нет прав для выполнения этой команды.')
+        return
+    from aiogram.fsm.storage.memory import MemoryStorage
+    from profiling import memory_profiler, count_objects
+    from services import _clients, report_cache
+    from utils import format_memory_status, format_memory_top, format_object_counts
+    usage = 'Использование:\n/memory - состояние памяти\n/memory start [кадров] - включить tracemalloc\n/memory stop - выключить tracemalloc\n/memory top [N] - крупнейшие места выделения памяти\n/memory diff [N] - прирост с прошлого снимка\n/memory objects [N] - количество объектов по типам'
+    args = message.text.split()[1:]
+    action = args[0].lower() if args else 'status'
+    try:
+        number = min(int(args[1]), 25) if len(args) > 1 else None
+    except ValueError:
+        await message.answer(usage)
+        return
+    if number is not None and number < 1:
+        await message.answer(usage)
+        return
+    if action == 'status':
+        containers = {'Клиентов Pyrogram': len(_clients), 'Отчетов в кэше': len(report_cache)}
+        if isinstance(fsm_storage, MemoryStorage):
+            containers['Записей FSM в памяти'] = len(fsm_storage.storage)
+        text = format_memory_status(memory_profiler.is_tracing, memory_profiler.started_at, memory_profiler.traced_memory() if memory_profiler.is_tracing else None, containers)
+    elif action == 'start':
+        text = f'✅ tracemalloc включен, кадров стека: {memory_profiler.frames}' if memory_profiler.start(number) else 'ℹ️ tracemalloc уже включен.'
+    elif action == 'stop':
+        text = '✅ tracemalloc выключен, снимки удалены.' if memory_profiler.stop() else 'ℹ️ tracemalloc и так выключен.'
+    elif action in ('top', 'diff') and (not memory_profiler.is_tracing):
+        text = 'ℹ️ Сначала включите tracemalloc: /memory start'
+    elif action == 'top':
+        text = format_memory_top(await asyncio.to_thread(memory_profiler.snapshot, number or 10), 'КРУПНЕЙШИЕ МЕСТА ВЫДЕЛЕНИЯ ПАМЯТИ')
+    elif action == 'diff':
+        stats = await asyncio.to_thread(memory_profiler.diff, number or 10)
+        text = 'ℹ️ Базовый снимок сохранен. Повторите /memory diff позже, чтобы увидеть прирост.' if stats is None else format_memory_top(stats, 'ПРИРОСТ ПАМЯТИ С ПРОШЛОГО СНИМКА')
+    elif action == 'objects':
+        text = format_object_counts(*await asyncio.to_thread(count_objects, number or 15))
+    else:
+        text = usage
+    await message.answer(text, parse_mode=None)
+
+@router.message(Command('export_history'))
+async def cmd_export_history(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer('❌ У вас нет прав для выполнения этой команды.')
+        return
+    usage = 'Использование:\n/export_history <ID_рассылки> [csv|jsonl] [gz]\n/export_history <ГГГГ-ММ-ДД> <ГГГГ-ММ-ДД> [csv|jsonl] [gz]\n\nПример: /export_history 123 jsonl gz'
+    args = message.text.split()[1:]
+    options = [arg.lower() for arg in args if arg.lower() in ('csv', 'jsonl', 'gz')]
+    args = [arg for arg in args if arg.lower() not in ('csv', 'jsonl', 'gz')]
+    campaign_id = None
+    start_date = None
+    end_date = None
+    try:
+        if len(args) == 1:
+            campaign_id = int(args[0])
+        elif len(args) == 2:
+            start_date = datetime.strptime(args[0], '%Y-%m-%d')
+            end_date = datetime.strptime(args[1], '%Y-%m-%d').replace(hour=23, minute=59, second=59, microsecond=999999)
+        else:
+            await message.answer(usage)
+            return
+    except ValueError:
+        await message.answer(f'❌ Неверный формат параметров.\n\n{usage}')
+        return
+    export_format = 'jsonl' if 'jsonl' in options else 'csv'
+    compress = 'gz' in options
+    if campaign_id is not None and (not await crud.get_campaign(campaign_id)):
+        await message.answer('❌ Рассылка не найдена.')
+        return
+    status_message = await message.answer('⏳ Выгружаю историю отправок...')
+    try:
+        result = await export_sending_history(campaign_id, start_date, end_date, export_format=export_format, compress=compress)
+    except Exception as e:
+        logger.error(f'Ошибка при выгрузке истории отправок: {e}', exc_info=True)
+        await status_message.edit_text('❌ Не удалось выгрузить историю. Попробуйте позже.')
+        return
+    path, exported = result
+    scope = f'campaign_{campaign_id}' if campaign_id is not None else f'{args[0]}_{args[1]}'
+    filename = f"history_{scope}.{export_format}{('.gz' if compress else '')}"
+    try:
+        if not exported:
+            await status_message.edit_text('📭 За выбранный период записей нет.')
+            return
+        await message.answer_document(FSInputFile(path, filename=filename), caption=f'📦 История отправок: {exported} записей')
+        await status_message.delete()
+    except Exception as e:
+        logger.error(f'Ошибка при отправке выгрузки истории: {e}')
+        await message.answer('❌ Не удалось отправить файл. Попробуйте позже.')
+    finally:
+        os.remove(path)
 from aiogram import Router, F
 from aiogram.types import CallbackQuery
 import database as crud
@@ -1574,11 +1757,12 @@ from database import Recipient, async_session_maker
 from sqlalchemy import select
 from services import send_duplicates
 from keyboards import get_duplicates_keyboard
+from callbacks import callback_registry, SendDuplicates, SkipDuplicates
 from utils import logger
 
-@router.callback_query(F.data.startswith('send_duplicates_'))
-async def handle_send_duplicates(callback: CallbackQuery):
-    campaign_id = int(callback.data.split('_')[2])
+@callback_registry.route(SendDuplicates)
+async def handle_send_duplicates(callback: CallbackQuery, callback_data: SendDuplicates):
+    campaign_id = callback_data.campaign_id
     campaign = await crud.get_campaign(campaign_id)
     if not campaign:
         await callback.answer('Рассылка не найдена', show_alert=True)
@@ -1597,9 +1781,9 @@ async def handle_send_duplicates(callback: CallbackQuery):
     await callback.message.answer(f'ℹ️ Дубли не отправляются\n\nСообщение уже было отправлено этим пользователям в предыдущих рассылках.\nПовторная отправка не выполняется.')
     logger.info(f'Попытка отправить дубли для рассылки {campaign.campaign_id} - дубли не отправляются')
 
-@router.callback_query(F.data.startswith('skip_duplicates_'))
-async def handle_skip_duplicates(callback: CallbackQuery):
-    campaign_id = int(callback.data.split('_')[2])
+@callback_registry.route(SkipDuplicates)
+async def handle_skip_duplicates(callback: CallbackQuery, callback_data: SkipDuplicates):
+    campaign_id = callback_data.campaign_id
     campaign = await crud.get_campaign(campaign_id)
     if not campaign:
         await callback.answer('Рассылка не найдена', show_alert=True)
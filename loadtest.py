@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+_workdir = tempfile.mkdtemp(prefix='loadtest_')
+os.environ['DATABASE_URL'] = f"sqlite+aiosqlite:///{os.path.join(_workdir, 'loadtest.db')}"
+os.environ.setdefault('BOT_TOKEN', '123456:LOADTEST')
+os.environ['CAMPAIGN_EXECUTION'] = 'worker'
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.methods import AnswerCallbackQuery, GetMe
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+import database as crud
+from callbacks import PickTemplate, Delay, MaxRecipients, ConfirmMailing
+from handlers import router
+from metrics import assert_max_queries, percentile, PERCENTILES
+from utils import logger
+LOADTEST_USERS = int(os.getenv('LOADTEST_USERS', '200'))
+LOADTEST_RECIPIENTS = int(os.getenv('LOADTEST_RECIPIENTS', '50'))
+LOADTEST_API_LATENCY_MS = float(os.getenv('LOADTEST_API_LATENCY_MS', '0'))
+LOADTEST_MAX_P95_MS = float(os.getenv('LOADTEST_MAX_P95_MS', '0'))
+QUERY_BUDGETS = {'cmd_new_mailing': 1, 'process_template_selection': 1, 'process_recipients': 0, 'process_delay_selection': 1, 'process_max_recipients_selection': 4, 'confirm_mailing': 3}
+BOT_USER = User(id=123456, is_bot=True, first_name='Load test', username='loadtest_bot')
+
+class FakeSession(BaseSession):
+    def __init__(self, latency: float=0.0):
+        super().__init__()
+        self.latency = latency
+        self.requests = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, GetMe):
+            return BOT_USER
+        if isinstance(method, AnswerCallbackQuery):
+            return True
+        chat_id = getattr(method, 'chat_id', None) or 0
+        return Message(message_id=self.requests, date=datetime.now(), chat=Chat(id=chat_id, type='private'), from_user=BOT_USER, text=getattr(method, 'text', None))
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
+
+class UpdateFactory:
+
+    def __init__(self):
+        self._ids = 0
+
+    def _next_id(self) -> int:
+        self._ids += 1
+        return self._ids
+
+    def message(self, user: User, text: str) -> Update:
+        message = Message(message_id=self._next_id(), date=datetime.now(), chat=Chat(id=user.id, type='private'), from_user=user, text=text)
+        return Update(update_id=self._next_id(), message=message)
+
+    def callback(self, user: User, data: str) -> Update:
+        message = Message(message_id=self._next_id(), date=datetime.now(), chat=Chat(id=user.id, type='private'), from_user=BOT_USER, text='...')
+        callback = CallbackQuery(id=str(self._next_id()), from_user=user, chat_instance=str(user.id), message=message, data=data)
+        return Update(update_id=self._next_id(), callback_query=callback)
+
+async def _feed(dp: Dispatcher, bot: Bot, handler: str, update: Update, timings: dict, errors: dict):
+    started = time.perf_counter()
+    try:
+        with assert_max_queries(QUERY_BUDGETS[handler], handler):
+            result = await dp.feed_update(bot, update)
+    except Exception as e:
+        errors[handler].append(repr(e))
+        return
+    finally:
+        timings[handler].append(time.perf_counter() - started)
+    if result is UNHANDLED:
+        errors[handler].append('update не обработан')
+
+async def virtual_user(dp: Dispatcher, bot: Bot, factory: UpdateFactory, user_id: int, template_id: int, timings: dict, errors: dict):
+    user = User(id=user_id, is_bot=False, first_name=f'user{user_id}')
+    await _feed(dp, bot, 'cmd_new_mailing', factory.message(user, '/new_mailing'), timings, errors)
+    await _feed(dp, bot, 'process_template_selection', factory.callback(user, PickTemplate(template_id=template_id).pack()), timings, errors)
+    recipients = ', '.join((f'@load{user_id}_{i}' for i in range(LOADTEST_RECIPIENTS)))
+    await _feed(dp, bot, 'process_recipients', factory.message(user, recipients), timings, errors)
+    await _feed(dp, bot, 'process_delay_selection', factory.callback(user, Delay(seconds=15).pack()), timings, errors)
+    await _feed(dp, bot, 'process_max_recipients_selection', factory.callback(user, MaxRecipients(count=100).pack()), timings, errors)
+    data = await dp.fsm.get_context(bot, chat_id=user_id, user_id=user_id).get_data()
+    if 'campaign_id' not in data:
+        errors['confirm_mailing'].append('рассылка не создана')
+        return
+    await _feed(dp, bot, 'confirm_mailing', factory.callback(user, ConfirmMailing(campaign_id=data['campaign_id']).pack()), timings, errors)
+
+async def run_load_test(users: int=LOADTEST_USERS) -> dict:
+    await crud.init_db()
+    template = await crud.create_template('loadtest', 'Нагрузочный тест', 1)
+    session = FakeSession(LOADTEST_API_LATENCY_MS / 1000)
+    bot = Bot(os.environ['BOT_TOKEN'], session=session)
+    dp = Dispatcher(storage=MemoryStorage())
+    dp.include_router(router)
+    dp['bot_info'] = await bot.me()
+    factory = UpdateFactory()
+    timings = defaultdict(list)
+    errors = defaultdict(list)
+    started = time.perf_counter()
+    await asyncio.gather(*(virtual_user(dp, bot, factory, 1000 + i, template.id, timings, errors) for i in range(users)))
+    elapsed = time.perf_counter() - started
+    return {'elapsed': elapsed, 'updates': sum((len(samples) for samples in timings.values())), 'api_requests': session.requests, 'timings': timings, 'errors': errors}
+
+def report(result: dict) -> list:
+    failures = []
+    logger.info(f"Обновлений: {result['updates']} за {result['elapsed']:.2f} с ({result['updates'] / result['elapsed']:.0f} обн/с), запросов к Bot API: {result['api_requests']}")
+    logger.info(f"{'Обработчик':<34} {'кол-во':>7} {'ошибок':>7} " + ' '.join((f'{f"p{p}, мс":>9}' for p in PERCENTILES)))
+    for handler, samples in result['timings'].items():
+        values = [percentile(samples, p) * 1000 for p in PERCENTILES]
+        logger.info(f"{handler:<34} {len(samples):>7} {len(result['errors'][handler]):>7} " + ' '.join((f'{value:>9.1f}' for value in values)))
+        if LOADTEST_MAX_P95_MS and values[1] > LOADTEST_MAX_P95_MS:
+            failures.append(f'{handler}: p95 {values[1]:.1f} мс больше порога {LOADTEST_MAX_P95_MS:.0f} мс')
+    for handler, messages in result['errors'].items():
+        if messages:
+            failures.append(f'{handler}: {len(messages)} ошибок, первая: {messages[0]}')
+    return failures
+
+async def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else LOADTEST_USERS
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    try:
+        result = await run_load_test(users)
+    finally:
+        logger.setLevel(level)
+        await crud.close_db()
+    failures = report(result)
+    for failure in failures:
+        logger.error(f'❌ {failure}')
+    if failures:
+        return 1
+    logger.info(f'✅ Нагрузочный тест пройден: {users} виртуальных пользователей')
+    return 0
+if __name__ == '__main__':
+    exit_code = asyncio.run(main())
+    exit(exit_code)
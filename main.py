@@ -1,24 +1,49 @@
 import asyncio
+import signal
 import sys
+from aiohttp import web
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
-from config import BOT_TOKEN, MAIN_ADMIN_ID
+from config import BOT_TOKEN, MAIN_ADMIN_ID, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_DRAIN_SECONDS, WEBHOOK_HEALTH_GRACE_SECONDS
 from database import init_db, close_db
 from handlers import router
+from metrics import loop_lag_monitor
+from group_registry import group_registry
 from utils import logger
 
-async def on_startup(bot: Bot):
-    try:
-        webhook_info = await bot.get_webhook_info()
-        if webhook_info.url:
-            logger.warning(f"⚠️ Найден webhook: {webhook_info.url}. Удаляю...")
-            await bot.delete_webhook(drop_pending_updates=True)
-            logger.info("✅ Webhook удален, используется polling")
-    except Exception as e:
-        logger.warning(f"⚠️ Ошибка при проверке webhook: {e}")
+def get_allowed_updates(dp: Dispatcher) -> list:
+    return list(set(list(dp.resolve_used_update_types()) + ["my_chat_member", "chat_member"]))
+
+async def on_startup(bot: Bot, dispatcher: Dispatcher):
+    if BOT_MODE == "webhook":
+        if WEBHOOK_URL:
+            await bot.set_webhook(
+                url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=get_allowed_updates(dispatcher)
+            )
+            logger.info(f"✅ Webhook установлен: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+        else:
+            logger.warning("⚠️ WEBHOOK_URL не задан, webhook в Telegram не регистрируется (локальный режим)")
+    else:
+        try:
+            webhook_info = await bot.get_webhook_info()
+            if webhook_info.url:
+                logger.warning(f"⚠️ Найден webhook: {webhook_info.url}. Удаляю...")
+                await bot.delete_webhook(drop_pending_updates=True)
+                logger.info("✅ Webhook удален, используется polling")
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка при проверке webhook: {e}")
+    
+    loop_lag_monitor.start()
+    
+    bot_info = await bot.me()
+    dispatcher["bot_info"] = bot_info
+    logger.info(f"Бот: @{bot_info.username} (id {bot_info.id})")
     
     logger.info("Инициализация базы данных...")
     await init_db()
@@ -40,8 +65,10 @@ async def on_startup(bot: Bot):
     
     logger.info(f"Бот запущен. Администратор: {MAIN_ADMIN_ID}")
 
-async def on_shutdown():
+async def on_shutdown(dispatcher: Dispatcher):
     logger.info("Закрытие соединений...")
+    loop_lag_monitor.stop()
+    await group_registry.close()
     await close_db()
     
     try:
@@ -52,6 +79,50 @@ async def on_shutdown():
     
     logger.info("Бот остановлен")
 
+class DrainingRequestHandler(SimpleRequestHandler):
+    async def close(self) -> None:
+        pending = list(self._background_feed_update_tasks)
+        if pending:
+            logger.info(f"Ожидаем завершения {len(pending)} обновлений...")
+            done, not_done = await asyncio.wait(pending, timeout=WEBHOOK_DRAIN_SECONDS)
+            if not_done:
+                logger.warning(f"⚠️ Не дождались завершения {len(not_done)} обновлений")
+        await super().close()
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    draining = False
+
+    async def health(request: web.Request) -> web.Response:
+        if draining:
+            return web.json_response({"status": "draining"}, status=503)
+        return web.json_response({"status": "ok"})
+
+    app = web.Application()
+    app.router.add_get("/health", health)
+    DrainingRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET or None).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    
+    runner = web.AppRunner(app, shutdown_timeout=WEBHOOK_DRAIN_SECONDS)
+    await runner.setup()
+    await web.TCPSite(runner, host=WEBAPP_HOST, port=WEBAPP_PORT).start()
+    logger.info(f"Webhook сервер слушает {WEBAPP_HOST}:{WEBAPP_PORT}{WEBHOOK_PATH}")
+    
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    try:
+        await stop.wait()
+        draining = True
+        logger.info(f"/health отвечает 503, ждем {WEBHOOK_HEALTH_GRACE_SECONDS} с, пока балансировщик снимет трафик...")
+        await asyncio.sleep(WEBHOOK_HEALTH_GRACE_SECONDS)
+    finally:
+        logger.info("Останавливаем webhook сервер...")
+        await runner.cleanup()
+
 async def main():
     if not BOT_TOKEN:
         logger.error("BOT_TOKEN не установлен! Проверьте файл .env")
@@ -70,18 +141,19 @@ async def main():
     dp = Dispatcher(storage=storage)
     
     dp.include_router(router)
-    try:
-        webhook_info = await bot.get_webhook_info()
-        if webhook_info.url:
-            logger.warning(f"⚠️ Найден webhook: {webhook_info.url}. Удаляю...")
-            await bot.delete_webhook(drop_pending_updates=True)
-            logger.info("✅ Webhook удален, используется polling")
-    except Exception as e:
-        logger.warning(f"⚠️ Ошибка при проверке webhook: {e}")
-    
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
     
+    if BOT_MODE == "webhook":
+        try:
+            logger.info("Запуск бота в режиме webhook...")
+            await run_webhook(dp, bot)
+        except Exception as e:
+            logger.error(f"Критическая ошибка: {e}", exc_info=True)
+        finally:
+            await bot.session.close()
+        return
+    
     try:
         logger.info("Запуск бота...")
         
@@ -94,7 +166,7 @@ async def main():
         except Exception as e:
             logger.warning(f"⚠️ Ошибка при проверке webhook: {e}")
         
-        allowed_updates = list(set(list(dp.resolve_used_update_types()) + ["my_chat_member", "chat_member"]))
+        allowed_updates = get_allowed_updates(dp)
         logger.info(f"Разрешенные типы обновлений: {allowed_updates}")
         
         await dp.start_polling(bot, allowed_updates=allowed_updates, close_loop=False)
@@ -105,7 +177,11 @@ async def main():
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        if len(sys.argv) > 1 and sys.argv[1] == "worker":
+            from worker import run_worker
+            asyncio.run(run_worker())
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Бот остановлен пользователем")
     except Exception as e:
@@ -0,0 +1,88 @@
+import asyncio
+import os
+import time
+from typing import Dict, Optional, Tuple
+from aiogram import Bot
+from pyrogram import Client
+from config import MEDIA_CACHE_DIR, MEDIA_BRIDGE_FAILURE_TTL
+from utils import logger
+
+_client_media: Dict[Tuple[str, str], str] = {}
+_failed_media: Dict[Tuple[str, str], float] = {}
+_locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+_lock_users: Dict[Tuple[str, str], int] = {}
+CLIENT_MEDIA_TYPES = ('photo', 'video', 'audio', 'voice', 'video_note', 'animation')
+
+def media_cache_path(media_file_unique_id: str) -> str:
+    return os.path.join(MEDIA_CACHE_DIR, media_file_unique_id)
+
+async def download_template_media(bot: Bot, media_file_id: str, media_file_unique_id: str) -> str:
+    path = media_cache_path(media_file_unique_id)
+    if os.path.exists(path):
+        return path
+    os.makedirs(MEDIA_CACHE_DIR, exist_ok=True)
+    partial_path = f'{path}.part'
+    await bot.download(media_file_id, destination=partial_path)
+    os.replace(partial_path, path)
+    logger.info(f'Медиа {media_file_unique_id} скачано через Bot API в {path}')
+    return path
+
+async def _upload_to_saved_messages(client: Client, media_type: str, path: str) -> str:
+    kind = media_type if media_type in CLIENT_MEDIA_TYPES else 'document'
+    message = await getattr(client, f'send_{kind}')('me', path)
+    return getattr(message, kind).file_id
+
+def _cached_media(key: Tuple[str, str], media_file_id: str) -> Optional[str]:
+    if key in _client_media:
+        return _client_media[key]
+    failed_until = _failed_media.get(key)
+    if failed_until is None:
+        return None
+    if failed_until > time.monotonic():
+        return media_file_id
+    del _failed_media[key]
+    return None
+
+async def get_client_media(client: Client, bot: Bot, media_type: str, media_file_id: str, media_file_unique_id: Optional[str]) -> str:
+    if not media_file_unique_id:
+        return media_file_id
+    key = (client.name, media_file_unique_id)
+    cached = _cached_media(key, media_file_id)
+    if cached is not None:
+        return cached
+    lock = _locks.setdefault(key, asyncio.Lock())
+    _lock_users[key] = _lock_users.get(key, 0) + 1
+    try:
+        async with lock:
+            cached = _cached_media(key, media_file_id)
+            if cached is not None:
+                return cached
+            try:
+                path = await download_template_media(bot, media_file_id, media_file_unique_id)
+                _client_media[key] = await _upload_to_saved_messages(client, media_type, path)
+                logger.info(f'Медиа {media_file_unique_id} загружено в аккаунт {client.name}')
+            except Exception as e:
+                _failed_media[key] = time.monotonic() + MEDIA_BRIDGE_FAILURE_TTL
+                logger.warning(f'Не удалось перенести медиа {media_file_unique_id} в Client API, {MEDIA_BRIDGE_FAILURE_TTL} с используем исходный file_id: {e}')
+                return media_file_id
+            return _client_media[key]
+    finally:
+        _lock_users[key] -= 1
+        if not _lock_users[key]:
+            del _lock_users[key]
+            del _locks[key]
+
+def invalidate_client_media(client: Client, media_file_unique_id: str):
+    _client_media.pop((client.name, media_file_unique_id), None)
+
+def invalidate_template_media(media_file_unique_id: Optional[str]):
+    if not media_file_unique_id:
+        return
+    for key in [key for key in _client_media if key[1] == media_file_unique_id]:
+        del _client_media[key]
+    for key in [key for key in _failed_media if key[1] == media_file_unique_id]:
+        del _failed_media[key]
+    path = media_cache_path(media_file_unique_id)
+    if os.path.exists(path):
+        os.remove(path)
+    logger.info(f'Кэш медиа {media_file_unique_id} сброшен')
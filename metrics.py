@@ -0,0 +1,218 @@
+import asyncio
+import contextvars
+import logging
+import math
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from aiogram import BaseMiddleware, Router
+from aiogram.types import CallbackQuery, TelegramObject
+from sqlalchemy import event
+from callbacks import callback_registry
+from database import ENGINES
+from config import SLOW_UPDATE_SECONDS, HANDLER_METRICS_WINDOW, LOOP_LAG_INTERVAL, LOOP_BLOCK_SECONDS, LOOP_DEBUG, SLOW_QUERY_SECONDS
+from utils import logger
+PERCENTILES = (50, 95, 99)
+
+def percentile(samples, percent: int) -> float:
+    ordered = sorted(samples)
+    index = max(0, math.ceil(percent / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+class QueryStats:
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+_active_query_stats: contextvars.ContextVar[Tuple[QueryStats, ...]] = contextvars.ContextVar('active_query_stats', default=())
+
+@contextmanager
+def track_queries():
+    stats = QueryStats()
+    token = _active_query_stats.set(_active_query_stats.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        _active_query_stats.reset(token)
+
+@contextmanager
+def assert_max_queries(limit: int, label: str='блок'):
+    with track_queries() as stats:
+        yield stats
+    if stats.count > limit:
+        raise AssertionError(f'{label}: {stats.count} SQL-запросов при бюджете {limit}')
+
+def _redact(parameters) -> str:
+    if isinstance(parameters, dict):
+        return '{' + ', '.join((f'{key}: {type(value).__name__}' for key, value in parameters.items())) + '}'
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (list, tuple, dict)):
+            return f'[{len(parameters)} наборов параметров]'
+        return '(' + ', '.join((type(value).__name__ for value in parameters)) + ')'
+    return type(parameters).__name__
+
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    context.query_started = time.perf_counter()
+
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context.query_started
+    for stats in _active_query_stats.get():
+        stats.count += 1
+        stats.seconds += elapsed
+    if elapsed >= SLOW_QUERY_SECONDS:
+        logger.warning(f'🐢 Медленный SQL-запрос ({elapsed * 1000:.0f} мс): {" ".join(statement.split())} параметры: {_redact(parameters)}')
+for _engine in ENGINES:
+    event.listen(_engine.sync_engine, 'before_cursor_execute', _query_started)
+    event.listen(_engine.sync_engine, 'after_cursor_execute', _query_finished)
+
+class HandlerStats:
+
+    def __init__(self, window: int):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.errors = 0
+        self.slow = 0
+        self.max_seconds = 0.0
+        self.queries = 0
+        self.max_queries = 0
+        self.db_seconds = 0.0
+
+    def record(self, seconds: float, error: bool, queries: Optional[QueryStats]=None):
+        self.samples.append(seconds)
+        self.count += 1
+        if queries is not None:
+            self.queries += queries.count
+            self.max_queries = max(self.max_queries, queries.count)
+            self.db_seconds += queries.seconds
+        self.errors += error
+        self.slow += seconds >= SLOW_UPDATE_SECONDS
+        self.max_seconds = max(self.max_seconds, seconds)
+
+class HandlerMetrics:
+    def __init__(self, window: int=HANDLER_METRICS_WINDOW):
+        self.window = window
+        self._stats: Dict[str, HandlerStats] = {}
+        self.started_at = time.time()
+
+    def record(self, handler: str, seconds: float, error: bool=False, queries: Optional[QueryStats]=None):
+        stats = self._stats.get(handler)
+        if stats is None:
+            stats = self._stats[handler] = HandlerStats(self.window)
+        stats.record(seconds, error, queries)
+
+    def top(self, limit: int=10) -> List[Tuple[str, HandlerStats, Tuple[float, ...]]]:
+        rows = [(name, stats, tuple((percentile(stats.samples, p) for p in PERCENTILES))) for name, stats in self._stats.items()]
+        rows.sort(key=lambda row: row[2][1], reverse=True)
+        return rows[:limit]
+
+    def reset(self):
+        self._stats.clear()
+        self.started_at = time.time()
+handler_metrics = HandlerMetrics()
+
+def _handler_name(event: TelegramObject, data: Dict[str, Any]) -> str:
+    if isinstance(event, CallbackQuery):
+        route = callback_registry.resolve(event.data or '', data.get('raw_state'))
+        if route is not None:
+            return route[1].__name__
+    return data['handler'].callback.__name__
+
+class HandlerTimingMiddleware(BaseMiddleware):
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]], event: TelegramObject, data: Dict[str, Any]) -> Any:
+        timing = data['handler_timing'] = {'handler': None}
+        started = time.perf_counter()
+        error = False
+        with track_queries() as queries:
+            try:
+                return await handler(event, data)
+            except Exception:
+                error = True
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                name = timing['handler']
+                if name is not None:
+                    handler_metrics.record(name, elapsed, error, queries)
+                if elapsed >= SLOW_UPDATE_SECONDS:
+                    logger.warning(f"🐢 Медленное обновление: {name or 'без обработчика'} ({type(event).__name__}, состояние {data.get('raw_state')}) {elapsed * 1000:.0f} мс, SQL-запросов: {queries.count} ({queries.seconds * 1000:.0f} мс)")
+
+class HandlerNameMiddleware(BaseMiddleware):
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]], event: TelegramObject, data: Dict[str, Any]) -> Any:
+        timing: Optional[dict] = data.get('handler_timing')
+        if timing is not None:
+            timing['handler'] = _handler_name(event, data)
+        return await handler(event, data)
+
+def setup_handler_metrics(router: Router):
+    for observer in (router.message, router.callback_query, router.my_chat_member, router.chat_member):
+        observer.outer_middleware(HandlerTimingMiddleware())
+        observer.middleware(HandlerNameMiddleware())
+
+class LoopLagMonitor:
+    def __init__(self, interval: float=LOOP_LAG_INTERVAL, threshold: float=LOOP_BLOCK_SECONDS, window: int=HANDLER_METRICS_WINDOW):
+        self.interval = interval
+        self.threshold = threshold
+        self.samples = deque(maxlen=window)
+        self.max_seconds = 0.0
+        self.stalls = 0
+        self._heartbeat = time.monotonic()
+        self._reported = None
+        self._loop_thread_id = None
+        self._task = None
+        self._stop = threading.Event()
+        self._watchdog = None
+
+    def start(self, debug: bool=LOOP_DEBUG):
+        loop = asyncio.get_running_loop()
+        if debug:
+            loop.set_debug(True)
+            loop.slow_callback_duration = self.threshold
+            asyncio_logger = logging.getLogger('asyncio')
+            for handler in logger.handlers:
+                asyncio_logger.addHandler(handler)
+            logger.info(f'Отладка event loop включена: медленные колбэки дольше {self.threshold * 1000:.0f} мс попадут в лог')
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._measure())
+        self._watchdog = threading.Thread(target=self._watch, name='loop-lag-watchdog', daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+
+    async def _measure(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.samples.append(lag)
+            self.max_seconds = max(self.max_seconds, lag)
+            self._heartbeat = time.monotonic()
+
+    def _watch(self):
+        while not self._stop.wait(self.threshold / 2):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked < self.threshold or self._reported == heartbeat:
+                continue
+            self._reported = heartbeat
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = ''.join(traceback.format_stack(frame)) if frame else 'стек недоступен'
+            logger.warning(f'⏳ Event loop заблокирован уже {blocked * 1000:.0f} мс, стек:\n{stack}')
+
+    def percentiles(self) -> Tuple[float, ...]:
+        if not self.samples:
+            return tuple((0.0 for _ in PERCENTILES))
+        return tuple((percentile(self.samples, p) for p in PERCENTILES))
+loop_lag_monitor = LoopLagMonitor()
@@ -1,171 +1,319 @@
 import asyncio
-import aiosqlite
-from sqlalchemy import text
-from config import DATABASE_URL
-from database import async_session_maker
-from utils import logger
+from typing import Optional
+from sqlalchemy import MetaData, bindparam, column, delete, func, inspect, insert, select, table, text, update
+from database import engine, Base, ReportReceiverList, ERROR_MESSAGES, _insert_ignore
+from utils import logger, normalize_identifier
 
-def get_db_path():
-    return DATABASE_URL.replace('sqlite+aiosqlite:///', '')
+def _table_exists(sync_conn, table_name: str) -> bool:
+    return inspect(sync_conn).has_table(table_name)
+
+def _column_names(sync_conn, table_name: str) -> list:
+    if not _table_exists(sync_conn, table_name):
+        return []
+    return [col['name'] for col in inspect(sync_conn).get_columns(table_name)]
+
+def _index_names(sync_conn, table_name: str) -> list:
+    if not _table_exists(sync_conn, table_name):
+        return []
+    return [idx['name'] for idx in inspect(sync_conn).get_indexes(table_name)]
+
+def _add_column(sync_conn, table_name: str, column_name: str):
+    column = Base.metadata.tables[table_name].c[column_name]
+    preparer = sync_conn.dialect.identifier_preparer
+    column_type = column.type.compile(dialect=sync_conn.dialect)
+    sync_conn.execute(text(f'ALTER TABLE {preparer.quote(table_name)} ADD COLUMN {preparer.quote(column_name)} {column_type}'))
+    if column.default is not None and column.default.is_scalar:
+        table = Base.metadata.tables[table_name]
+        sync_conn.execute(update(table).where(table.c[column_name].is_(None)).values({column_name: column.default.arg}))
+
+def _drop_column(sync_conn, table_name: str, column_name: str):
+    if sync_conn.dialect.name == 'sqlite':
+        _rebuild_table(sync_conn, table_name)
+        return
+    preparer = sync_conn.dialect.identifier_preparer
+    sync_conn.execute(text(f'ALTER TABLE {preparer.quote(table_name)} DROP COLUMN {preparer.quote(column_name)}'))
+
+def _set_not_null(sync_conn, table_name: str, column_name: str):
+    dialect = sync_conn.dialect.name
+    if dialect == 'sqlite':
+        _rebuild_table(sync_conn, table_name)
+        return
+    preparer = sync_conn.dialect.identifier_preparer
+    table = preparer.quote(table_name)
+    column = preparer.quote(column_name)
+    if dialect in ('mysql', 'mariadb'):
+        column_type = Base.metadata.tables[table_name].c[column_name].type.compile(dialect=sync_conn.dialect)
+        sync_conn.execute(text(f'ALTER TABLE {table} MODIFY {column} {column_type} NOT NULL'))
+    else:
+        sync_conn.execute(text(f'ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL'))
+
+def _rebuild_table(sync_conn, table_name: str):
+    target = Base.metadata.tables[table_name]
+    scratch = MetaData()
+    for table in Base.metadata.sorted_tables:
+        if table is not target:
+            table.to_metadata(scratch)
+    rebuilt = target.to_metadata(scratch, name=f'{table_name}_new')
+    rebuilt.indexes.clear()
+    existing_columns = set(_column_names(sync_conn, table_name))
+    columns = [col.name for col in target.columns if col.name in existing_columns]
+    source_indexes = [idx for idx in inspect(sync_conn).get_indexes(table_name) if all((name in columns for name in idx['column_names']))]
+    rebuilt.drop(sync_conn, checkfirst=True)
+    rebuilt.create(sync_conn)
+    sync_conn.execute(insert(rebuilt).from_select(columns, select(*[target.c[name] for name in columns])))
+    target.drop(sync_conn)
+    preparer = sync_conn.dialect.identifier_preparer
+    sync_conn.execute(text(f'ALTER TABLE {preparer.quote(rebuilt.name)} RENAME TO {preparer.quote(table_name)}'))
+    for idx in source_indexes:
+        unique = 'UNIQUE ' if idx['unique'] else ''
+        sync_conn.execute(text(f"CREATE {unique}INDEX {preparer.quote(idx['name'])} ON {preparer.quote(table_name)} ({', '.join((preparer.quote(name) for name in idx['column_names']))})"))
+    logger.info(f'✅ Таблица {table_name} пересоздана по текущей схеме')
 
 async def migrate_users_table():
-    db_path = get_db_path()
-    logger.info(f'[Миграция 1] Начинаем миграцию таблицы users: {db_path}')
-    async with aiosqlite.connect(db_path) as db:
-        cursor = await db.execute('PRAGMA table_info(users)')
-        columns = await cursor.fetchall()
-        existing_columns = [col[1] for col in columns]
+    logger.info(f'[Миграция 1] Начинаем миграцию таблицы users: {engine.dialect.name}')
+    async with engine.begin() as conn:
+        existing_columns = await conn.run_sync(_column_names, 'users')
         logger.info(f'Существующие колонки в users: {existing_columns}')
-        migrations = []
-        if 'api_id' not in existing_columns:
-            migrations.append('ALTER TABLE users ADD COLUMN api_id INTEGER')
-            logger.info('Добавляем колонку api_id')
-        if 'api_hash' not in existing_columns:
-            migrations.append('ALTER TABLE users ADD COLUMN api_hash VARCHAR(255)')
-            logger.info('Добавляем колонку api_hash')
-        if 'phone_number' not in existing_columns:
-            migrations.append('ALTER TABLE users ADD COLUMN phone_number VARCHAR(50)')
-            logger.info('Добавляем колонку phone_number')
-        if 'has_client_auth' not in existing_columns:
-            migrations.append('ALTER TABLE users ADD COLUMN has_client_auth BOOLEAN DEFAULT 0')
-            logger.info('Добавляем колонку has_client_auth')
-        if not migrations:
+        missing = [name for name in ('api_id', 'api_hash', 'phone_number', 'has_client_auth') if name not in existing_columns]
+        if not missing:
             logger.info('✅ [Миграция 1] Все колонки уже существуют, миграция не требуется')
             return True
-        for migration in migrations:
+        for column_name in missing:
             try:
-                await db.execute(migration)
-                logger.info(f'✅ Выполнено: {migration}')
+                await conn.run_sync(_add_column, 'users', column_name)
+                logger.info(f'✅ Добавлена колонка {column_name}')
             except Exception as e:
-                logger.error(f'❌ Ошибка при выполнении {migration}: {e}')
+                logger.error(f'❌ Ошибка при добавлении колонки {column_name}: {e}')
                 raise
-        await db.commit()
-        logger.info('✅ [Миграция 1] Миграция таблицы users завершена успешно!')
-        return True
+    logger.info('✅ [Миграция 1] Миграция таблицы users завершена успешно!')
+    return True
 
 async def migrate_delay_seconds():
-    db_path = get_db_path()
-    logger.info(f'[Миграция 2] Начинаем миграцию delay_seconds: {db_path}')
-    async with aiosqlite.connect(db_path) as db:
-        cursor = await db.execute('PRAGMA table_info(mailing_campaigns)')
-        columns = await cursor.fetchall()
-        existing_columns = [col[1] for col in columns]
+    logger.info(f'[Миграция 2] Начинаем миграцию delay_seconds: {engine.dialect.name}')
+    async with engine.begin() as conn:
+        existing_columns = await conn.run_sync(_column_names, 'mailing_campaigns')
         if 'delay_seconds' not in existing_columns:
             try:
-                await db.execute('ALTER TABLE mailing_campaigns ADD COLUMN delay_seconds INTEGER DEFAULT 5')
-                logger.info('✅ Добавлена колонка delay_seconds')
-                await db.commit()
-                await db.execute('UPDATE mailing_campaigns SET delay_seconds = 5 WHERE delay_seconds IS NULL')
-                await db.commit()
-                logger.info('✅ Обновлены существующие записи значением по умолчанию (5 секунд)')
+                await conn.run_sync(_add_column, 'mailing_campaigns', 'delay_seconds')
+                logger.info('✅ Добавлена колонка delay_seconds, существующие записи обновлены значением по умолчанию (5 секунд)')
             except Exception as e:
                 logger.error(f'❌ Ошибка при добавлении колонки delay_seconds: {e}')
                 raise
         else:
             logger.info('✅ [Миграция 2] Колонка delay_seconds уже существует, миграция не требуется')
-        logger.info('✅ [Миграция 2] Миграция delay_seconds завершена успешно!')
-        return True
+    logger.info('✅ [Миграция 2] Миграция delay_seconds завершена успешно!')
+    return True
 
 async def migrate_max_recipients():
-    db_path = get_db_path()
-    logger.info(f'[Миграция 3] Начинаем миграцию max_recipients: {db_path}')
-    async with aiosqlite.connect(db_path) as db:
-        cursor = await db.execute('PRAGMA table_info(mailing_campaigns)')
-        columns = await cursor.fetchall()
-        existing_columns = [col[1] for col in columns]
+    logger.info(f'[Миграция 3] Начинаем миграцию max_recipients: {engine.dialect.name}')
+    async with engine.begin() as conn:
+        existing_columns = await conn.run_sync(_column_names, 'mailing_campaigns')
         if 'max_recipients' not in existing_columns:
-            await db.execute('ALTER TABLE mailing_campaigns ADD COLUMN max_recipients INTEGER')
-            await db.commit()
+            await conn.run_sync(_add_column, 'mailing_campaigns', 'max_recipients')
             logger.info('✅ Добавлена колонка max_recipients')
         else:
             logger.info('✅ [Миграция 3] Колонка max_recipients уже существует, миграция не требуется')
-        logger.info('✅ [Миграция 3] Миграция max_recipients завершена успешно!')
-        return True
+    logger.info('✅ [Миграция 3] Миграция max_recipients завершена успешно!')
+    return True
 
 async def migrate_report_lists():
-    db_path = get_db_path()
-    logger.info(f'[Миграция 4] Начинаем миграцию report_lists: {db_path}')
-    async with aiosqlite.connect(db_path) as db:
-        cursor = await db.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='report_receiver_lists'")
-        table_exists = await cursor.fetchone()
+    logger.info(f'[Миграция 4] Начинаем миграцию report_lists: {engine.dialect.name}')
+    async with engine.begin() as conn:
+        table_exists = await conn.run_sync(_table_exists, 'report_receiver_lists')
         if not table_exists:
-            await db.execute('\n                CREATE TABLE report_receiver_lists (\n                    id INTEGER PRIMARY KEY AUTOINCREMENT,\n                    name VARCHAR(255) NOT NULL,\n                    is_active BOOLEAN DEFAULT 1,\n                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,\n                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP\n                )\n            ')
+            await conn.run_sync(ReportReceiverList.__table__.create)
             logger.info('✅ Создана таблица report_receiver_lists')
-            await db.execute("\n                INSERT INTO report_receiver_lists (name, is_active)\n                VALUES ('Основной список', 1)\n            ")
-            await db.commit()
+            await conn.execute(insert(ReportReceiverList).values(name='Основной список', is_active=True))
             logger.info("✅ Создан дефолтный список 'Основной список'")
-        cursor = await db.execute('PRAGMA table_info(report_receivers)')
-        columns = await cursor.fetchall()
-        existing_columns = [col[1] for col in columns]
-        if 'list_id' not in existing_columns:
-            cursor = await db.execute("SELECT id FROM report_receiver_lists WHERE name = 'Основной список' LIMIT 1")
-            default_list = await cursor.fetchone()
-            default_list_id = default_list[0] if default_list else 1
-            await db.execute('ALTER TABLE report_receivers ADD COLUMN list_id INTEGER')
+        existing_columns = await conn.run_sync(_column_names, 'report_receivers')
+        if existing_columns and 'list_id' not in existing_columns:
+            result = await conn.execute(select(ReportReceiverList.id).where(ReportReceiverList.name == 'Основной список').limit(1))
+            default_list_id = result.scalar_one_or_none() or 1
+            await conn.run_sync(_add_column, 'report_receivers', 'list_id')
             logger.info('✅ Добавлена колонка list_id в report_receivers')
-            await db.execute(f'UPDATE report_receivers SET list_id = {default_list_id} WHERE list_id IS NULL')
+            receivers = Base.metadata.tables['report_receivers']
+            await conn.execute(update(receivers).where(receivers.c.list_id.is_(None)).values(list_id=default_list_id))
             logger.info(f'✅ Обновлены существующие получатели (привязаны к списку ID {default_list_id})')
-            await db.execute('\n                CREATE TABLE report_receivers_new (\n                    id INTEGER PRIMARY KEY AUTOINCREMENT,\n                    list_id INTEGER NOT NULL,\n                    identifier VARCHAR(255) NOT NULL,\n                    identifier_type VARCHAR(20) NOT NULL,\n                    telegram_id INTEGER,\n                    is_active BOOLEAN DEFAULT 1,\n                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,\n                    FOREIGN KEY (list_id) REFERENCES report_receiver_lists(id)\n                )\n            ')
-            await db.execute('\n                INSERT INTO report_receivers_new \n                (id, list_id, identifier, identifier_type, telegram_id, is_active, created_at)\n                SELECT id, list_id, identifier, identifier_type, telegram_id, is_active, created_at\n                FROM report_receivers\n            ')
-            await db.execute('DROP TABLE report_receivers')
-            await db.execute('ALTER TABLE report_receivers_new RENAME TO report_receivers')
+            await conn.run_sync(_set_not_null, 'report_receivers', 'list_id')
             logger.info('✅ Таблица report_receivers обновлена с обязательным list_id')
-        await db.commit()
-        logger.info('✅ [Миграция 4] Миграция report_lists завершена успешно!')
-        return True
+    logger.info('✅ [Миграция 4] Миграция report_lists завершена успешно!')
+    return True
 
 async def migrate_bot_groups():
-    db_path = get_db_path()
-    logger.info(f'[Миграция 5] Начинаем миграцию bot_groups: {db_path}')
-    async with aiosqlite.connect(db_path) as db:
-        cursor = await db.execute("\n            SELECT name FROM sqlite_master \n            WHERE type='table' AND name='bot_groups'\n        ")
-        table_exists = await cursor.fetchone()
+    logger.info(f'[Миграция 5] Начинаем миграцию bot_groups: {engine.dialect.name}')
+    async with engine.begin() as conn:
+        table_exists = await conn.run_sync(_table_exists, 'bot_groups')
         if not table_exists:
-            await db.execute('\n                CREATE TABLE bot_groups (\n                    id INTEGER PRIMARY KEY AUTOINCREMENT,\n                    chat_id INTEGER UNIQUE NOT NULL,\n                    title VARCHAR(255),\n                    username VARCHAR(255),\n                    chat_type VARCHAR(50) NOT NULL,\n                    is_active BOOLEAN DEFAULT 1,\n                    members_count INTEGER,\n                    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,\n                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP\n                )\n            ')
-            await db.execute('\n                CREATE INDEX idx_bot_groups_chat_id ON bot_groups(chat_id)\n            ')
-            await db.commit()
+            await conn.run_sync(Base.metadata.tables['bot_groups'].create)
             logger.info('✅ Таблица bot_groups создана')
         else:
             logger.info('✅ [Миграция 5] Таблица bot_groups уже существует, миграция не требуется')
-        logger.info('✅ [Миграция 5] Миграция bot_groups завершена успешно!')
-        return True
+    logger.info('✅ [Миграция 5] Миграция bot_groups завершена успешно!')
+    return True
 
 async def migrate_template_media():
     logger.info('[Миграция 6] Начинаем миграцию template_media')
     try:
-        async with async_session_maker() as session:
-            result = await session.execute(text('PRAGMA table_info(templates)'))
-            columns = [row[1] for row in result.fetchall()]
-            if 'media_type' not in columns:
-                logger.info('Добавляем колонку media_type...')
-                await session.execute(text('ALTER TABLE templates ADD COLUMN media_type VARCHAR(50)'))
-                logger.info('✅ Колонка media_type добавлена')
-            else:
-                logger.info('Колонка media_type уже существует')
-            if 'media_file_id' not in columns:
-                logger.info('Добавляем колонку media_file_id...')
-                await session.execute(text('ALTER TABLE templates ADD COLUMN media_file_id VARCHAR(255)'))
-                logger.info('✅ Колонка media_file_id добавлена')
-            else:
-                logger.info('Колонка media_file_id уже существует')
-            if 'media_file_unique_id' not in columns:
-                logger.info('Добавляем колонку media_file_unique_id...')
-                await session.execute(text('ALTER TABLE templates ADD COLUMN media_file_unique_id VARCHAR(255)'))
-                logger.info('✅ Колонка media_file_unique_id добавлена')
-            else:
-                logger.info('Колонка media_file_unique_id уже существует')
-            await session.commit()
-            logger.info('✅ [Миграция 6] Миграция template_media завершена успешно')
-            return True
+        async with engine.begin() as conn:
+            columns = await conn.run_sync(_column_names, 'templates')
+            for column_name in ('media_type', 'media_file_id', 'media_file_unique_id'):
+                if column_name not in columns:
+                    logger.info(f'Добавляем колонку {column_name}...')
+                    await conn.run_sync(_add_column, 'templates', column_name)
+                    logger.info(f'✅ Колонка {column_name} добавлена')
+                else:
+                    logger.info(f'Колонка {column_name} уже существует')
+        logger.info('✅ [Миграция 6] Миграция template_media завершена успешно')
+        return True
     except Exception as e:
         logger.error(f'❌ Ошибка при миграции template_media: {e}', exc_info=True)
         return False
 
+async def migrate_report_receivers_unique():
+    logger.info(f'[Миграция 7] Начинаем миграцию уникальности report_receivers: {engine.dialect.name}')
+    async with engine.begin() as conn:
+        indexes = await conn.run_sync(_index_names, 'report_receivers')
+        if 'uq_report_receivers_list_identifier' in indexes:
+            logger.info('✅ [Миграция 7] Уникальный индекс уже существует, миграция не требуется')
+            return True
+        receivers = Base.metadata.tables['report_receivers']
+        keep = select(func.min(receivers.c.id).label('id')).group_by(receivers.c.list_id, receivers.c.identifier).subquery()
+        result = await conn.execute(delete(receivers).where(receivers.c.id.not_in(select(keep.c.id))))
+        logger.info(f'✅ Удалено дублирующихся получателей: {result.rowcount}')
+        for index in receivers.indexes:
+            if index.name == 'uq_report_receivers_list_identifier':
+                await conn.run_sync(index.create)
+        logger.info('✅ Создан уникальный индекс (list_id, identifier)')
+    logger.info('✅ [Миграция 7] Миграция уникальности report_receivers завершена успешно!')
+    return True
+
+async def migrate_campaign_leases():
+    logger.info(f'[Миграция 8] Начинаем миграцию аренды рассылок: {engine.dialect.name}')
+    async with engine.begin() as conn:
+        existing_columns = await conn.run_sync(_column_names, 'mailing_campaigns')
+        missing = [name for name in ('lease_owner', 'lease_expires_at') if name not in existing_columns]
+        if not missing:
+            logger.info('✅ [Миграция 8] Колонки аренды уже существуют, миграция не требуется')
+            return True
+        for column_name in missing:
+            await conn.run_sync(_add_column, 'mailing_campaigns', column_name)
+            logger.info(f'✅ Добавлена колонка {column_name}')
+    logger.info('✅ [Миграция 8] Миграция аренды рассылок завершена успешно!')
+    return True
+
+LEGACY_SENDING_HISTORY = table('sending_history', column('id'), column('campaign_id'), column('recipient_identifier'), column('success'), column('error_type'), column('error_details'), column('sent_at'), column('recipient_id'), column('error_code'))
+LEGACY_ERROR_DETAILS = {'no_client': ('Client API не настроен. Настройте через /setup_my_client или используйте общие настройки в .env',), 'invalid_user': ('Чат не найден или недоступен', 'Пользователь не найден', 'Неверный username'), 'not_participant': ('Вы не являетесь участником этой группы. Присоединитесь к группе перед отправкой сообщений.', 'Вы не являетесь участником этой группы/канала. Присоединитесь к группе перед отправкой сообщений.'), 'privacy': ('Нельзя отправить сообщение этому пользователю', 'Ограничения приватности пользователя'), 'deleted': ('Аккаунт деактивирован',), 'admin_required': ('Требуются права администратора для отправки сообщений в эту группу/канал',), 'private_chat': ('Это приватная группа/канал. Используйте invite-ссылку для присоединения или убедитесь, что вы являетесь участником.',), 'peer_flood': ('Аккаунт временно ограничен Telegram из-за слишком частых отправок. Увеличьте интервал между сообщениями (минимум 15-30 секунд) или подождите 1-2 часа перед следующей рассылкой.', 'Аккаунт все еще ограничен Telegram (PEER_FLOOD). Ограничение может быть снято для Bot API, но еще активно для Client API. Подождите еще 1-2 часа.')}
+INDEX_PACK_TABLES = ('mailing_campaigns', 'recipients', 'sending_history', 'report_receivers')
+REDUNDANT_INDEXES = (('recipients', 'ix_recipients_normalized_identifier'),)
+
+def _drop_index(sync_conn, table_name: str, index_name: str):
+    preparer = sync_conn.dialect.identifier_preparer
+    if sync_conn.dialect.name in ('mysql', 'mariadb'):
+        sync_conn.execute(text(f'DROP INDEX {preparer.quote(index_name)} ON {preparer.quote(table_name)}'))
+    else:
+        sync_conn.execute(text(f'DROP INDEX {preparer.quote(index_name)}'))
+
+async def migrate_index_pack():
+    logger.info(f'[Миграция 9] Начинаем миграцию индексов: {engine.dialect.name}')
+    async with engine.begin() as conn:
+        for table_name, index_name in REDUNDANT_INDEXES:
+            if index_name in await conn.run_sync(_index_names, table_name):
+                await conn.run_sync(_drop_index, table_name, index_name)
+                logger.info(f'✅ Удален лишний индекс {index_name}')
+        for table_name in INDEX_PACK_TABLES:
+            existing_indexes = await conn.run_sync(_index_names, table_name)
+            existing_columns = await conn.run_sync(_column_names, table_name)
+            for index in Base.metadata.tables[table_name].indexes:
+                if index.name not in existing_indexes and all((col.name in existing_columns for col in index.columns)):
+                    await conn.run_sync(index.create)
+                    logger.info(f'✅ Создан индекс {index.name}')
+    logger.info('✅ [Миграция 9] Миграция индексов завершена успешно!')
+    return True
+
+async def migrate_delivery_ledger():
+    logger.info(f'[Миграция 10] Начинаем заполнение журнала доставок: {engine.dialect.name}')
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.tables['delivery_ledger'].create, checkfirst=True)
+        ledger = Base.metadata.tables['delivery_ledger']
+        campaigns = Base.metadata.tables['mailing_campaigns']
+        recipients = Base.metadata.tables['recipients']
+        if 'recipient_identifier' in await conn.run_sync(_column_names, 'sending_history'):
+            history = LEGACY_SENDING_HISTORY
+            normalized = func.coalesce(recipients.c.normalized_identifier, history.c.recipient_identifier)
+            recipient_join = (recipients.c.campaign_id == history.c.campaign_id) & (recipients.c.recipient_identifier == history.c.recipient_identifier)
+        else:
+            history = Base.metadata.tables['sending_history']
+            normalized = recipients.c.normalized_identifier
+            recipient_join = recipients.c.id == history.c.recipient_id
+        delivered = select(campaigns.c.template_id, normalized.label('normalized_identifier'), func.max(campaigns.c.id).label('campaign_id'), func.max(history.c.sent_at).label('delivered_at')).select_from(history.join(campaigns, history.c.campaign_id == campaigns.c.id).outerjoin(recipients, recipient_join)).where((history.c.success == True) & normalized.is_not(None)).group_by(campaigns.c.template_id, normalized)
+        result = await conn.execute(_insert_ignore(ledger).from_select(['template_id', 'normalized_identifier', 'campaign_id', 'delivered_at'], delivered))
+        logger.info(f'✅ Добавлено доставок в журнал: {max(result.rowcount, 0)}')
+    logger.info('✅ [Миграция 10] Заполнение журнала доставок завершено успешно!')
+    return True
+
+def _legacy_error_detail(code: str, details: str) -> Optional[str]:
+    prefixes = LEGACY_ERROR_DETAILS.get(code, ()) + ((ERROR_MESSAGES[code],) if code in ERROR_MESSAGES else ())
+    for prefix in sorted(prefixes, key=len, reverse=True):
+        if details.casefold().startswith(prefix.casefold()):
+            return details[len(prefix):].lstrip(' :.-') or None
+    return details
+
+def _compact_sending_history(sync_conn) -> int:
+    history = LEGACY_SENDING_HISTORY
+    existing_columns = _column_names(sync_conn, 'sending_history')
+    for column_name in ('recipient_id', 'error_code'):
+        if column_name not in existing_columns:
+            _add_column(sync_conn, 'sending_history', column_name)
+    recipients = Base.metadata.tables['recipients']
+    error_types = Base.metadata.tables['error_types']
+    error_types.create(sync_conn, checkfirst=True)
+    same_recipient = (recipients.c.campaign_id == history.c.campaign_id) & (recipients.c.recipient_identifier == history.c.recipient_identifier)
+    orphaned = sync_conn.execute(select(history.c.campaign_id, history.c.recipient_identifier).where(~select(recipients.c.id).where(same_recipient).exists()).distinct()).all()
+    if orphaned:
+        sync_conn.execute(insert(recipients), [{'campaign_id': campaign_id, 'recipient_identifier': identifier, 'normalized_identifier': normalize_identifier(identifier)} for campaign_id, identifier in orphaned])
+    restored = len(orphaned)
+    logger.info(f'✅ Восстановлено получателей для старых записей истории: {restored}')
+    rows = sync_conn.execute(update(history).values(recipient_id=select(func.min(recipients.c.id)).where(same_recipient).scalar_subquery())).rowcount
+    codes = set(sync_conn.execute(select(history.c.error_type).where(history.c.error_type.is_not(None)).distinct()).scalars())
+    known_codes = dict(sync_conn.execute(select(error_types.c.code, error_types.c.id)).all())
+    next_id = max(known_codes.values(), default=0) + 1
+    for code in sorted(codes - known_codes.keys()):
+        sync_conn.execute(insert(error_types).values(id=next_id, code=code, message=ERROR_MESSAGES.get(code)))
+        next_id += 1
+    logger.info(f'✅ Типов ошибок в справочнике: {len(known_codes.keys() | codes)}')
+    sync_conn.execute(update(history).values(error_code=select(error_types.c.id).where(error_types.c.code == history.c.error_type).scalar_subquery()))
+    details = [{'b_code': code, 'b_details': text, 'b_stripped': _legacy_error_detail(code, text)} for code, text in sync_conn.execute(select(history.c.error_type, history.c.error_details).where(history.c.error_type.is_not(None) & history.c.error_details.is_not(None)).distinct())]
+    stripped = [row for row in details if row['b_stripped'] != row['b_details']]
+    if stripped:
+        sync_conn.execute(update(history).where((history.c.error_type == bindparam('b_code')) & (history.c.error_details == bindparam('b_details'))).values(error_details=bindparam('b_stripped')), stripped)
+    logger.info(f'✅ Сокращено текстов ошибок: {len(stripped)}')
+    if 'ix_sending_history_recipient_success' in _index_names(sync_conn, 'sending_history'):
+        _drop_index(sync_conn, 'sending_history', 'ix_sending_history_recipient_success')
+    for column_name in ('recipient_identifier', 'error_type'):
+        if column_name in _column_names(sync_conn, 'sending_history'):
+            _drop_column(sync_conn, 'sending_history', column_name)
+    existing_indexes = _index_names(sync_conn, 'sending_history')
+    for index in Base.metadata.tables['sending_history'].indexes:
+        if index.name not in existing_indexes:
+            index.create(sync_conn)
+    return rows
+
+async def migrate_compact_sending_history():
+    logger.info(f'[Миграция 11] Начинаем сжатие sending_history: {engine.dialect.name}')
+    async with engine.begin() as conn:
+        if 'recipient_identifier' not in await conn.run_sync(_column_names, 'sending_history'):
+            logger.info('✅ [Миграция 11] sending_history уже в компактном формате, миграция не требуется')
+            return True
+        rows = await conn.run_sync(_compact_sending_history)
+        logger.info(f'✅ Перенесено записей истории: {rows}')
+    logger.info('✅ [Миграция 11] Сжатие sending_history завершено успешно!')
+    return True
+
 async def run_all_migrations():
     logger.info('=' * 60)
     logger.info('🚀 Начинаем выполнение всех миграций базы данных')
     logger.info('=' * 60)
-    migrations = [('Users Table', migrate_users_table), ('Delay Seconds', migrate_delay_seconds), ('Max Recipients', migrate_max_recipients), ('Report Lists', migrate_report_lists), ('Bot Groups', migrate_bot_groups), ('Template Media', migrate_template_media)]
+    migrations = [('Users Table', migrate_users_table), ('Delay Seconds', migrate_delay_seconds), ('Max Recipients', migrate_max_recipients), ('Report Lists', migrate_report_lists), ('Bot Groups', migrate_bot_groups), ('Template Media', migrate_template_media), ('Report Receivers Unique', migrate_report_receivers_unique), ('Campaign Leases', migrate_campaign_leases), ('Index Pack', migrate_index_pack), ('Delivery Ledger', migrate_delivery_ledger), ('Compact Sending History', migrate_compact_sending_history)]
     results = []
     for name, migration_func in migrations:
         try:
@@ -196,6 +344,8 @@ async def main():
     except Exception as e:
         logger.error(f'Критическая ошибка при выполнении миграций: {e}', exc_info=True)
         return 1
+    finally:
+        await engine.dispose()
 if __name__ == '__main__':
     exit_code = asyncio.run(main())
     exit(exit_code)
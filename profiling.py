@@ -0,0 +1,66 @@
+import gc
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from typing import List, Optional, Tuple
+from pyrogram import Client
+from database import Base
+from config import PROFILING_TRACE_FRAMES
+_IGNORED_TRACES = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, '<frozen importlib._bootstrap>'), tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'), tracemalloc.Filter(False, '<unknown>'))
+
+class MemoryProfiler:
+    def __init__(self, frames: int=PROFILING_TRACE_FRAMES):
+        self.frames = frames
+        self.started_at: Optional[datetime] = None
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+
+    @property
+    def is_tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: Optional[int]=None) -> bool:
+        if tracemalloc.is_tracing():
+            return False
+        self.frames = frames or self.frames
+        tracemalloc.start(self.frames)
+        self.started_at = datetime.now()
+        self._baseline = None
+        return True
+
+    def stop(self) -> bool:
+        if not tracemalloc.is_tracing():
+            return False
+        tracemalloc.stop()
+        self.started_at = None
+        self._baseline = None
+        return True
+
+    def traced_memory(self) -> Tuple[int, int]:
+        return tracemalloc.get_traced_memory()
+
+    def _take_snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(_IGNORED_TRACES)
+
+    def snapshot(self, limit: int=10) -> List[tracemalloc.Statistic]:
+        snapshot = self._take_snapshot()
+        self._baseline = snapshot
+        return snapshot.statistics('lineno')[:limit]
+
+    def diff(self, limit: int=10) -> Optional[List[tracemalloc.StatisticDiff]]:
+        snapshot = self._take_snapshot()
+        baseline, self._baseline = self._baseline, snapshot
+        if baseline is None:
+            return None
+        return snapshot.compare_to(baseline, 'lineno')[:limit]
+memory_profiler = MemoryProfiler()
+
+def count_objects(limit: int=15) -> Tuple[List[Tuple[str, int]], List[Tuple[str, int]], int]:
+    orm_classes = {mapper.class_ for mapper in Base.registry.mappers}
+    counts = Counter()
+    tracked = Counter()
+    for obj in gc.get_objects():
+        cls = type(obj)
+        counts[cls.__name__] += 1
+        if cls in orm_classes or isinstance(obj, Client):
+            tracked[cls.__name__] += 1
+    return (sorted(tracked.items(), key=lambda item: item[1], reverse=True), counts.most_common(limit), sum(counts.values()))
@@ -0,0 +1,99 @@
+import asyncio
+import gzip
+import os
+import socket
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from sqlalchemy import text
+import database as crud
+from database import engine
+from config import HISTORY_RETENTION_DAYS, HISTORY_ARCHIVE_DIR, RETENTION_BATCH_SIZE, RETENTION_LEASE_SECONDS, RETENTION_VACUUM_PAGES
+from utils import logger, iter_jsonl_lines, SENDING_HISTORY_EXPORT_COLUMNS
+RECIPIENT_ARCHIVE_COLUMNS = ('id', 'campaign_id', 'recipient', 'normalized', 'is_duplicate', 'previous_campaign_id', 'created_at')
+RETENTION_LEASE = 'retention'
+RUNNER_ID = f'{socket.gethostname()}:{os.getpid()}'
+
+def archive_path(table_name: str, month: str, first_id: int, last_id: int) -> str:
+    return os.path.join(HISTORY_ARCHIVE_DIR, f'{table_name}-{month}-{first_id}-{last_id}.jsonl.gz')
+
+def _write_archive(table_name: str, columns: Tuple[str, ...], rows: List[Tuple]):
+    by_month: Dict[str, List[Tuple]] = defaultdict(list)
+    for row in rows:
+        by_month[row[-1].strftime('%Y-%m') if row[-1] else 'unknown'].append(row)
+    os.makedirs(HISTORY_ARCHIVE_DIR, exist_ok=True)
+    for month, month_rows in by_month.items():
+        month_rows.sort(key=lambda row: row[0])
+        path = archive_path(table_name, month, month_rows[0][0], month_rows[-1][0])
+        with gzip.open(f'{path}.part', 'wt', encoding='utf-8') as archive:
+            archive.writelines(iter_jsonl_lines(month_rows, columns))
+        os.replace(f'{path}.part', path)
+
+async def _archive_table(table_name: str, columns: Tuple[str, ...], fetch: Callable[[datetime, int], Awaitable[List[Tuple]]], delete: Callable[[List[int]], Awaitable[int]], cutoff: datetime) -> int:
+    archived = 0
+    while True:
+        if not await crud.acquire_job_lease(RETENTION_LEASE, RUNNER_ID, RETENTION_LEASE_SECONDS):
+            raise RuntimeError('блокировка архивации перехвачена другим процессом')
+        rows = await fetch(cutoff, RETENTION_BATCH_SIZE)
+        if not rows:
+            break
+        await asyncio.to_thread(_write_archive, table_name, columns, rows)
+        archived += await delete([row[0] for row in rows])
+        await asyncio.sleep(0)
+    if archived:
+        logger.info(f'Архивировано строк {table_name}: {archived}')
+    return archived
+
+async def vacuum_database():
+    dialect = engine.dialect.name
+    if dialect == 'sqlite':
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+            if await conn.scalar(text('PRAGMA auto_vacuum')) != 2:
+                logger.info('Переводим SQLite в режим auto_vacuum=INCREMENTAL (однократный полный VACUUM)')
+                await conn.execute(text('PRAGMA auto_vacuum = INCREMENTAL'))
+                await conn.execute(text('VACUUM'))
+                return
+            while await conn.scalar(text('PRAGMA freelist_count')):
+                await conn.execute(text(f'PRAGMA incremental_vacuum({RETENTION_VACUUM_PAGES})'))
+                await asyncio.sleep(0.1)
+    elif dialect == 'postgresql':
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+            for table_name in ('sending_history', 'recipients'):
+                await conn.execute(text(f'VACUUM (ANALYZE) {table_name}'))
+    else:
+        logger.info(f'VACUUM для {dialect} не выполняется, место освобождает сама СУБД')
+        return
+    logger.info('✅ Очистка места в базе данных завершена')
+
+async def run_retention(retention_days: int=HISTORY_RETENTION_DAYS) -> Optional[Dict[str, int]]:
+    if not await crud.acquire_job_lease(RETENTION_LEASE, RUNNER_ID, RETENTION_LEASE_SECONDS):
+        logger.info('Архивация уже выполняется другим процессом, пропускаем')
+        return None
+    try:
+        cutoff = datetime.now() - timedelta(days=retention_days)
+        logger.info(f'Архивация истории старше {cutoff:%d.%m.%Y} в {HISTORY_ARCHIVE_DIR}')
+        archived = {'sending_history': await _archive_table('sending_history', SENDING_HISTORY_EXPORT_COLUMNS, crud.get_archivable_sending_history, crud.delete_sending_history_rows, cutoff), 'recipients': await _archive_table('recipients', RECIPIENT_ARCHIVE_COLUMNS, crud.get_archivable_recipients, crud.delete_recipient_rows, cutoff)}
+        if any(archived.values()):
+            await vacuum_database()
+        return archived
+    finally:
+        await crud.release_job_lease(RETENTION_LEASE, RUNNER_ID)
+
+async def main():
+    if HISTORY_RETENTION_DAYS <= 0:
+        logger.info('Архивация истории выключена: задайте HISTORY_RETENTION_DAYS и постоянный HISTORY_ARCHIVE_DIR')
+        return 0
+    try:
+        await crud.init_db()
+        await run_retention()
+        return 0
+    except Exception as e:
+        logger.error(f'Ошибка при архивации истории: {e}', exc_info=True)
+        return 1
+    finally:
+        await crud.close_db()
+if __name__ == '__main__':
+    exit_code = asyncio.run(main())
+    exit(exit_code)
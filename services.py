@@ -1,15 +1,22 @@
 import asyncio
+import os
+import tempfile
+import zlib
+from collections import OrderedDict
 from datetime import datetime, time
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from aiogram import Bot
-from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramAPIError
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramAPIError, TelegramRetryAfter
 from pyrogram import Client
 from pyrogram.enums import ChatType
-from pyrogram.errors import UserNotParticipant, ChatWriteForbidden, FloodWait, PeerIdInvalid, UsernameNotOccupied, UsernameInvalid, UserPrivacyRestricted, UserDeactivated, ChannelPrivate, ChatAdminRequired, InviteHashExpired, InviteHashInvalid, UserAlreadyParticipant, PeerFlood
+from pyrogram.errors import UserNotParticipant, ChatWriteForbidden, FloodWait, PeerIdInvalid, UsernameNotOccupied, UsernameInvalid, UserPrivacyRestricted, UserDeactivated, ChannelPrivate, ChatAdminRequired, InviteHashExpired, InviteHashInvalid, UserAlreadyParticipant, PeerFlood, FileReferenceExpired, FileReferenceInvalid
 import database as crud
-from database import MailingCampaign, Template, Recipient, User, SendingHistory, async_session_maker
-from utils import normalize_identifier, logger, format_personal_report, format_summary_report
-from config import API_ID, API_HASH, PHONE_NUMBER
+from database import MailingCampaign, Template, Recipient, User, SendingHistory, CampaignPlan, PlanRecipient, async_session_maker
+from utils import normalize_identifier, logger, format_campaign_progress, format_summary_report, format_personal_report_header, format_personal_report_footer, format_failed_recipient, iter_csv_lines, iter_jsonl_lines, PERSONAL_REPORT_CSV_HEADER, SENDING_HISTORY_EXPORT_COLUMNS, PERSONAL_REPORT_ERRORS, TELEGRAM_MESSAGE_LIMIT
+from keyboards import get_report_keyboard
+from media_bridge import get_client_media, invalidate_client_media, invalidate_template_media
+from metrics import track_queries
+from config import API_ID, API_HASH, PHONE_NUMBER, SUMMARY_REPORT_CONCURRENCY, SUMMARY_REPORT_MESSAGES_PER_SECOND, PROGRESS_UPDATE_SECONDS, PROGRESS_UPDATE_RECIPIENTS, REPORT_CACHE_SIZE
 
 def is_within_allowed_time() -> bool:
     current_time = datetime.now().time()
@@ -68,93 +75,212 @@ async def send_with_error_handling(bot: Bot, recipient_identifier: str, text: st
         logger.error(f'Неизвестная ошибка при отправке {recipient_identifier}: {error_msg}')
         return {'success': False, 'error_type': 'unknown', 'error_details': error_msg, 'telegram_message_id': None}
 
-async def process_mailing(bot: Bot, campaign: MailingCampaign, template: Template, recipients: List[Recipient]) -> Dict:
-    logger.info(f'Начало обработки рассылки {campaign.campaign_id}')
+class ProgressReporter:
+    def __init__(self, bot: Bot, plan: CampaignPlan, total: int, sent: int, failed: int, duplicates: int):
+        self.bot = bot
+        self.plan = plan
+        self.total = total
+        self.sent = sent
+        self.failed = failed
+        self.duplicates = duplicates
+        self._loop = asyncio.get_running_loop()
+        self._started_at = self._loop.time()
+        self._processed_at_start = self.processed
+        self._next_flush_at = self._started_at + PROGRESS_UPDATE_SECONDS
+        self._pending = 0
+        self._message_id = None
+        self._text = None
+        self._task = None
+
+    @property
+    def processed(self) -> int:
+        return self.sent + self.failed + self.duplicates
+
+    def eta_seconds(self) -> Optional[float]:
+        remaining = self.total - self.processed
+        if remaining <= 0:
+            return None
+        done = self.processed - self._processed_at_start
+        if done:
+            return (self._loop.time() - self._started_at) / done * remaining
+        return remaining * (self.plan.delay_seconds or 5)
+
+    def _render(self, status: str) -> str:
+        return format_campaign_progress(self.plan.campaign_id, self.total, self.sent, self.failed, self.duplicates, self.eta_seconds(), status)
+
+    async def start(self):
+        self._text = self._render('processing')
+        try:
+            message = await self.bot.send_message(chat_id=self.plan.owner_id, text=self._text, parse_mode=None)
+            self._message_id = message.message_id
+        except Exception as e:
+            logger.error(f'Ошибка при отправке сообщения о ходе рассылки {self.plan.campaign_id}: {e}')
+
+    def record(self, success: bool):
+        if success:
+            self.sent += 1
+        else:
+            self.failed += 1
+        self._pending += 1
+        if self._pending >= PROGRESS_UPDATE_RECIPIENTS or self._loop.time() >= self._next_flush_at:
+            if self._task is None or self._task.done():
+                self._task = asyncio.create_task(self._flush('processing'))
+
+    async def _flush(self, status: str):
+        self._pending = 0
+        self._next_flush_at = self._loop.time() + PROGRESS_UPDATE_SECONDS
+        if status == 'processing':
+            await crud.update_campaign_stats(self.plan.id, total=self.total, sent=self.sent, failed=self.failed, duplicates=self.duplicates)
+        text = self._render(status)
+        if self._message_id is None or text == self._text:
+            return
+        try:
+            await self.bot.edit_message_text(text=text, chat_id=self.plan.owner_id, message_id=self._message_id, parse_mode=None)
+            self._text = text
+        except TelegramRetryAfter as e:
+            logger.warning(f'Лимит Bot API при обновлении хода рассылки {self.plan.campaign_id}, следующее обновление через {e.retry_after} секунд')
+            self._next_flush_at = self._loop.time() + e.retry_after
+        except TelegramBadRequest as e:
+            if 'message is not modified' in str(e).lower():
+                self._text = text
+            else:
+                logger.warning(f'Не удалось обновить сообщение о ходе рассылки {self.plan.campaign_id}: {e}')
+                self._message_id = None
+        except Exception as e:
+            logger.error(f'Ошибка при обновлении хода рассылки {self.plan.campaign_id}: {e}')
+
+    async def finish(self, status: str):
+        if self._task is not None:
+            try:
+                await self._task
+            except Exception as e:
+                logger.error(f'Ошибка при обновлении хода рассылки {self.plan.campaign_id}: {e}')
+        await self._flush(status)
+
+async def update_template(template_id: int, name: Optional[str]=None, text: Optional[str]=None, media_type: Optional[str]=None, media_file_id: Optional[str]=None, media_file_unique_id: Optional[str]=None) -> Optional[Template]:
+    previous = await crud.get_template(template_id) if media_file_unique_id is not None else None
+    template = await crud.update_template(template_id, name=name, text=text, media_type=media_type, media_file_id=media_file_id, media_file_unique_id=media_file_unique_id)
+    if previous is not None and template is not None and previous.media_file_unique_id != template.media_file_unique_id:
+        invalidate_template_media(previous.media_file_unique_id)
+    return template
+
+async def _skip_duplicate(plan: CampaignPlan, recipient: PlanRecipient, duplicate_info: Dict):
+    await crud.mark_recipient_as_duplicate(recipient.id, duplicate_info.get('previous_campaign_id'))
+    await crud.add_sending_history(plan.id, recipient.id, False, 'duplicate', f'Пропущен дубль (уже отправлялось в {duplicate_info.get('campaign_id')})', None)
+
+async def process_mailing(bot: Bot, plan: CampaignPlan, resume: bool=False) -> Dict:
+    with track_queries() as queries:
+        try:
+            return await _run_mailing(bot, plan, resume)
+        finally:
+            logger.info(f'Рассылка {plan.campaign_id}: SQL-запросов {queries.count}, время БД {queries.seconds:.2f} с')
+
+async def _run_mailing(bot: Bot, plan: CampaignPlan, resume: bool) -> Dict:
+    recipients = plan.recipients
+    logger.info(f'Начало обработки рассылки {plan.campaign_id}')
     if not is_within_allowed_time():
         current_time = datetime.now().time()
         logger.warning(f'Попытка запуска рассылки вне разрешенного времени. Текущее время: {current_time}')
-        await crud.update_campaign_status(campaign.id, 'failed', completed_at=datetime.now())
+        await crud.update_campaign_status(plan.id, 'failed', completed_at=datetime.now())
         return {'success': False, 'error': 'Рассылка разрешена только с 09:00 до 22:00', 'sent_count': 0, 'failed_count': len(recipients), 'duplicates_count': 0}
-    if campaign.max_recipients and len(recipients) > campaign.max_recipients:
-        logger.info(f'Ограничиваем рассылку до {campaign.max_recipients} получателей (было {len(recipients)})')
-        recipients = recipients[:campaign.max_recipients]
-    logger.info(f'Проверка статуса аккаунта перед началом рассылки {campaign.campaign_id}')
-    account_status = await check_account_status(campaign.owner_id)
+    if plan.max_recipients and len(recipients) > plan.max_recipients:
+        logger.info(f'Ограничиваем рассылку до {plan.max_recipients} получателей (было {len(recipients)})')
+        recipients = recipients[:plan.max_recipients]
+    total = len(recipients)
+    progress = await crud.get_campaign_progress(plan.id) if resume else {'processed': set(), 'sent': 0, 'failed': 0, 'duplicates': 0}
+    if progress['processed']:
+        recipients = tuple((r for r in recipients if r.id not in progress['processed']))
+        logger.info(f'Возобновляем рассылку {plan.campaign_id}: уже обработано {total - len(recipients)}, осталось {len(recipients)}')
+    logger.info(f'Проверка статуса аккаунта перед началом рассылки {plan.campaign_id}')
+    account_status = await check_account_status(plan.owner_id)
     if not account_status['success']:
         if account_status['error_type'] == 'peer_flood':
-            logger.error(f'⚠️ PEER_FLOOD обнаружен при проверке статуса! Останавливаем рассылку {campaign.campaign_id}')
-            await crud.update_campaign_status(campaign.id, 'failed', completed_at=datetime.now())
+            logger.error(f'⚠️ PEER_FLOOD обнаружен при проверке статуса! Останавливаем рассылку {plan.campaign_id}')
+            await crud.update_campaign_status(plan.id, 'failed', completed_at=datetime.now())
             try:
-                await bot.send_message(chat_id=campaign.owner_id, text=f'⚠️ РАССЫЛКА ОТМЕНЕНА\n\nКампания: {campaign.campaign_id}\nПричина: Аккаунт все еще ограничен Telegram (PEER_FLOOD)\n\n💡 ВАЖНО:\n• Ограничение может быть снято для Bot API, но еще активно для Client API\n• Подождите еще 1-2 часа после снятия ограничения\n• Проверьте статус через @SpamBot и убедитесь, что ограничение полностью снято\n• После снятия ограничения попробуйте запустить рассылку снова\n\n📝 Детали: {account_status.get('error_details', 'Неизвестная ошибка')}', parse_mode=None)
-                logger.info(f'Уведомление о PEER_FLOOD отправлено владельцу {campaign.owner_id}')
+                await bot.send_message(chat_id=plan.owner_id, text=f'⚠️ РАССЫЛКА ОТМЕНЕНА\n\nКампания: {plan.campaign_id}\nПричина: Аккаунт все еще ограничен Telegram (PEER_FLOOD)\n\n💡 ВАЖНО:\n• Ограничение может быть снято для Bot API, но еще активно для Client API\n• Подождите еще 1-2 часа после снятия ограничения\n• Проверьте статус через @SpamBot и убедитесь, что ограничение полностью снято\n• После снятия ограничения попробуйте запустить рассылку снова\n\n📝 Детали: {account_status.get('error_details', 'Неизвестная ошибка')}', parse_mode=None)
+                logger.info(f'Уведомление о PEER_FLOOD отправлено владельцу {plan.owner_id}')
             except Exception as e:
                 logger.error(f'Ошибка при отправке уведомления о PEER_FLOOD: {e}')
             return {'success': False, 'error': account_status.get('error_details', 'Аккаунт ограничен'), 'sent_count': 0, 'failed_count': len(recipients), 'duplicates_count': 0}
         else:
             logger.warning(f'Предупреждение при проверке статуса аккаунта: {account_status.get('error_details')}')
-    await crud.update_campaign_status(campaign.id, 'processing', started_at=datetime.now())
-    new_recipients = []
-    duplicate_recipients = []
+    await crud.update_campaign_status(plan.id, 'processing', started_at=None if progress['processed'] else datetime.now())
+    duplicate_ids = set()
+    duplicate_identifiers = []
     for recipient in recipients:
-        duplicate_info = await crud.check_duplicate(template.id, recipient.normalized_identifier)
+        duplicate_info = await crud.check_duplicate(plan.template_id, recipient.normalized)
         if duplicate_info and duplicate_info.get('is_duplicate'):
-            duplicate_recipients.append({'recipient': recipient, 'previous_campaign': duplicate_info.get('campaign_id'), 'previous_time': duplicate_info.get('previous_time')})
-            await crud.mark_recipient_as_duplicate(recipient.id, duplicate_info.get('previous_campaign_id'))
-            await crud.add_sending_history(campaign.id, recipient.recipient_identifier, False, 'duplicate', f'Пропущен дубль (уже отправлялось в {duplicate_info.get('campaign_id')})', None)
-        else:
-            new_recipients.append(recipient)
-    logger.info(f'Найдено новых получателей: {len(new_recipients)}, дублей (пропущено): {len(duplicate_recipients)}')
-    sent_count = 0
-    failed_count = 0
+            duplicate_ids.add(recipient.id)
+            duplicate_identifiers.append(recipient.identifier)
+            await _skip_duplicate(plan, recipient, duplicate_info)
+    logger.info(f'Найдено новых получателей: {len(recipients) - len(duplicate_ids)}, дублей (пропущено): {len(duplicate_ids)}')
+    sent_count = progress['sent']
+    failed_count = progress['failed']
+    reporter = ProgressReporter(bot, plan, total, sent_count, failed_count, progress['duplicates'] + len(duplicate_identifiers))
+    await reporter.start()
+    final_status = 'completed'
     last_was_new = False
     for recipient in recipients:
-        duplicate_info = await crud.check_duplicate(template.id, recipient.normalized_identifier)
-        if duplicate_info and duplicate_info.get('is_duplicate'):
-            logger.debug(f'Пропущен дубль: {recipient.recipient_identifier} (уже отправлялось ранее)')
+        if recipient.id in duplicate_ids:
+            logger.debug(f'Пропущен дубль: {recipient.identifier} (уже отправлялось ранее)')
             last_was_new = False
             continue
         if last_was_new:
-            delay = campaign.delay_seconds or 5
+            delay = plan.delay_seconds or 5
             logger.debug(f'Задержка {delay} секунд перед отправкой новому получателю (выбранный интервал)')
             await asyncio.sleep(delay)
-        result = await send_message_as_user(recipient.recipient_identifier, template.text, sender_user_id=campaign.owner_id, media_type=template.media_type, media_file_id=template.media_file_id)
-        await crud.add_sending_history(campaign.id, recipient.recipient_identifier, result['success'], result['error_type'], result['error_details'], result['telegram_message_id'])
+        duplicate_info = await crud.claim_delivery(plan.template_id, recipient.normalized, plan.id)
+        if duplicate_info:
+            logger.info(f'Получатель {recipient.identifier} уже получил сообщение в рассылке {duplicate_info.get('campaign_id')}, пропускаем')
+            duplicate_identifiers.append(recipient.identifier)
+            reporter.duplicates += 1
+            await _skip_duplicate(plan, recipient, duplicate_info)
+            last_was_new = False
+            continue
+        result = await send_message_as_user(recipient.identifier, plan.template_text, sender_user_id=plan.owner_id, media_type=plan.media_type, media_file_id=plan.media_file_id, media_file_unique_id=plan.media_file_unique_id, bot=bot)
+        await crud.add_sending_history(plan.id, recipient.id, result['success'], result['error_type'], result['error_details'], result['telegram_message_id'])
+        reporter.record(result['success'])
         if result['success']:
+            await crud.record_delivery(plan.template_id, recipient.normalized, plan.id)
             sent_count += 1
             last_was_new = True
         else:
+            await crud.release_delivery(plan.template_id, recipient.normalized, plan.id)
             failed_count += 1
             if result['error_type'] == 'peer_flood':
-                logger.error(f'⚠️ PEER_FLOOD обнаружен! Останавливаем рассылку {campaign.campaign_id}')
-                await crud.update_campaign_status(campaign.id, 'failed', completed_at=datetime.now())
-                await crud.update_campaign_stats(campaign.id, total=len(recipients), sent=sent_count, failed=failed_count, duplicates=len(duplicate_recipients))
+                logger.error(f'⚠️ PEER_FLOOD обнаружен! Останавливаем рассылку {plan.campaign_id}')
+                final_status = 'failed'
+                await crud.update_campaign_status(plan.id, 'failed', completed_at=datetime.now())
+                await crud.update_campaign_stats(plan.id, total=total, sent=sent_count, failed=failed_count, duplicates=progress['duplicates'] + len(duplicate_identifiers))
                 try:
-                    await bot.send_message(chat_id=campaign.owner_id, text=f'⚠️ РАССЫЛКА ПРЕРВАНА\n\nКампания: {campaign.campaign_id}\nПричина: Аккаунт ограничен Telegram (PEER_FLOOD)\n\nОтправлено до ограничения: {sent_count}\nОшибок: {failed_count}\n\n💡 РЕКОМЕНДАЦИИ:\n• Увеличьте интервал между сообщениями (минимум 15-30 секунд)\n• Уменьшите количество получателей за раз (используйте ограничение 10, 50, 100)\n• Подождите 1-2 часа перед следующей рассылкой\n• Избегайте интервалов менее 10 секунд', parse_mode=None)
-                    logger.info(f'Уведомление о PEER_FLOOD отправлено владельцу {campaign.owner_id}')
+                    await bot.send_message(chat_id=plan.owner_id, text=f'⚠️ РАССЫЛКА ПРЕРВАНА\n\nКампания: {plan.campaign_id}\nПричина: Аккаунт ограничен Telegram (PEER_FLOOD)\n\nОтправлено до ограничения: {sent_count}\nОшибок: {failed_count}\n\n💡 РЕКОМЕНДАЦИИ:\n• Увеличьте интервал между сообщениями (минимум 15-30 секунд)\n• Уменьшите количество получателей за раз (используйте ограничение 10, 50, 100)\n• Подождите 1-2 часа перед следующей рассылкой\n• Избегайте интервалов менее 10 секунд', parse_mode=None)
+                    logger.info(f'Уведомление о PEER_FLOOD отправлено владельцу {plan.owner_id}')
                 except Exception as e:
                     logger.error(f'Ошибка при отправке уведомления о PEER_FLOOD: {e}')
                 break
             last_was_new = True
-    await crud.update_campaign_stats(campaign.id, total=len(recipients), sent=sent_count, failed=failed_count, duplicates=len(duplicate_recipients))
-    await crud.update_campaign_status(campaign.id, 'completed', completed_at=datetime.now())
-    logger.info(f'Рассылка {campaign.campaign_id} завершена. Отправлено: {sent_count}, Ошибок: {failed_count}, Дублей: {len(duplicate_recipients)}')
-    if duplicate_recipients:
-        dup_list = ', '.join([d['recipient'].recipient_identifier for d in duplicate_recipients[:10]])
-        if len(duplicate_recipients) > 10:
-            dup_list += f', ... и еще {len(duplicate_recipients) - 10}'
+    await reporter.finish(final_status)
+    await crud.update_campaign_stats(plan.id, total=total, sent=sent_count, failed=failed_count, duplicates=progress['duplicates'] + len(duplicate_identifiers))
+    await crud.update_campaign_status(plan.id, 'completed', completed_at=datetime.now())
+    logger.info(f'Рассылка {plan.campaign_id} завершена. Отправлено: {sent_count}, Ошибок: {failed_count}, Дублей: {len(duplicate_identifiers)}')
+    if duplicate_identifiers:
+        dup_list = ', '.join(duplicate_identifiers[:10])
+        if len(duplicate_identifiers) > 10:
+            dup_list += f', ... и еще {len(duplicate_identifiers) - 10}'
         try:
-            await bot.send_message(chat_id=campaign.owner_id, text=f'ℹ️ Обнаружено дублей: {len(duplicate_recipients)}\n\nДубли пропущены (сообщение уже отправлялось этим пользователям ранее):\n{dup_list}\n\nПауза при переходе от дубля к новому получателю не применялась.', parse_mode=None)
-            logger.info(f'Уведомление о дублях отправлено владельцу {campaign.owner_id}')
+            await bot.send_message(chat_id=plan.owner_id, text=f'ℹ️ Обнаружено дублей: {len(duplicate_identifiers)}\n\nДубли пропущены (сообщение уже отправлялось этим пользователям ранее):\n{dup_list}\n\nПауза при переходе от дубля к новому получателю не применялась.', parse_mode=None)
+            logger.info(f'Уведомление о дублях отправлено владельцу {plan.owner_id}')
         except Exception as e:
             logger.error(f'Ошибка при отправке уведомления о дублях: {e}')
     try:
-        report = await generate_personal_report(campaign.id)
-        if report:
-            await bot.send_message(chat_id=campaign.owner_id, text=report, parse_mode=None)
-            logger.info(f'Персональный отчет отправлен владельцу {campaign.owner_id}')
+        page = await render_personal_report_page(plan.id)
+        if page:
+            await bot.send_message(chat_id=plan.owner_id, text=page['text'], reply_markup=get_report_keyboard(plan.id, page['after_id'], page['next_after_id']), parse_mode=None)
+            logger.info(f'Персональный отчет отправлен владельцу {plan.owner_id}')
     except Exception as e:
         logger.error(f'Ошибка при отправке персонального отчета: {e}', exc_info=True)
-    return {'sent': sent_count, 'failed': failed_count, 'duplicates': len(duplicate_recipients), 'duplicate_list': [d['recipient'].recipient_identifier for d in duplicate_recipients], 'duplicate_recipients': duplicate_recipients}
+    return {'sent': sent_count, 'failed': failed_count, 'duplicates': len(duplicate_identifiers), 'duplicate_list': duplicate_identifiers}
 
 async def send_duplicates(bot: Bot, campaign: MailingCampaign, template: Template, duplicate_recipients: List[Recipient]) -> Dict:
     logger.warning(f'Попытка отправить дубли для рассылки {campaign.campaign_id} - дубли не отправляются, так как сообщение уже отправлялось')
@@ -164,27 +290,151 @@ async def send_duplicates(bot: Bot, campaign: MailingCampaign, template: Templat
         await crud.update_campaign_stats(updated_campaign.id, total=updated_campaign.total_recipients, sent=updated_campaign.sent_successfully + sent_count, failed=updated_campaign.sent_failed + failed_count, duplicates=max(0, updated_campaign.duplicates_count - sent_count))
     return {'sent': sent_count, 'failed': failed_count}
 
-async def generate_personal_report(campaign_id: int) -> Optional[str]:
-    campaign = await crud.get_campaign(campaign_id)
+FINISHED_CAMPAIGN_STATUSES = ('completed', 'failed')
+
+class ReportCache:
+    def __init__(self, maxsize: int=REPORT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._pages: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(campaign: MailingCampaign, after_id: int) -> Optional[Tuple]:
+        if campaign.status not in FINISHED_CAMPAIGN_STATUSES:
+            return None
+        return (campaign.id, campaign.status, campaign.completed_at, after_id)
+
+    def get(self, key: Tuple) -> Optional[Dict]:
+        page = self._pages.get(key)
+        if page is None:
+            self.misses += 1
+            return None
+        self._pages.move_to_end(key)
+        self.hits += 1
+        return dict(page)
+
+    def put(self, key: Tuple, page: Dict):
+        self._pages[key] = dict(page)
+        self._pages.move_to_end(key)
+        while len(self._pages) > self.maxsize:
+            self._pages.popitem(last=False)
+
+    def clear(self):
+        self._pages.clear()
+
+    def __len__(self) -> int:
+        return len(self._pages)
+report_cache = ReportCache()
+
+async def render_personal_report_page(campaign_id: int, after_id: int=0, campaign: Optional[MailingCampaign]=None) -> Optional[Dict]:
+    if campaign is None:
+        campaign = await crud.get_campaign(campaign_id)
     if not campaign:
         return None
+    cache_key = report_cache.key(campaign, after_id)
+    if cache_key is not None:
+        page = report_cache.get(cache_key)
+        if page is not None:
+            return page
+    page = await _render_personal_report_page(campaign, after_id)
+    if page is not None and cache_key is not None:
+        report_cache.put(cache_key, page)
+    return page
+
+async def _render_personal_report_page(campaign: MailingCampaign, after_id: int) -> Optional[Dict]:
+    campaign_id = campaign.id
     template = await crud.get_template(campaign.template_id)
     if not template:
         return None
     owner = await crud.get_user_by_telegram_id(campaign.owner_id)
     if not owner:
         return None
-    history = await crud.get_campaign_sending_history(campaign_id)
-    from database import Recipient
-    from sqlalchemy import select
-    from database import async_session_maker
-    duplicates = []
-    async with async_session_maker() as session:
-        result = await session.execute(select(Recipient).where(Recipient.campaign_id == campaign_id, Recipient.is_duplicate == True))
-        duplicate_recipients = list(result.scalars().all())
-        duplicates = [r.recipient_identifier for r in duplicate_recipients]
-    report = format_personal_report(campaign, template, owner, history, duplicates)
-    return report
+    duplicates, duplicates_total = await crud.get_campaign_duplicates(campaign_id)
+    header = format_personal_report_header(campaign, template, owner)
+    footer = format_personal_report_footer(campaign, duplicates, duplicates_total)
+    section = '\n\nНЕОТПРАВЛЕННЫЕ (продолжение):\n' if after_id else '\n\nНЕОТПРАВЛЕННЫЕ:\n'
+    budget = TELEGRAM_MESSAGE_LIMIT - len(header) - len(footer) - len(section)
+    lines = []
+    size = 0
+    last_id = after_id
+    next_after_id = None
+    rows = crud.iter_failed_history(campaign_id, after_id)
+    try:
+        async for history_id, recipient_identifier, error_type, _, _ in rows:
+            line = format_failed_recipient(recipient_identifier, error_type)[:budget]
+            if lines and size + len(line) + 1 > budget:
+                next_after_id = last_id
+                break
+            lines.append(line)
+            size += len(line) + 1
+            last_id = history_id
+    finally:
+        await rows.aclose()
+    text = header
+    if lines:
+        text += section + '\n'.join(lines)
+    return {'text': text + footer, 'after_id': after_id, 'next_after_id': next_after_id}
+
+async def generate_personal_report(campaign_id: int) -> Optional[str]:
+    page = await render_personal_report_page(campaign_id)
+    return page['text'] if page else None
+
+async def build_personal_report_csv(campaign_id: int, batch_size: int=500) -> Optional[str]:
+    campaign = await crud.get_campaign(campaign_id)
+    if not campaign:
+        return None
+    fd, path = tempfile.mkstemp(prefix=f'report_{campaign.id}_', suffix='.csv')
+    os.close(fd)
+    try:
+        with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+            await asyncio.to_thread(f.writelines, iter_csv_lines([PERSONAL_REPORT_CSV_HEADER]))
+            batch = []
+            async for _, recipient_identifier, error_type, error_details, sent_at in crud.iter_failed_history(campaign_id, batch_size=batch_size):
+                batch.append((recipient_identifier, error_type or '', PERSONAL_REPORT_ERRORS.get(error_type, 'неизвестная ошибка'), error_details or '', sent_at.strftime('%Y-%m-%d %H:%M:%S') if sent_at else ''))
+                if len(batch) >= batch_size:
+                    await asyncio.to_thread(f.writelines, iter_csv_lines(batch))
+                    batch = []
+            if batch:
+                await asyncio.to_thread(f.writelines, iter_csv_lines(batch))
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+async def export_sending_history(campaign_id: Optional[int]=None, start_date: Optional[datetime]=None, end_date: Optional[datetime]=None, export_format: str='csv', compress: bool=False, batch_size: int=1000) -> Optional[Tuple[str, int]]:
+    if export_format not in ('csv', 'jsonl'):
+        return None
+    suffix = f'.{export_format}.gz' if compress else f'.{export_format}'
+    fd, path = tempfile.mkstemp(prefix='sending_history_', suffix=suffix)
+    os.close(fd)
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def encode(rows: List[Tuple]) -> bytes:
+        lines = iter_csv_lines(rows) if export_format == 'csv' else iter_jsonl_lines(rows, SENDING_HISTORY_EXPORT_COLUMNS)
+        chunk = ''.join(lines).encode('utf-8')
+        return compressor.compress(chunk) if compressor else chunk
+    exported = 0
+    try:
+        with open(path, 'wb') as f:
+            if export_format == 'csv':
+                await asyncio.to_thread(f.write, encode([SENDING_HISTORY_EXPORT_COLUMNS]))
+            batch = []
+            async for row in crud.iter_sending_history(campaign_id, start_date, end_date, batch_size=batch_size):
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    await asyncio.to_thread(f.write, encode(batch))
+                    exported += len(batch)
+                    batch = []
+            if batch:
+                await asyncio.to_thread(f.write, encode(batch))
+                exported += len(batch)
+            if compressor:
+                await asyncio.to_thread(f.write, compressor.flush())
+    except Exception:
+        os.remove(path)
+        raise
+    return (path, exported)
 
 async def generate_summary_report(date: Optional[datetime]=None) -> str:
     if not date:
@@ -210,27 +460,75 @@ async def generate_summary_report(date: Optional[datetime]=None) -> str:
     report = format_summary_report(campaigns, templates, owners, error_stats, date)
     return report
 
-async def send_summary_reports_to_receivers(bot, date: Optional[datetime]=None):
+class RateLimiter:
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._next_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            delay = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+async def _send_summary_report(bot: Bot, chat_id, text: str, semaphore: asyncio.Semaphore, limiter: RateLimiter, attempts: int=3):
+    async with semaphore:
+        for attempt in range(attempts):
+            await limiter.wait()
+            try:
+                return await bot.send_message(chat_id=chat_id, text=text, parse_mode='Markdown')
+            except TelegramRetryAfter as e:
+                if attempt == attempts - 1:
+                    raise
+                logger.warning(f'Лимит Bot API при отправке сводного отчета {chat_id}, ждем {e.retry_after} секунд')
+                await asyncio.sleep(e.retry_after)
+
+async def send_summary_reports_to_receivers(bot, date: Optional[datetime]=None) -> Dict:
     if not date:
         date = datetime.now()
-    report = await generate_summary_report(date)
     receivers = await crud.get_all_report_receivers()
     if not receivers:
         logger.info('Нет получателей сводных отчетов')
-        return
+        return {'sent': 0, 'failed': 0}
+    report = await generate_summary_report(date)
+    targets = {}
     for receiver in receivers:
+        target = targets.setdefault(receiver.identifier, {'telegram_id': None, 'unresolved': False})
+        if receiver.telegram_id:
+            target['telegram_id'] = receiver.telegram_id
+        else:
+            target['unresolved'] = True
+    semaphore = asyncio.Semaphore(SUMMARY_REPORT_CONCURRENCY)
+    limiter = RateLimiter(SUMMARY_REPORT_MESSAGES_PER_SECOND)
+
+    async def deliver(identifier: str, target: Dict):
+        if target['telegram_id']:
+            chat_id = target['telegram_id']
+        elif identifier.isdigit():
+            chat_id = int(identifier)
+        else:
+            chat_id = f'@{identifier}'
         try:
-            if receiver.telegram_id:
-                await bot.send_message(chat_id=receiver.telegram_id, text=report, parse_mode='Markdown')
-                logger.info(f'Сводный отчет отправлен получателю {receiver.identifier}')
-            elif receiver.identifier_type == 'username':
-                try:
-                    await bot.send_message(chat_id=f'@{receiver.identifier.lstrip('@')}', text=report, parse_mode='Markdown')
-                    logger.info(f'Сводный отчет отправлен получателю {receiver.identifier}')
-                except Exception as e:
-                    logger.warning(f'Не удалось отправить отчет {receiver.identifier}: {e}')
+            message = await _send_summary_report(bot, chat_id, report, semaphore, limiter)
+            logger.info(f'Сводный отчет отправлен получателю {identifier}')
+            return (identifier, message.chat.id if target['unresolved'] else None)
         except Exception as e:
-            logger.error(f'Ошибка при отправке сводного отчета {receiver.identifier}: {e}')
+            logger.warning(f'Не удалось отправить сводный отчет {identifier}: {e}')
+            return None
+    results = await asyncio.gather(*(deliver(identifier, target) for identifier, target in targets.items()))
+    delivered = [result for result in results if result]
+    resolved = {identifier: chat_id for identifier, chat_id in delivered if chat_id}
+    if resolved:
+        try:
+            await crud.update_report_receiver_telegram_ids(resolved)
+        except Exception as e:
+            logger.error(f'Ошибка при сохранении telegram_id получателей отчетов: {e}')
+    logger.info(f'Сводный отчет разослан: {len(delivered)} из {len(targets)} получателей')
+    return {'sent': len(delivered), 'failed': len(targets) - len(delivered)}
 _clients: Dict[int, Client] = {}
 
 async def get_user_client(user_id: int) -> Optional[Client]:
@@ -305,11 +603,32 @@ async def check_account_status(user_id: int) -> Dict:
         logger.error(f'Ошибка при проверке статуса аккаунта для {user_id}: {e}', exc_info=True)
         return {'success': False, 'error_type': 'unknown', 'error_details': f'Ошибка при проверке статуса: {str(e)}'}
 
-async def send_message_as_user(recipient_identifier: str, text: str, sender_user_id: int, media_type: Optional[str]=None, media_file_id: Optional[str]=None) -> dict:
+async def _send_media_as_user(client: Client, chat_id, text: str, media_type: str, media: str):
+    if media_type == 'photo':
+        message = await client.send_photo(chat_id=chat_id, photo=media, caption=text if text else None)
+    elif media_type == 'video':
+        message = await client.send_video(chat_id=chat_id, video=media, caption=text if text else None)
+    elif media_type == 'document':
+        message = await client.send_document(chat_id=chat_id, document=media, caption=text if text else None)
+    elif media_type == 'audio':
+        message = await client.send_audio(chat_id=chat_id, audio=media, caption=text if text else None)
+    elif media_type == 'voice':
+        message = await client.send_voice(chat_id=chat_id, voice=media, caption=text if text else None)
+    elif media_type == 'video_note':
+        message = await client.send_video_note(chat_id=chat_id, video_note=media)
+        if text:
+            await client.send_message(chat_id=chat_id, text=text)
+    elif media_type == 'animation':
+        message = await client.send_animation(chat_id=chat_id, animation=media, caption=text if text else None)
+    else:
+        message = await client.send_document(chat_id=chat_id, document=media, caption=text if text else None)
+    return message
+
+async def send_message_as_user(recipient_identifier: str, text: str, sender_user_id: int, media_type: Optional[str]=None, media_file_id: Optional[str]=None, media_file_unique_id: Optional[str]=None, bot: Optional[Bot]=None) -> dict:
     try:
         client = await get_user_client(sender_user_id)
         if client is None:
-            return {'success': False, 'error_type': 'no_client', 'error_details': 'Client API не настроен. Настройте через /setup_my_client или используйте общие настройки в .env', 'telegram_message_id': None}
+            return {'success': False, 'error_type': 'no_client', 'error_details': None, 'telegram_message_id': None}
         chat_id = None
         if recipient_identifier.isdigit() or (recipient_identifier.startswith('-') and recipient_identifier[1:].isdigit()):
             chat_id = int(recipient_identifier)
@@ -327,10 +646,10 @@ async def send_message_as_user(recipient_identifier: str, text: str, sender_user
                         logger.info(f'Присоединились к приватной группе по invite-ссылке: {chat_id}')
                     except (InviteHashExpired, InviteHashInvalid) as e:
                         logger.warning(f'Недействительная invite-ссылка для {original_identifier}: {e}')
-                        return {'success': False, 'error_type': 'invalid_invite', 'error_details': f'Недействительная или истекшая invite-ссылка: {str(e)}', 'telegram_message_id': None}
+                        return {'success': False, 'error_type': 'invalid_invite', 'error_details': str(e), 'telegram_message_id': None}
                     except Exception as e:
                         logger.warning(f'Не удалось присоединиться к группе по invite-ссылке {original_identifier}: {e}')
-                        return {'success': False, 'error_type': 'join_failed', 'error_details': f'Не удалось присоединиться к группе: {str(e)}', 'telegram_message_id': None}
+                        return {'success': False, 'error_type': 'join_failed', 'error_details': str(e), 'telegram_message_id': None}
                 else:
                     match = re.search('(?:t\\.me/|telegram\\.me/)(?:c/)?([a-zA-Z0-9_]+)', identifier)
                     if match:
@@ -346,7 +665,7 @@ async def send_message_as_user(recipient_identifier: str, text: str, sender_user
                 logger.debug(f'Получен chat_id {chat_id} для {recipient_identifier}')
             except (PeerIdInvalid, UsernameNotOccupied, UsernameInvalid, ChannelPrivate) as e:
                 logger.warning(f'Не удалось получить информацию о чате {chat_id}: {e}')
-                return {'success': False, 'error_type': 'invalid_user', 'error_details': f'Чат не найден или недоступен: {str(e)}', 'telegram_message_id': None}
+                return {'success': False, 'error_type': 'invalid_user', 'error_details': str(e), 'telegram_message_id': None}
             except Exception as e:
                 logger.warning(f'Ошибка при получении информации о чате {chat_id}: {e}')
                 pass
@@ -355,31 +674,25 @@ async def send_message_as_user(recipient_identifier: str, text: str, sender_user
                 chat_member = await client.get_chat_member(chat_id, 'me')
                 if chat_member.status not in ['member', 'administrator', 'creator']:
                     logger.warning(f'Пользователь не является участником группы {chat_id}')
-                    return {'success': False, 'error_type': 'not_participant', 'error_details': 'Вы не являетесь участником этой группы. Присоединитесь к группе перед отправкой сообщений.', 'telegram_message_id': None}
+                    return {'success': False, 'error_type': 'not_participant', 'error_details': None, 'telegram_message_id': None}
             except UserNotParticipant:
                 logger.warning(f'Пользователь не является участником группы {chat_id}')
-                return {'success': False, 'error_type': 'not_participant', 'error_details': 'Вы не являетесь участником этой группы. Присоединитесь к группе перед отправкой сообщений.', 'telegram_message_id': None}
+                return {'success': False, 'error_type': 'not_participant', 'error_details': None, 'telegram_message_id': None}
             except Exception as e:
                 logger.warning(f'Ошибка при проверке участника группы {chat_id}: {e}')
         if media_type and media_file_id:
-            if media_type == 'photo':
-                message = await client.send_photo(chat_id=chat_id, photo=media_file_id, caption=text if text else None)
-            elif media_type == 'video':
-                message = await client.send_video(chat_id=chat_id, video=media_file_id, caption=text if text else None)
-            elif media_type == 'document':
-                message = await client.send_document(chat_id=chat_id, document=media_file_id, caption=text if text else None)
-            elif media_type == 'audio':
-                message = await client.send_audio(chat_id=chat_id, audio=media_file_id, caption=text if text else None)
-            elif media_type == 'voice':
-                message = await client.send_voice(chat_id=chat_id, voice=media_file_id, caption=text if text else None)
-            elif media_type == 'video_note':
-                message = await client.send_video_note(chat_id=chat_id, video_note=media_file_id)
-                if text:
-                    await client.send_message(chat_id=chat_id, text=text)
-            elif media_type == 'animation':
-                message = await client.send_animation(chat_id=chat_id, animation=media_file_id, caption=text if text else None)
-            else:
-                message = await client.send_document(chat_id=chat_id, document=media_file_id, caption=text if text else None)
+            media = media_file_id
+            if bot is not None:
+                media = await get_client_media(client, bot, media_type, media_file_id, media_file_unique_id)
+            try:
+                message = await _send_media_as_user(client, chat_id, text, media_type, media)
+            except (FileReferenceExpired, FileReferenceInvalid):
+                if media == media_file_id:
+                    raise
+                logger.warning(f'Ссылка на медиа {media_file_unique_id} устарела, загружаем заново')
+                invalidate_client_media(client, media_file_unique_id)
+                media = await get_client_media(client, bot, media_type, media_file_id, media_file_unique_id)
+                message = await _send_media_as_user(client, chat_id, text, media_type, media)
         else:
             message = await client.send_message(chat_id=chat_id, text=text)
         logger.info(f'Сообщение отправлено от имени пользователя получателю {recipient_identifier}, message_id: {message.id}')
@@ -388,31 +701,31 @@ async def send_message_as_user(recipient_identifier: str, text: str, sender_user
         wait_time = e.value
         logger.warning(f'FloodWait для {recipient_identifier}: нужно подождать {wait_time} секунд')
         await asyncio.sleep(wait_time)
-        return await send_message_as_user(recipient_identifier, text, sender_user_id, media_type, media_file_id)
+        return await send_message_as_user(recipient_identifier, text, sender_user_id, media_type, media_file_id, media_file_unique_id, bot)
     except (PeerIdInvalid, UsernameNotOccupied, UsernameInvalid) as e:
         logger.warning(f'Неверный получатель {recipient_identifier}: {e}')
-        return {'success': False, 'error_type': 'invalid_user', 'error_details': f'Пользователь не найден: {str(e)}', 'telegram_message_id': None}
+        return {'success': False, 'error_type': 'invalid_user', 'error_details': str(e), 'telegram_message_id': None}
     except ChatWriteForbidden:
         logger.warning(f'Нельзя писать получателю {recipient_identifier}: запрещено')
-        return {'success': False, 'error_type': 'privacy', 'error_details': 'Нельзя отправить сообщение этому пользователю', 'telegram_message_id': None}
+        return {'success': False, 'error_type': 'privacy', 'error_details': None, 'telegram_message_id': None}
     except UserPrivacyRestricted:
         logger.warning(f'Ограничения приватности для {recipient_identifier}')
-        return {'success': False, 'error_type': 'privacy', 'error_details': 'Ограничения приватности пользователя', 'telegram_message_id': None}
+        return {'success': False, 'error_type': 'privacy', 'error_details': None, 'telegram_message_id': None}
     except UserDeactivated:
         logger.warning(f'Аккаунт {recipient_identifier} деактивирован')
-        return {'success': False, 'error_type': 'deleted', 'error_details': 'Аккаунт деактивирован', 'telegram_message_id': None}
+        return {'success': False, 'error_type': 'deleted', 'error_details': None, 'telegram_message_id': None}
     except UserNotParticipant:
         logger.warning(f'Пользователь {recipient_identifier} не является участником группы/канала')
-        return {'success': False, 'error_type': 'not_participant', 'error_details': 'Вы не являетесь участником этой группы/канала. Присоединитесь к группе перед отправкой сообщений.', 'telegram_message_id': None}
+        return {'success': False, 'error_type': 'not_participant', 'error_details': None, 'telegram_message_id': None}
     except ChatAdminRequired:
         logger.warning(f'Требуются права администратора для отправки в {recipient_identifier}')
-        return {'success': False, 'error_type': 'admin_required', 'error_details': 'Требуются права администратора для отправки сообщений в эту группу/канал', 'telegram_message_id': None}
+        return {'success': False, 'error_type': 'admin_required', 'error_details': None, 'telegram_message_id': None}
     except ChannelPrivate:
         logger.warning(f'Приватный канал/группа {recipient_identifier} недоступен')
-        return {'success': False, 'error_type': 'private_chat', 'error_details': 'Это приватная группа/канал. Используйте invite-ссылку для присоединения или убедитесь, что вы являетесь участником.', 'telegram_message_id': None}
+        return {'success': False, 'error_type': 'private_chat', 'error_details': None, 'telegram_message_id': None}
     except PeerFlood as e:
         logger.error(f'⚠️ PEER_FLOOD: Аккаунт ограничен из-за слишком частых отправок для {recipient_identifier}: {e}')
-        return {'success': False, 'error_type': 'peer_flood', 'error_details': 'Аккаунт временно ограничен Telegram из-за слишком частых отправок. Увеличьте интервал между сообщениями (минимум 15-30 секунд) или подождите 1-2 часа перед следующей рассылкой.', 'telegram_message_id': None}
+        return {'success': False, 'error_type': 'peer_flood', 'error_details': None, 'telegram_message_id': None}
     except Exception as e:
         logger.error(f'Неизвестная ошибка при отправке {recipient_identifier}: {e}', exc_info=True)
         return {'success': False, 'error_type': 'unknown', 'error_details': str(e), 'telegram_message_id': None}
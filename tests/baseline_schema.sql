@@ -0,0 +1,106 @@
+CREATE TABLE users (
+	id INTEGER NOT NULL, 
+	telegram_id INTEGER NOT NULL, 
+	username VARCHAR(255), 
+	first_name VARCHAR(255), 
+	last_name VARCHAR(255), 
+	is_active BOOLEAN, 
+	api_id INTEGER, 
+	api_hash VARCHAR(255), 
+	phone_number VARCHAR(50), 
+	has_client_auth BOOLEAN, 
+	created_at DATETIME, 
+	updated_at DATETIME, 
+	PRIMARY KEY (id)
+);
+CREATE UNIQUE INDEX ix_users_telegram_id ON users (telegram_id);
+CREATE TABLE report_receiver_lists (
+	id INTEGER NOT NULL, 
+	name VARCHAR(255) NOT NULL, 
+	is_active BOOLEAN, 
+	created_at DATETIME, 
+	updated_at DATETIME, 
+	PRIMARY KEY (id)
+);
+CREATE TABLE bot_groups (
+	id INTEGER NOT NULL, 
+	chat_id INTEGER NOT NULL, 
+	title VARCHAR(255), 
+	username VARCHAR(255), 
+	chat_type VARCHAR(50) NOT NULL, 
+	is_active BOOLEAN, 
+	members_count INTEGER, 
+	added_at DATETIME, 
+	updated_at DATETIME, 
+	PRIMARY KEY (id)
+);
+CREATE UNIQUE INDEX ix_bot_groups_chat_id ON bot_groups (chat_id);
+CREATE TABLE templates (
+	id INTEGER NOT NULL, 
+	name VARCHAR(255) NOT NULL, 
+	text TEXT NOT NULL, 
+	created_by INTEGER NOT NULL, 
+	created_at DATETIME, 
+	is_active BOOLEAN, 
+	media_type VARCHAR(50), 
+	media_file_id VARCHAR(255), 
+	media_file_unique_id VARCHAR(255), 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(created_by) REFERENCES users (telegram_id)
+);
+CREATE TABLE report_receivers (
+	id INTEGER NOT NULL, 
+	list_id INTEGER NOT NULL, 
+	identifier VARCHAR(255) NOT NULL, 
+	identifier_type VARCHAR(20) NOT NULL, 
+	telegram_id INTEGER, 
+	is_active BOOLEAN, 
+	created_at DATETIME, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(list_id) REFERENCES report_receiver_lists (id)
+);
+CREATE TABLE mailing_campaigns (
+	id INTEGER NOT NULL, 
+	campaign_id VARCHAR(50) NOT NULL, 
+	owner_id INTEGER NOT NULL, 
+	template_id INTEGER NOT NULL, 
+	status VARCHAR(50), 
+	started_at DATETIME, 
+	completed_at DATETIME, 
+	total_recipients INTEGER, 
+	sent_successfully INTEGER, 
+	sent_failed INTEGER, 
+	duplicates_count INTEGER, 
+	delay_seconds INTEGER, 
+	max_recipients INTEGER, 
+	created_at DATETIME, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(owner_id) REFERENCES users (telegram_id), 
+	FOREIGN KEY(template_id) REFERENCES templates (id)
+);
+CREATE UNIQUE INDEX ix_mailing_campaigns_campaign_id ON mailing_campaigns (campaign_id);
+CREATE TABLE recipients (
+	id INTEGER NOT NULL, 
+	campaign_id INTEGER NOT NULL, 
+	recipient_identifier VARCHAR(255) NOT NULL, 
+	normalized_identifier VARCHAR(255) NOT NULL, 
+	is_duplicate BOOLEAN, 
+	previous_campaign_id INTEGER, 
+	created_at DATETIME, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(campaign_id) REFERENCES mailing_campaigns (id)
+);
+CREATE INDEX idx_template_recipient ON recipients (normalized_identifier);
+CREATE INDEX ix_recipients_normalized_identifier ON recipients (normalized_identifier);
+CREATE TABLE sending_history (
+	id INTEGER NOT NULL, 
+	campaign_id INTEGER NOT NULL, 
+	recipient_identifier VARCHAR(255) NOT NULL, 
+	success BOOLEAN NOT NULL, 
+	error_type VARCHAR(100), 
+	error_details TEXT, 
+	telegram_message_id INTEGER, 
+	sent_at DATETIME, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(campaign_id) REFERENCES mailing_campaigns (id)
+);
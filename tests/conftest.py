@@ -0,0 +1,47 @@
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+WORK_DIR = Path(tempfile.mkdtemp(prefix='mailing-bot-tests-'))
+DB_PATH = WORK_DIR / 'bot.db'
+os.environ['DATABASE_URL'] = f'sqlite+aiosqlite:///{DB_PATH}'
+os.environ['DATABASE_READ_URL'] = ''
+os.environ.setdefault('BOT_TOKEN', '1:test')
+os.chdir(WORK_DIR)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import sqlite3
+import pytest
+import database as crud
+BASELINE_SCHEMA = Path(__file__).resolve().parent / 'baseline_schema.sql'
+
+def _run(coro):
+
+    async def main():
+        try:
+            return await coro
+        finally:
+            await crud.close_db()
+    return asyncio.run(main())
+
+@pytest.fixture
+def run():
+    return _run
+
+@pytest.fixture
+def db_path():
+    for suffix in ('', '-wal', '-shm'):
+        Path(f'{DB_PATH}{suffix}').unlink(missing_ok=True)
+    crud._error_types.clear()
+    return DB_PATH
+
+@pytest.fixture
+def baseline_db(db_path):
+    with sqlite3.connect(db_path) as conn:
+        conn.executescript(BASELINE_SCHEMA.read_text())
+    return db_path
+
+@pytest.fixture
+def fresh_db(db_path):
+    _run(crud.init_db())
+    return db_path
@@ -0,0 +1,88 @@
+import sqlite3
+from migrations import run_all_migrations
+import database as crud
+from database import Base, ERROR_MESSAGES
+BASELINE_ROWS = {'users': [(1, 100, 'owner', 1)], 'templates': [(1, 'Акция', 'Привет', 100, 1)], 'report_receiver_lists': [(1, 'Основной список', 1)], 'report_receivers': [(1, 1, '@boss', 'username', None, 1), (2, 1, '200', 'user_id', 200, 1)], 'mailing_campaigns': [(1, 'c-1', 100, 1, 'completed', 5), (2, 'c-2', 100, 1, 'completed', 5)], 'recipients': [(1, 1, '@Alice', 'alice', 0), (2, 1, '123', '123', 0), (3, 2, 'alice', 'alice', 1)], 'sending_history': [(1, 1, '@Alice', 1, None, None, 11, '2026-01-01 10:00:00'), (2, 1, '123', 0, 'privacy', 'Ограничения приватности пользователя', None, '2026-01-01 10:01:00'), (3, 2, 'alice', 0, 'duplicate', 'Пропущен дубль (уже отправлялось в c-1)', None, '2026-01-02 10:00:00')], 'bot_groups': [(1, -100500, 'Группа', None, 'supergroup', 1)]}
+BASELINE_COLUMNS = {'users': 'id, telegram_id, username, is_active', 'templates': 'id, name, text, created_by, is_active', 'report_receiver_lists': 'id, name, is_active', 'report_receivers': 'id, list_id, identifier, identifier_type, telegram_id, is_active', 'mailing_campaigns': 'id, campaign_id, owner_id, template_id, status, delay_seconds', 'recipients': 'id, campaign_id, recipient_identifier, normalized_identifier, is_duplicate', 'sending_history': 'id, campaign_id, recipient_identifier, success, error_type, error_details, telegram_message_id, sent_at', 'bot_groups': 'id, chat_id, title, username, chat_type, is_active'}
+
+def _fill(db_path, rows=BASELINE_ROWS):
+    with sqlite3.connect(db_path) as conn:
+        for table_name, values in rows.items():
+            columns = BASELINE_COLUMNS[table_name]
+            conn.executemany(f"INSERT INTO {table_name} ({columns}) VALUES ({', '.join('?' * len(columns.split(', ')))})", values)
+
+def _schema(db_path):
+    with sqlite3.connect(db_path) as conn:
+        tables = [name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")]
+        return {name: {'count': conn.execute(f'SELECT COUNT(*) FROM {name}').fetchone()[0], 'columns': {row[1]: not row[3] for row in conn.execute(f'PRAGMA table_info({name})')}, 'indexes': {row[1]: bool(row[2]) for row in conn.execute(f'PRAGMA index_list({name})') if not row[1].startswith('sqlite_autoindex')}} for name in tables}
+
+def _assert_nullability_matches_models(schema):
+    for table in Base.metadata.sorted_tables:
+        if table.name not in schema:
+            continue
+        for column in table.columns:
+            if not column.primary_key:
+                assert schema[table.name]['columns'][column.name] == column.nullable, f'{table.name}.{column.name}'
+
+def test_baseline_database_migrates_and_keeps_rows(baseline_db, run):
+    _fill(baseline_db)
+    assert run(run_all_migrations())
+    schema = _schema(baseline_db)
+    for table_name, values in BASELINE_ROWS.items():
+        assert schema[table_name]['count'] == len(values), table_name
+    assert set(schema['sending_history']['columns']) == set(Base.metadata.tables['sending_history'].columns.keys())
+    _assert_nullability_matches_models(schema)
+    for table_name in ('mailing_campaigns', 'recipients', 'sending_history', 'report_receivers'):
+        assert {index.name for index in Base.metadata.tables[table_name].indexes} <= set(schema[table_name]['indexes']), table_name
+    assert 'ix_recipients_normalized_identifier' not in schema['recipients']['indexes']
+    assert schema['users']['indexes'] == {'ix_users_telegram_id': True}
+    assert schema['report_receivers']['indexes']['uq_report_receivers_list_identifier'] is True
+    with sqlite3.connect(baseline_db) as conn:
+        assert conn.execute('SELECT recipient_id, success FROM sending_history ORDER BY id').fetchall() == [(1, 1), (2, 0), (3, 0)]
+        assert conn.execute('SELECT template_id, normalized_identifier, campaign_id FROM delivery_ledger').fetchall() == [(1, 'alice', 1)]
+
+def test_migrations_are_idempotent(baseline_db, run):
+    _fill(baseline_db)
+    assert run(run_all_migrations())
+    with sqlite3.connect(baseline_db) as conn:
+        first = sorted(conn.execute('SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL').fetchall())
+    first_schema = _schema(baseline_db)
+    assert run(run_all_migrations())
+    with sqlite3.connect(baseline_db) as conn:
+        assert sorted(conn.execute('SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL').fetchall()) == first
+    assert _schema(baseline_db) == first_schema
+
+def test_receivers_without_lists_get_required_list_and_keep_indexes(baseline_db, run):
+    with sqlite3.connect(baseline_db) as conn:
+        conn.executescript('DROP TABLE report_receivers; DROP TABLE report_receiver_lists; CREATE TABLE report_receivers (id INTEGER NOT NULL, identifier VARCHAR(255) NOT NULL, identifier_type VARCHAR(20) NOT NULL, telegram_id INTEGER, is_active BOOLEAN, created_at DATETIME, PRIMARY KEY (id)); CREATE INDEX ix_report_receivers_telegram_id ON report_receivers (telegram_id);')
+        conn.executemany('INSERT INTO report_receivers (id, identifier, identifier_type, telegram_id, is_active) VALUES (?, ?, ?, ?, ?)', [(1, '@boss', 'username', None, 1), (2, '200', 'user_id', 200, 1)])
+    assert run(run_all_migrations())
+    schema = _schema(baseline_db)
+    assert schema['report_receivers']['count'] == 2
+    assert schema['report_receivers']['columns']['list_id'] is False
+    assert 'ix_report_receivers_telegram_id' in schema['report_receivers']['indexes']
+    assert schema['report_receivers']['indexes']['uq_report_receivers_list_identifier'] is True
+    with sqlite3.connect(baseline_db) as conn:
+        default_list_id, = conn.execute("SELECT id FROM report_receiver_lists WHERE name = 'Основной список'").fetchone()
+        assert conn.execute('SELECT id, list_id, identifier FROM report_receivers ORDER BY id').fetchall() == [(1, default_list_id, '@boss'), (2, default_list_id, '200')]
+    assert run(run_all_migrations())
+    assert _schema(baseline_db) == schema
+
+def test_legacy_error_texts_keep_only_the_variable_detail(baseline_db, run):
+    _fill(baseline_db)
+    legacy = [(4, 1, '123', 0, 'invalid_user', 'Пользователь не найден: [400 USERNAME_NOT_OCCUPIED]', None, '2026-01-01 10:02:00'), (5, 1, '123', 0, 'technical', 'Техническая ошибка: boom 42', None, '2026-01-01 10:03:00'), (6, 1, '123', 0, 'peer_flood', 'Аккаунт временно ограничен Telegram из-за слишком частых отправок. Увеличьте интервал между сообщениями (минимум 15-30 секунд) или подождите 1-2 часа перед следующей рассылкой.', None, '2026-01-01 10:04:00'), (7, 1, '123', 0, 'unknown', 'Connection reset', None, '2026-01-01 10:05:00')]
+    _fill(baseline_db, {'sending_history': legacy})
+    assert run(run_all_migrations())
+    with sqlite3.connect(baseline_db) as conn:
+        assert conn.execute('SELECT id, error_details FROM sending_history WHERE id > 1 ORDER BY id').fetchall() == [(2, None), (3, 'Пропущен дубль (уже отправлялось в c-1)'), (4, '[400 USERNAME_NOT_OCCUPIED]'), (5, 'boom 42'), (6, None), (7, 'Connection reset')]
+
+    async def history():
+        await crud.init_db()
+        return {row.id: row.error_details for campaign_id in (1, 2) for row in await crud.get_campaign_sending_history(campaign_id)}
+    details = run(history())
+    assert details[2] == ERROR_MESSAGES['privacy']
+    assert details[3] == 'Пропущен дубль (уже отправлялось в c-1)'
+    assert details[4] == f"{ERROR_MESSAGES['invalid_user']}: [400 USERNAME_NOT_OCCUPIED]"
+    assert details[5] == 'техническая ошибка: boom 42'
+    assert details[6] == ERROR_MESSAGES['peer_flood']
+    assert details[7] == f"{ERROR_MESSAGES['unknown']}: Connection reset"
@@ -0,0 +1,55 @@
+import os
+import pytest
+import database as crud
+from metrics import assert_max_queries
+from services import build_personal_report_csv, render_personal_report_page, report_cache
+SIZES = (3, 30)
+
+async def _seed(size: int):
+    await crud.get_or_create_user(1, username='owner')
+    template = await crud.create_template('budgets', 'text', 1)
+    campaign = await crud.create_campaign(1, template.id)
+    await crud.add_recipients(campaign.id, [{'original': f'@user{index}', 'normalized': f'user{index}'} for index in range(size)])
+    for recipient in (await crud.load_campaign_plan(campaign.id)).recipients:
+        await crud.add_sending_history(campaign.id, recipient.id, False, error_type='invalid_user', error_details='[400 USERNAME_NOT_OCCUPIED]')
+    receiver_list = await crud.create_report_receiver_list('budgets')
+    await crud.add_report_receivers_to_list(receiver_list.id, [f'@receiver{index}' for index in range(size)])
+    report_cache.clear()
+    return (campaign.id, receiver_list.id)
+
+@pytest.mark.parametrize('size', SIZES)
+def test_personal_report_page_query_budget(fresh_db, run, size):
+
+    async def scenario():
+        campaign_id, _ = await _seed(size)
+        with assert_max_queries(5, 'отчёт по рассылке'):
+            page = await render_personal_report_page(campaign_id)
+        assert page['text'].count('@user') == size
+    run(scenario())
+
+@pytest.mark.parametrize('size', SIZES)
+def test_personal_report_csv_query_budget(fresh_db, run, size):
+
+    async def scenario():
+        campaign_id, _ = await _seed(size)
+        with assert_max_queries(2, 'CSV-отчёт'):
+            path = await build_personal_report_csv(campaign_id)
+        with open(path, encoding='utf-8-sig') as f:
+            assert len(f.readlines()) == size + 1
+        os.remove(path)
+    run(scenario())
+
+@pytest.mark.parametrize('size', SIZES)
+def test_receiver_list_query_budget(fresh_db, run, size):
+
+    async def scenario():
+        _, list_id = await _seed(size)
+        with assert_max_queries(1, 'списки получателей'):
+            summaries = await crud.get_report_receiver_list_summaries()
+        assert [(list_id, size)] == [(row[0], row[2]) for row in summaries]
+        with assert_max_queries(2, 'страница получателей'):
+            receivers, total = await crud.get_receivers_page(list_id, limit=20)
+        assert (len(receivers), total) == (min(size, 20), size)
+        with assert_max_queries(2, 'страница получателей'):
+            await crud.get_receivers_page(list_id, offset=20, limit=20)
+    run(scenario())
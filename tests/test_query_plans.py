@@ -0,0 +1,79 @@
+import inspect
+from datetime import datetime, timedelta
+from typing import NamedTuple
+import pytest
+from sqlalchemy import event
+import database as crud
+from database import Base, ENGINES, engine
+FULL_SCAN_ALLOWED = {'get_all_active_templates': {'templates'}, 'get_all_report_receiver_lists': {'report_receiver_lists'}, 'get_report_receiver_list_summaries': {'report_receiver_lists'}, 'get_all_report_receivers': {'report_receivers'}, 'get_all_bot_groups': {'bot_groups'}, 'iter_sending_history': {'sending_history'}, 'seed_error_types': {'error_types'}}
+EXPECTED_INDEXES = {'claim_campaign': 'ix_mailing_campaigns_status_lease', 'get_user_campaigns': 'ix_mailing_campaigns_owner_created', 'get_daily_campaigns': 'ix_mailing_campaigns_created_at', 'get_error_statistics': 'ix_mailing_campaigns_created_at', 'load_campaign_plan': 'ix_recipients_campaign_duplicate', 'get_campaign_duplicates': 'ix_recipients_campaign_duplicate', 'check_duplicate': 'uq_delivery_ledger_template_identifier', 'record_delivery': 'uq_delivery_ledger_template_identifier', 'claim_delivery:taken': 'uq_delivery_ledger_template_identifier', 'get_campaign_progress': 'ix_sending_history_campaign_sent', 'get_campaign_sending_history': 'ix_sending_history_campaign_sent', 'iter_failed_history': 'ix_sending_history_campaign_sent', 'iter_sending_history:campaign': 'ix_sending_history_campaign_sent', 'iter_sending_history:period': 'ix_sending_history_sent_at', 'get_archivable_sending_history': 'ix_sending_history_sent_at', 'get_archivable_recipients': 'ix_sending_history_recipient', 'get_receivers_page': 'uq_report_receivers_list_identifier', 'get_bot_group': 'ix_bot_groups_chat_id', 'upsert_bot_groups': 'ix_bot_groups_chat_id'}
+NOT_QUERIES = {'init_db', 'close_db'}
+
+class Seed(NamedTuple):
+    template_id: int
+    campaign_id: int
+    campaign_uid: str
+    recipient_id: int
+    list_id: int
+    receiver_id: int
+    now: datetime
+
+async def _drain(iterator):
+    async for _ in iterator:
+        pass
+
+async def _claim_twice(seed: Seed):
+    await crud.claim_delivery(seed.template_id, 'claimed', seed.campaign_id)
+    await crud.claim_delivery(seed.template_id, 'claimed', seed.campaign_id)
+
+async def _seed() -> Seed:
+    await crud.get_or_create_user(1, username='owner')
+    template = await crud.create_template('plans', 'text', 1)
+    campaign = await crud.create_campaign(1, template.id)
+    await crud.add_recipients(campaign.id, [{'original': '@user', 'normalized': 'user'}])
+    recipients = (await crud.load_campaign_plan(campaign.id)).recipients
+    await crud.add_sending_history(campaign.id, recipients[0].id, True)
+    await crud.add_sending_history(campaign.id, recipients[0].id, False, error_type='invalid_user', error_details='Пользователь не найден')
+    receiver_list = await crud.create_report_receiver_list('plans')
+    await crud.add_report_receivers_to_list(receiver_list.id, ['@receiver'])
+    receivers, _ = await crud.get_receivers_page(receiver_list.id)
+    await crud.add_or_update_bot_group(-100, title='plans')
+    return Seed(template.id, campaign.id, campaign.campaign_id, recipients[0].id, receiver_list.id, receivers[0].id, datetime.now())
+CASES = [('get_or_create_user', lambda seed: crud.get_or_create_user(1)), ('update_user_client_auth', lambda seed: crud.update_user_client_auth(1, has_auth=False)), ('get_user_by_telegram_id', lambda seed: crud.get_user_by_telegram_id(1)), ('create_template', lambda seed: crud.create_template('extra', 'text', 1)), ('get_template', lambda seed: crud.get_template(seed.template_id)), ('get_all_active_templates', lambda seed: crud.get_all_active_templates()), ('update_template', lambda seed: crud.update_template(seed.template_id, name='plans')), ('create_campaign', lambda seed: crud.create_campaign(1, seed.template_id)), ('get_campaign', lambda seed: crud.get_campaign(seed.campaign_id)), ('get_campaign_by_campaign_id', lambda seed: crud.get_campaign_by_campaign_id(seed.campaign_uid)), ('get_user_campaigns', lambda seed: crud.get_user_campaigns(1)), ('update_campaign_status', lambda seed: crud.update_campaign_status(seed.campaign_id, 'pending')), ('update_campaign_stats', lambda seed: crud.update_campaign_stats(seed.campaign_id, 2, 1, 1, 0)), ('queue_campaign', lambda seed: crud.queue_campaign(seed.campaign_id)), ('claim_campaign', lambda seed: crud.claim_campaign('plans', 60)), ('renew_campaign_lease', lambda seed: crud.renew_campaign_lease(seed.campaign_id, 'plans', 60)), ('release_campaign_lease', lambda seed: crud.release_campaign_lease(seed.campaign_id, 'plans')), ('release_campaign_lease:failed', lambda seed: crud.release_campaign_lease(seed.campaign_id, 'plans', status='failed')), ('get_campaign_progress', lambda seed: crud.get_campaign_progress(seed.campaign_id)), ('acquire_job_lease', lambda seed: crud.acquire_job_lease('plans', 'plans', 60)), ('release_job_lease', lambda seed: crud.release_job_lease('plans', 'plans')), ('add_recipients', lambda seed: crud.add_recipients(seed.campaign_id, [{'original': '@extra', 'normalized': 'extra'}])), ('load_campaign_plan', lambda seed: crud.load_campaign_plan(seed.campaign_id)), ('check_duplicate', lambda seed: crud.check_duplicate(seed.template_id, 'user')), ('record_delivery', lambda seed: crud.record_delivery(seed.template_id, 'user', seed.campaign_id)), ('claim_delivery', lambda seed: crud.claim_delivery(seed.template_id, 'claimed', seed.campaign_id)), ('claim_delivery:taken', lambda seed: _claim_twice(seed)), ('release_delivery', lambda seed: crud.release_delivery(seed.template_id, 'claimed', seed.campaign_id)), ('mark_recipient_as_duplicate', lambda seed: crud.mark_recipient_as_duplicate(seed.recipient_id, seed.campaign_id)), ('seed_error_types', lambda seed: crud.seed_error_types()), ('add_sending_history', lambda seed: crud.add_sending_history(seed.campaign_id, seed.recipient_id, False, error_type='invalid_user', error_details='Пользователь не найден')), ('get_campaign_sending_history', lambda seed: crud.get_campaign_sending_history(seed.campaign_id)), ('iter_failed_history', lambda seed: _drain(crud.iter_failed_history(seed.campaign_id))), ('iter_sending_history:campaign', lambda seed: _drain(crud.iter_sending_history(campaign_id=seed.campaign_id))), ('iter_sending_history:period', lambda seed: _drain(crud.iter_sending_history(start_date=seed.now - timedelta(days=1), end_date=seed.now + timedelta(days=1)))), ('iter_sending_history', lambda seed: _drain(crud.iter_sending_history())), ('get_archivable_sending_history', lambda seed: crud.get_archivable_sending_history(seed.now, 100)), ('get_archivable_recipients', lambda seed: crud.get_archivable_recipients(seed.now, 100)), ('delete_sending_history_rows', lambda seed: crud.delete_sending_history_rows([0])), ('delete_recipient_rows', lambda seed: crud.delete_recipient_rows([0])), ('get_campaign_duplicates', lambda seed: crud.get_campaign_duplicates(seed.campaign_id)), ('create_report_receiver_list', lambda seed: crud.create_report_receiver_list('extra')), ('get_all_report_receiver_lists', lambda seed: crud.get_all_report_receiver_lists()), ('get_report_receiver_list', lambda seed: crud.get_report_receiver_list(seed.list_id)), ('update_report_receiver_list', lambda seed: crud.update_report_receiver_list(seed.list_id, name='plans')), ('get_report_receiver_list_summaries', lambda seed: crud.get_report_receiver_list_summaries()), ('get_receivers_page', lambda seed: crud.get_receivers_page(seed.list_id)), ('get_receivers_page:next', lambda seed: crud.get_receivers_page(seed.list_id, offset=20)), ('add_report_receivers_to_list', lambda seed: crud.add_report_receivers_to_list(seed.list_id, ['@extra'])), ('get_all_report_receivers', lambda seed: crud.get_all_report_receivers()), ('update_report_receiver_telegram_id', lambda seed: crud.update_report_receiver_telegram_id('@receiver', 42)), ('update_report_receiver_telegram_ids', lambda seed: crud.update_report_receiver_telegram_ids({'@receiver': 42})), ('get_daily_campaigns', lambda seed: crud.get_daily_campaigns(seed.now)), ('get_error_statistics', lambda seed: crud.get_error_statistics(seed.now - timedelta(days=1), seed.now + timedelta(days=1))), ('add_or_update_bot_group', lambda seed: crud.add_or_update_bot_group(-100, title='plans')), ('upsert_bot_groups', lambda seed: crud.upsert_bot_groups([{'chat_id': -100, 'title': 'plans', 'chat_type': 'group', 'is_active': True}, {'chat_id': -101, 'chat_type': 'channel', 'is_active': False}, {'chat_id': -102, 'members_count': 5}])), ('get_bot_group', lambda seed: crud.get_bot_group(-100)), ('get_all_bot_groups', lambda seed: crud.get_all_bot_groups()), ('update_bot_group_members_count', lambda seed: crud.update_bot_group_members_count(-100, 3)), ('delete_report_receiver', lambda seed: crud.delete_report_receiver(seed.receiver_id)), ('delete_report_receiver_list', lambda seed: crud.delete_report_receiver_list(seed.list_id)), ('remove_bot_group', lambda seed: crud.remove_bot_group(-100)), ('delete_template', lambda seed: crud.delete_template(seed.template_id))]
+
+@pytest.fixture
+def statements():
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+            captured.append((statement, parameters[0] if executemany else parameters))
+    for db_engine in ENGINES:
+        event.listen(db_engine.sync_engine, 'before_cursor_execute', capture)
+    yield captured
+    for db_engine in ENGINES:
+        event.remove(db_engine.sync_engine, 'before_cursor_execute', capture)
+
+async def _plan(statement: str, parameters) -> list:
+    async with engine.connect() as conn:
+        result = await conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters)
+        return [row[3] for row in result.all()]
+
+def test_every_query_has_a_plan_case():
+    queries = {name for name, func in vars(crud).items() if getattr(func, '__module__', None) == 'database' and (inspect.iscoroutinefunction(func) or inspect.isasyncgenfunction(func)) and (not name.startswith('_'))}
+    assert queries - NOT_QUERIES - {name.split(':')[0] for name, _ in CASES} == set()
+
+@pytest.mark.parametrize('name, call', CASES, ids=[name for name, _ in CASES])
+def test_query_uses_indexes(name, call, fresh_db, run, statements):
+
+    async def explain():
+        seed = await _seed()
+        statements.clear()
+        await call(seed)
+        return [(' '.join(statement.split()), await _plan(statement, parameters)) for statement, parameters in list(statements)]
+    plans = run(explain())
+    allowed = FULL_SCAN_ALLOWED.get(name.split(':')[0], set())
+    scans = [(table, statement) for statement, details in plans for detail in details if detail.startswith('SCAN ') and (table := detail.split()[1]) in Base.metadata.tables and table not in allowed]
+    assert scans == []
+    if name in EXPECTED_INDEXES:
+        assert any((EXPECTED_INDEXES[name] in detail for _, details in plans for detail in details)), plans
@@ -1,10 +1,15 @@
+import csv
+import io
+import json
 import logging
 import sys
 import re
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Iterable, Iterator, List, Dict, Optional
 from config import LOG_FILE, LOG_LEVEL
-from database import MailingCampaign, SendingHistory, Template, User
+from database import MailingCampaign, SendingHistory, Template, User, ERROR_MESSAGES
+
+TELEGRAM_MESSAGE_LIMIT = 4096
 
 def setup_logger():
     logger = logging.getLogger('mailing_bot')
@@ -105,7 +110,74 @@ def validate_username(username: str) -> tuple[bool, Optional[str]]:
         return (False, None)
     return (True, username)
 
-def format_personal_report(campaign: MailingCampaign, template: Template, owner: User, history: List[SendingHistory], duplicates: List[str]) -> str:
+PERSONAL_REPORT_ERRORS = ERROR_MESSAGES
+PERSONAL_REPORT_CSV_HEADER = ('recipient', 'error_type', 'error', 'details', 'sent_at')
+SENDING_HISTORY_EXPORT_COLUMNS = ('id', 'campaign_id', 'recipient', 'success', 'error_type', 'error_details', 'telegram_message_id', 'sent_at')
+
+def escape_markdown(value: str) -> str:
+    return value.replace('_', '\\_').replace('*', '\\*').replace('[', '\\[').replace(']', '\\]')
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f'{hours} ч {minutes} мин'
+    if minutes:
+        return f'{minutes} мин {seconds} сек'
+    return f'{seconds} сек'
+
+def format_campaign_progress(campaign_id: str, total: int, sent: int, failed: int, duplicates: int, eta_seconds: Optional[float], status: str='processing') -> str:
+    processed = sent + failed + duplicates
+    title = {'processing': '🔄 РАССЫЛКА ИДЕТ', 'completed': '✅ РАССЫЛКА ЗАВЕРШЕНА', 'failed': '⛔ РАССЫЛКА ПРЕРВАНА'}.get(status, '🔄 РАССЫЛКА ИДЕТ')
+    text = f'{title}\n\nКампания: {campaign_id}\nОбработано: {processed} из {total}\n✅ Отправлено: {sent}\n❌ Ошибок: {failed}\n🔁 Дублей: {duplicates}'
+    if status == 'processing' and eta_seconds is not None:
+        text += f'\n⏱ Осталось примерно: {format_duration(eta_seconds)}'
+    return text
+
+def format_slow_handlers(rows: List, started_at: datetime, loop_lag: Optional[tuple]=None, loop_stalls: int=0) -> str:
+    text = f'🐢 МЕДЛЕННЫЕ ОБРАБОТЧИКИ\nс {started_at:%d.%m.%Y %H:%M}, задержки в мс (p50 / p95 / p99 / max)\n'
+    if loop_lag:
+        text += f'\n⏳ Задержка event loop: {' / '.join((f'{value * 1000:.0f}' for value in loop_lag))}\n   блокировок: {loop_stalls}\n'
+    if not rows:
+        return text + '\nДанных по обработчикам пока нет.'
+    for i, (name, stats, (p50, p95, p99)) in enumerate(rows, 1):
+        text += f'\n{i}. {name}\n   {p50 * 1000:.0f} / {p95 * 1000:.0f} / {p99 * 1000:.0f} / {stats.max_seconds * 1000:.0f}\n   вызовов: {stats.count}, ошибок: {stats.errors}, медленных: {stats.slow}\n   SQL-запросов на обновление: {stats.queries / stats.count:.1f} (макс. {stats.max_queries}), время БД: {stats.db_seconds * 1000 / stats.count:.0f} мс\n'
+    return text
+
+def format_bytes(size: float) -> str:
+    for unit in ('Б', 'КБ', 'МБ'):
+        if abs(size) < 1024:
+            return f'{size:.0f} {unit}' if unit == 'Б' else f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} ГБ'
+
+def format_memory_status(tracing: bool, started_at: Optional[datetime], traced: Optional[tuple], containers: Dict[str, int]) -> str:
+    if tracing:
+        text = f'🧠 ПАМЯТЬ\ntracemalloc включен с {started_at:%d.%m.%Y %H:%M}\nсейчас: {format_bytes(traced[0])}, пик: {format_bytes(traced[1])}\n'
+    else:
+        text = '🧠 ПАМЯТЬ\ntracemalloc выключен\n'
+    text += '\n' + '\n'.join((f'{name}: {size}' for name, size in containers.items()))
+    return text
+
+def format_memory_top(stats: List, title: str) -> str:
+    text = f'🧠 {title}\n'
+    if not stats:
+        return text + '\nНет данных.'
+    for i, stat in enumerate(stats, 1):
+        frame = stat.traceback[0]
+        if hasattr(stat, 'size_diff'):
+            text += f'\n{i}. {frame.filename}:{frame.lineno}\n   {'+' if stat.size_diff >= 0 else ''}{format_bytes(stat.size_diff)} ({stat.count_diff:+} блоков), всего {format_bytes(stat.size)}\n'
+        else:
+            text += f'\n{i}. {frame.filename}:{frame.lineno}\n   {format_bytes(stat.size)} ({stat.count} блоков)\n'
+    return text
+
+def format_object_counts(tracked: List, top: List, total: int) -> str:
+    text = f'🧠 ОБЪЕКТЫ В ПАМЯТИ\nвсего отслеживается gc: {total}\n\nМодели ORM и клиенты Pyrogram:\n'
+    text += '\n'.join((f'   {name}: {count}' for name, count in tracked)) if tracked else '   нет'
+    text += '\n\nСамые частые типы:\n' + '\n'.join((f'   {name}: {count}' for name, count in top))
+    return text
+
+def format_personal_report_header(campaign: MailingCampaign, template: Template, owner: User) -> str:
     if campaign.started_at and campaign.completed_at:
         start_time = campaign.started_at.strftime('%H:%M')
         end_time = campaign.completed_at.strftime('%H:%M')
@@ -115,38 +187,56 @@ def format_personal_report(campaign: MailingCampaign, template: Template, owner:
         time_range = campaign.started_at.strftime('%H:%M (%d.%m.%Y)')
     else:
         time_range = 'Не начата'
-    total = campaign.total_recipients
-    sent = campaign.sent_successfully
-    failed = campaign.sent_failed
-    dup_count = campaign.duplicates_count
-    error_messages = {'blocked': 'пользователь заблокировал бота', 'invalid_user': 'пользователь не найден или не начинал диалог с ботом', 'deleted': 'аккаунт удален', 'privacy': 'ограничения приватности', 'rate_limit': 'превышен лимит сообщений', 'technical': 'техническая ошибка', 'unknown': 'неизвестная ошибка'}
-    failed_recipients = []
-    for h in history:
-        if not h.success:
-            error_msg = error_messages.get(h.error_type, 'неизвестная ошибка')
-            failed_recipients.append(f'• {h.recipient_identifier} - {error_msg}')
-    owner_username = (owner.username or 'не указан').replace('_', '\\_').replace('*', '\\*').replace('[', '\\[').replace(']', '\\]')
-    template_name = template.name.replace('_', '\\_').replace('*', '\\*').replace('[', '\\[').replace(']', '\\]')
-    report = f"""📊 ВАШ ОТЧЕТ #{campaign.id}
+    owner_username = escape_markdown(owner.username or 'не указан')
+    template_name = escape_markdown(template.name)
+    return f"""📊 ВАШ ОТЧЕТ #{campaign.id}
 
 Владелец: @{owner_username}
 Шаблон: "{template_name}" (#{template.id})
 Время рассылки: {time_range}
 
 СТАТИСТИКА:
-✅ Отправлено успешно: {sent} из {total}
-❌ Не удалось отправить: {failed}
-🔄 Дубли (пропущены): {dup_count}"""
-    if failed_recipients:
-        report += f'\n\nНЕОТПРАВЛЕННЫЕ:\n' + '\n'.join(failed_recipients)
+✅ Отправлено успешно: {campaign.sent_successfully} из {campaign.total_recipients}
+❌ Не удалось отправить: {campaign.sent_failed}
+🔄 Дубли (пропущены): {campaign.duplicates_count}"""
+
+def format_personal_report_footer(campaign: MailingCampaign, duplicates: List[str], duplicates_total: Optional[int]=None) -> str:
+    footer = ''
     if duplicates:
+        total = duplicates_total if duplicates_total is not None else len(duplicates)
         dup_list = ', '.join(duplicates[:10])
-        if len(duplicates) > 10:
-            dup_list += f', ... и еще {len(duplicates) - 10}'
-        report += f'\n\nДУБЛИ (не отправлялись повторно):\n• {dup_list}'
-    report += f'\n\nИДЕНТИФИКАТОР РАССЫЛКИ: {campaign.campaign_id}'
+        if total > 10:
+            dup_list += f', ... и еще {total - 10}'
+        footer += f'\n\nДУБЛИ (не отправлялись повторно):\n• {dup_list}'
+    footer += f'\n\nИДЕНТИФИКАТОР РАССЫЛКИ: {campaign.campaign_id}'
+    return footer
+
+def format_failed_recipient(recipient_identifier: str, error_type: Optional[str]) -> str:
+    return f'• {recipient_identifier} - {PERSONAL_REPORT_ERRORS.get(error_type, 'неизвестная ошибка')}'
+
+def format_personal_report(campaign: MailingCampaign, template: Template, owner: User, history: List[SendingHistory], duplicates: List[str]) -> str:
+    report = format_personal_report_header(campaign, template, owner)
+    failed_recipients = [format_failed_recipient(h.recipient_identifier, h.error_type) for h in history if not h.success]
+    if failed_recipients:
+        report += f'\n\nНЕОТПРАВЛЕННЫЕ:\n' + '\n'.join(failed_recipients)
+    report += format_personal_report_footer(campaign, duplicates)
     return report
 
+def iter_csv_lines(rows: Iterable[Iterable]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+
+def iter_jsonl_lines(rows: Iterable[Iterable], columns: Iterable[str]) -> Iterator[str]:
+    columns = tuple(columns)
+    for row in rows:
+        record = {column: value.isoformat() if isinstance(value, datetime) else value for column, value in zip(columns, row)}
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
 def format_summary_report(campaigns: List[MailingCampaign], templates: Dict[int, Template], owners: Dict[int, User], error_stats: Dict[str, int], date: datetime) -> str:
     date_str = date.strftime('%d.%m.%Y')
     report = f'📈 СВОДНЫЙ ОТЧЕТ ПО РАССЫЛКАМ\n\nПериод: {date_str}\nВсего рассылок за день: {len(campaigns)}\n\nДЕТАЛИ ПО РАССЫЛКАМ:\n\n'
@@ -0,0 +1,91 @@
+import asyncio
+import os
+import signal
+import socket
+from typing import Dict
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+import database as crud
+from config import BOT_TOKEN, CAMPAIGN_LEASE_SECONDS, CAMPAIGN_WORKER_CONCURRENCY, CAMPAIGN_WORKER_POLL_SECONDS
+from services import process_mailing, is_within_allowed_time, close_client
+from utils import logger
+from metrics import loop_lag_monitor
+
+WORKER_ID = f'{socket.gethostname()}:{os.getpid()}'
+
+async def _keep_lease(campaign_id: int, mailing: asyncio.Task):
+    while not mailing.done():
+        await asyncio.sleep(CAMPAIGN_LEASE_SECONDS / 3)
+        if not await crud.renew_campaign_lease(campaign_id, WORKER_ID, CAMPAIGN_LEASE_SECONDS):
+            logger.error(f'Аренда рассылки #{campaign_id} потеряна воркером {WORKER_ID}, останавливаем обработку')
+            mailing.cancel()
+            return
+
+async def run_campaign(bot: Bot, campaign_id: int):
+    mailing = None
+    heartbeat = None
+    final_status = None
+    try:
+        plan = await crud.load_campaign_plan(campaign_id)
+        if not plan:
+            logger.error(f'Рассылка #{campaign_id} не найдена или у нее нет шаблона')
+            await crud.update_campaign_status(campaign_id, 'failed')
+            return
+        campaign = await crud.get_campaign(campaign_id)
+        mailing = asyncio.create_task(process_mailing(bot, plan, resume=campaign.started_at is not None))
+        heartbeat = asyncio.create_task(_keep_lease(campaign_id, mailing))
+        await mailing
+    except asyncio.CancelledError:
+        logger.warning(f'Обработка рассылки #{campaign_id} прервана воркером {WORKER_ID}, возвращаем в очередь')
+        final_status = 'queued'
+        if mailing and (not mailing.done()):
+            mailing.cancel()
+        raise
+    except Exception as e:
+        logger.error(f'Ошибка при обработке рассылки #{campaign_id}: {e}', exc_info=True)
+        final_status = 'failed'
+    finally:
+        if heartbeat:
+            heartbeat.cancel()
+        await crud.release_campaign_lease(campaign_id, WORKER_ID, status=final_status)
+
+async def run_worker():
+    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=None))
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    running: Dict[int, asyncio.Task] = {}
+    loop_lag_monitor.start()
+    logger.info(f'Воркер рассылок {WORKER_ID} запущен (параллельно: {CAMPAIGN_WORKER_CONCURRENCY})')
+    try:
+        while not stop.is_set():
+            for campaign_id, task in list(running.items()):
+                if task.done():
+                    del running[campaign_id]
+            campaign_id = None
+            if len(running) < CAMPAIGN_WORKER_CONCURRENCY and is_within_allowed_time():
+                try:
+                    campaign_id = await crud.claim_campaign(WORKER_ID, CAMPAIGN_LEASE_SECONDS)
+                except Exception as e:
+                    logger.error(f'Ошибка при получении рассылки из очереди: {e}', exc_info=True)
+            if campaign_id is not None:
+                logger.info(f'Воркер {WORKER_ID} взял рассылку #{campaign_id}')
+                running[campaign_id] = asyncio.create_task(run_campaign(bot, campaign_id))
+                continue
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=CAMPAIGN_WORKER_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        logger.info(f'Останавливаем воркер {WORKER_ID}, активных рассылок: {len(running)}')
+        loop_lag_monitor.stop()
+        for task in running.values():
+            task.cancel()
+        await asyncio.gather(*running.values(), return_exceptions=True)
+        await close_client()
+        await bot.session.close()
+        await crud.close_db()